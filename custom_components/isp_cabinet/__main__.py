@@ -0,0 +1,219 @@
+"""Command-line runner for ISP connectors.
+
+Runs login and contract retrieval for one or many accounts without Home Assistant and prints results
+as JSON. Example:
+
+    python -m custom_components.isp_cabinet --isp mgts --username user --password secret
+    python -m custom_components.isp_cabinet --accounts accounts.json --concurrency 8 --repeat 5
+"""
+import argparse
+import asyncio
+import getpass
+import json
+import logging
+import socket
+import sys
+import time
+from typing import List, Dict, Any, Optional, Tuple
+
+import aiohttp
+from aiohttp.abc import AbstractResolver
+
+from .supported_isps import ISP_CONNECTORS
+from .supported_isps.parsing import enable_process_pool, disable_process_pool
+from .supported_isps.routing import RoutePool, validate_proxy_url
+from .supported_isps.transfer import get_transfer_stats
+from .supported_isps.batch import BatchAccount, BatchResult, iterate_accounts, \
+    DEFAULT_CONCURRENCY, DEFAULT_CONCURRENCY_PER_HOST
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class _StaticResolver(AbstractResolver):
+    """Resolves selected host names to fixed addresses (e.g. a local mock portal)"""
+
+    def __init__(self, mapping: Dict[str, Tuple[str, Optional[int]]]) -> None:
+        self._mapping = mapping
+        self._default = aiohttp.DefaultResolver()
+
+    async def resolve(self, host: str, port: int = 0, family: int = socket.AF_INET) -> List[Dict[str, Any]]:
+        if host not in self._mapping:
+            return await self._default.resolve(host, port, family)
+
+        address, mapped_port = self._mapping[host]
+        return [{
+            'hostname': host,
+            'host': address,
+            'port': port if mapped_port is None else mapped_port,
+            'family': socket.AF_INET6 if ':' in address else socket.AF_INET,
+            'proto': 0,
+            'flags': socket.AI_NUMERICHOST,
+        }]
+
+    async def close(self) -> None:
+        await self._default.close()
+
+
+def _parse_resolve(values: List[str]) -> Dict[str, Tuple[str, Optional[int]]]:
+    mapping = {}
+    for value in values:
+        parts = value.split(':')
+        if len(parts) not in (2, 3):
+            raise argparse.ArgumentTypeError('Invalid --resolve value "%s", expected HOST:ADDRESS[:PORT]' % value)
+        mapping[parts[0]] = (parts[1], int(parts[2]) if len(parts) == 3 else None)
+    return mapping
+
+
+def _load_accounts(path: str) -> List[BatchAccount]:
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read().strip()
+
+    if content.startswith('['):
+        accounts = json.loads(content)
+    else:
+        # JSON Lines
+        accounts = [json.loads(line) for line in content.splitlines() if line.strip()]
+
+    for account in accounts:
+        for field in ('isp', 'username', 'password'):
+            if field not in account:
+                raise ValueError('Account entry for user "%s" is missing field "%s"'
+                                 % (account.get('username'), field))
+
+    return [
+        BatchAccount(account['isp'], account['username'], account['password'],
+                     validate_proxy_url(account['proxy']) if account.get('proxy') else None)
+        for account in accounts
+    ]
+
+
+def _format_result(result: BatchResult) -> Dict[str, Any]:
+    output: Dict[str, Any] = {
+        'isp': result.account.isp,
+        'username': result.account.username,
+        'success': result.success,
+        'timings': result.timings,
+    }
+
+    if result.success:
+        output['contracts'] = [contract.to_snapshot() for contract in result.contracts.values()]
+    else:
+        output['error'] = '%s: %s' % (result.error.__class__.__name__, result.error)
+
+    return output
+
+
+async def _run(args: argparse.Namespace, accounts: List[BatchAccount]) -> Dict[str, Any]:
+    connector_kwargs: Dict[str, Any] = {
+        'limit': args.concurrency,
+        'limit_per_host': args.concurrency_per_host,
+    }
+    if args.resolve:
+        connector_kwargs['resolver'] = _StaticResolver(args.resolve)
+    if args.insecure:
+        connector_kwargs['ssl'] = False
+
+    http_connector = aiohttp.TCPConnector(**connector_kwargs)
+    route_pool = RoutePool(**connector_kwargs)
+
+    results = []
+    started_at = time.perf_counter()
+    try:
+        async for result in iterate_accounts(
+                [account for _ in range(args.repeat) for account in accounts],
+                concurrency=args.concurrency,
+                concurrency_per_host=args.concurrency_per_host,
+                http_connector=http_connector,
+                requests_per_minute=args.requests_per_minute,
+                proxies=args.proxy,
+                route_pool=route_pool):
+            _LOGGER.info('ISP "%s" account "%s" processed in %.2f seconds (%s)'
+                         % (result.account.isp, result.account.username, result.timings.get('total', 0.0),
+                            'success' if result.success else 'failed'))
+            results.append(_format_result(result))
+    finally:
+        await http_connector.close()
+        await route_pool.close()
+    elapsed = time.perf_counter() - started_at
+
+    succeeded = sum(1 for result in results if result['success'])
+    return {
+        'results': results,
+        'summary': {
+            'runs': len(results),
+            'succeeded': succeeded,
+            'failed': len(results) - succeeded,
+            'elapsed': elapsed,
+            'runs_per_second': len(results) / elapsed if elapsed else None,
+            'transfer': get_transfer_stats(),
+            'routes': route_pool.as_dict(),
+        },
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m custom_components.isp_cabinet',
+        description='Run ISP connectors outside of Home Assistant',
+    )
+    parser.add_argument('--accounts', metavar='FILE',
+                        help='JSON (list) or JSON Lines file with "isp", "username", "password" '
+                             'and optional "proxy" fields')
+    parser.add_argument('--isp', help='ISP identifier (%s)'
+                                      % ', '.join(c.isp_identifiers[0] for c in ISP_CONNECTORS))
+    parser.add_argument('--username')
+    parser.add_argument('--password', help='Password (prompted for if omitted)')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help='Maximum number of accounts processed at once')
+    parser.add_argument('--concurrency-per-host', type=int, default=DEFAULT_CONCURRENCY_PER_HOST,
+                        help='Maximum number of accounts of a single ISP processed at once (per route)')
+    parser.add_argument('--repeat', type=int, default=1, help='Run each account this many times (benchmarking)')
+    parser.add_argument('--requests-per-minute', type=float, default=None,
+                        help='Request budget per ISP host (defaults to connector budgets)')
+    parser.add_argument('--parse-workers', type=int, default=0, metavar='N',
+                        help='Parse large pages in a pool of N processes (0 - parse in place)')
+    parser.add_argument('--resolve', action='append', default=[], metavar='HOST:ADDRESS[:PORT]',
+                        help='Resolve HOST to ADDRESS (and PORT), e.g. to target a local mock portal')
+    parser.add_argument('--proxy', action='append', default=[], type=validate_proxy_url, metavar='URL',
+                        help='Spread accounts across egress routes: HTTP or SOCKS proxy URL, or "direct" '
+                             '(may be repeated; SOCKS proxies require aiohttp_socks)')
+    parser.add_argument('--insecure', action='store_true', help='Disable TLS certificate verification')
+    parser.add_argument('--summary-only', action='store_true', help='Print only the summary')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, stream=sys.stderr)
+
+    args.resolve = _parse_resolve(args.resolve)
+
+    if args.accounts:
+        accounts = _load_accounts(args.accounts)
+    elif args.isp and args.username:
+        password = args.password
+        if password is None:
+            password = getpass.getpass('Password for %s: ' % args.username)
+        accounts = [BatchAccount(args.isp, args.username, password)]
+    else:
+        parser.error('either --accounts or --isp and --username are required')
+        return 2
+
+    if args.parse_workers > 0:
+        enable_process_pool(args.parse_workers)
+
+    try:
+        output = asyncio.run(_run(args, accounts))
+    finally:
+        disable_process_pool()
+
+    failed = output['summary']['failed']
+    if args.summary_only:
+        output = output['summary']
+
+    json.dump(output, sys.stdout, ensure_ascii=False, indent=2, default=str)
+    sys.stdout.write('\n')
+
+    return 0 if failed == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
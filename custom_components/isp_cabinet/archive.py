@@ -0,0 +1,233 @@
+"""Archive of contract snapshots of all accounts"""
+__all__ = [
+    'SnapshotArchive',
+    'ArchiveWriter',
+    'ArchiveRowType',
+    'make_archive_rows',
+]
+
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Optional, Dict, Any, List, Iterable, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # noinspection PyProtectedMember
+    from .supported_isps.base import _ISPContract
+
+_LOGGER = logging.getLogger(__name__)
+
+ArchiveRowType = Tuple[str, str, str, float, Optional[float], Optional[float], Optional[str], Optional[str],
+                       Optional[float], Optional[str], str]
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS contract_snapshots ('
+    'id INTEGER PRIMARY KEY, '
+    'isp TEXT NOT NULL, '
+    'username TEXT NOT NULL, '
+    'contract TEXT NOT NULL, '
+    'fetched_at REAL NOT NULL, '
+    'current_balance REAL, '
+    'payment_required REAL, '
+    'payment_until TEXT, '
+    'tariff TEXT, '
+    'monthly_cost REAL, '
+    'currency TEXT, '
+    'data TEXT NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS ix_contract_snapshots_account '
+    'ON contract_snapshots (isp, username, fetched_at)',
+    'CREATE INDEX IF NOT EXISTS ix_contract_snapshots_isp ON contract_snapshots (isp, fetched_at)',
+    'CREATE INDEX IF NOT EXISTS ix_contract_snapshots_time ON contract_snapshots (fetched_at)',
+    # Latest snapshot of every contract, the usual starting point of reporting queries; maintained on write,
+    # so that reports do not aggregate the whole history
+    'CREATE TABLE IF NOT EXISTS latest_contract_snapshots ('
+    'isp TEXT NOT NULL, '
+    'username TEXT NOT NULL, '
+    'contract TEXT NOT NULL, '
+    'fetched_at REAL NOT NULL, '
+    'current_balance REAL, '
+    'payment_required REAL, '
+    'payment_until TEXT, '
+    'tariff TEXT, '
+    'monthly_cost REAL, '
+    'currency TEXT, '
+    'data TEXT NOT NULL, '
+    'PRIMARY KEY (isp, username, contract))',
+)
+
+_COLUMNS = 'isp, username, contract, fetched_at, current_balance, payment_required, payment_until, tariff, ' \
+           'monthly_cost, currency, data'
+
+_INSERT = 'INSERT INTO contract_snapshots (%s) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)' % _COLUMNS
+
+_UPDATE_LATEST = 'INSERT OR REPLACE INTO latest_contract_snapshots (%s) ' \
+                 'SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ? WHERE NOT EXISTS (' \
+                 'SELECT 1 FROM latest_contract_snapshots ' \
+                 'WHERE isp = ?1 AND username = ?2 AND contract = ?3 AND fetched_at > ?4)' % _COLUMNS
+
+
+def make_archive_rows(isp_identifier: str, username: str, contracts: Iterable['_ISPContract'],
+                      fetched_at: Optional[float] = None) -> List[ArchiveRowType]:
+    """
+    Формирование строк архива из контрактов.
+    :param isp_identifier: Идентификатор провайдера
+    :param username: Имя пользователя
+    :param contracts: Контракты (значения копируются, контракты могут измениться позднее)
+    :param fetched_at: UNIX timestamp (по умолчанию - текущее время)
+    :return: Строки
+    """
+    from .supported_isps.changes import get_contract_state
+
+    if fetched_at is None:
+        fetched_at = time.time()
+
+    rows = []
+    for contract in contracts:
+        state = get_contract_state(contract)
+        snapshot = contract.to_snapshot()
+        # History is archived row by row, repeating it in every row only bloats the database
+        snapshot.pop('balance_history', None)
+
+        payment_until = state['payment_until']
+        rows.append((
+            isp_identifier,
+            username,
+            contract.code,
+            fetched_at,
+            state['current_balance'],
+            state['payment_required'],
+            None if payment_until is None else payment_until.isoformat(),
+            state['tariff'],
+            state['monthly_cost'],
+            contract.currency,
+            json.dumps(snapshot, ensure_ascii=False),
+        ))
+
+    return rows
+
+
+class SnapshotArchive:
+    """Архив снимков контрактов в SQLite; методы блокирующие и должны выполняться в пуле потоков"""
+
+    def __init__(self, path: str, timeout: float = 10.0) -> None:
+        self._path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            for statement in _SCHEMA:
+                self._connection.execute(statement)
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def write(self, rows: List[ArchiveRowType]) -> None:
+        """Добавление строк одной транзакцией"""
+        if not rows:
+            return
+
+        with self._lock, self._connection:
+            self._connection.executemany(_INSERT, rows)
+            self._connection.executemany(_UPDATE_LATEST, rows)
+
+    def query(self, sql: str, parameters: Iterable[Any] = ()) -> List[Dict[str, Any]]:
+        with self._lock:
+            cursor = self._connection.execute(sql, tuple(parameters))
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def get_latest(self, isp_identifier: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Последние снимки всех контрактов (или контрактов одного провайдера)"""
+        sql = 'SELECT isp, username, contract, fetched_at, current_balance, payment_required, payment_until, ' \
+              'tariff, monthly_cost, currency FROM latest_contract_snapshots'
+        if isp_identifier is None:
+            return self.query(sql)
+        return self.query(sql + ' WHERE isp = ?', (isp_identifier,))
+
+    def get_underfunded(self) -> List[Dict[str, Any]]:
+        """Контракты, баланс которых не покрывает ежемесячную стоимость"""
+        return self.query(
+            'SELECT isp, username, contract, fetched_at, current_balance, monthly_cost, payment_until '
+            'FROM latest_contract_snapshots WHERE current_balance < monthly_cost '
+            'ORDER BY current_balance - monthly_cost'
+        )
+
+    def get_balance_history(self, isp_identifier: str, username: str,
+                            since: Optional[float] = None) -> List[Tuple[float, Optional[float]]]:
+        sql = 'SELECT fetched_at, current_balance FROM contract_snapshots WHERE isp = ? AND username = ?'
+        parameters: List[Any] = [isp_identifier, username]
+        if since is not None:
+            sql += ' AND fetched_at >= ?'
+            parameters.append(since)
+
+        return [(row['fetched_at'], row['current_balance']) for row in self.query(sql + ' ORDER BY fetched_at',
+                                                                                  parameters)]
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class ArchiveWriter:
+    """Накопление строк циклов обновления и их пакетная запись в архив в пуле потоков"""
+
+    def __init__(self, archive: SnapshotArchive, loop: asyncio.AbstractEventLoop,
+                 flush_delay: float = 10.0, max_pending: int = 500) -> None:
+        self._archive = archive
+        self._loop = loop
+        self._flush_delay = flush_delay
+        self._max_pending = max_pending
+
+        self._pending: List[ArchiveRowType] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task] = None
+
+    @property
+    def archive(self) -> SnapshotArchive:
+        return self._archive
+
+    def add(self, rows: List[ArchiveRowType]) -> None:
+        """Постановка строк в очередь записи (вызывается из цикла событий)"""
+        self._pending.extend(rows)
+
+        if len(self._pending) >= self._max_pending:
+            self._schedule_flush(0.0)
+        elif self._flush_handle is None:
+            self._schedule_flush(self._flush_delay)
+
+    def _schedule_flush(self, delay: float) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        self._flush_handle = self._loop.call_later(delay, self._start_flush)
+
+    def _start_flush(self) -> None:
+        self._flush_handle = None
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = self._loop.create_task(self.async_flush())
+
+    async def async_flush(self) -> None:
+        while self._pending:
+            rows, self._pending = self._pending, []
+            try:
+                await self._loop.run_in_executor(None, self._archive.write, rows)
+
+            except sqlite3.Error as e:
+                _LOGGER.warning('Could not write %d snapshots to archive "%s": %s'
+                                % (len(rows), self._archive.path, e))
+                return
+
+    async def async_close(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        if self._flush_task is not None and not self._flush_task.done():
+            await self._flush_task
+
+        await self.async_flush()
+        await self._loop.run_in_executor(None, self._archive.close)
@@ -1,11 +1,16 @@
-from typing import Optional, Dict, Union, Tuple
+import asyncio
+from typing import Optional, Dict, Union, Tuple, Any
 
 import logging
+import time
 
+import aiohttp
 from homeassistant import config_entries
 from homeassistant.const import CONF_USERNAME, CONF_PASSWORD
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
 
-from .const import CONF_ISP, DOMAIN
+from .const import CONF_ISP, DOMAIN, DATA_PENDING_CONNECTORS, DATA_IP_API_CACHE, IP_API_URL, IP_API_TIMEOUT, \
+    IP_API_CACHE_TTL, IP_API_FORM_WAIT, DATA_IP_API_TASK, IP_API_LOOKUP
 from .errors import AuthenticationError, InvalidServerResponseError, ISPCabinetException
 
 _LOGGER = logging.getLogger(__name__)
@@ -32,14 +37,52 @@ class ISPCabinetFlowHandler(config_entries.ConfigFlow):
         if key is None:
             return bool(current_entries)
 
-        isp_identifier, username = key
+        from .supported_isps import get_account_key
+
+        account_key = get_account_key(*key)
 
         for config_entry in current_entries:
-            if config_entry.data[CONF_ISP] == isp_identifier and config_entry.data[CONF_USERNAME] == username:
+            if get_account_key(config_entry.data[CONF_ISP], config_entry.data[CONF_USERNAME]) == account_key:
                 return True
 
         return False
 
+    async def _async_fetch_ip_api_data(self) -> Optional[Dict[str, Any]]:
+        ip_api_data = None
+        try:
+            session = async_get_clientsession(self.hass)
+            async with session.get(IP_API_URL, timeout=aiohttp.ClientTimeout(total=IP_API_TIMEOUT)) as request:
+                ip_api_data = await request.json()
+
+            if not isinstance(ip_api_data, dict) or ip_api_data.get('status') != 'success':
+                ip_api_data = None
+
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            _LOGGER.debug('Could not retrieve data from IP API, skipping ISP detection')
+
+        finally:
+            self.hass.data.pop(DATA_IP_API_TASK, None)
+
+        # Failed lookups are cached as well to keep the form from stalling on every display
+        self.hass.data[DATA_IP_API_CACHE] = (time.monotonic(), ip_api_data)
+        return ip_api_data
+
+    async def _async_get_ip_api_data(self) -> Optional[Dict[str, Any]]:
+        cached = self.hass.data.get(DATA_IP_API_CACHE)
+        if cached is not None and time.monotonic() - cached[0] < IP_API_CACHE_TTL.total_seconds():
+            return cached[1]
+
+        # Lookup is shared between flows and outlives the wait below
+        task = self.hass.data.get(DATA_IP_API_TASK)
+        if task is None:
+            task = self.hass.data[DATA_IP_API_TASK] = self.hass.async_create_task(self._async_fetch_ip_api_data())
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), IP_API_FORM_WAIT)
+        except asyncio.TimeoutError:
+            _LOGGER.debug('IP API lookup is taking too long, showing form without detected ISP')
+            return None
+
     async def _show_user_form(self, errors: Optional[Dict[str, str]] = None,
                               placeholders: Optional[Dict[str, Union[str, int, float]]] = None):
         if self._schema_user is None:
@@ -47,21 +90,20 @@ class ISPCabinetFlowHandler(config_entries.ConfigFlow):
             from collections import OrderedDict
 
             from .supported_isps import ISP_CONNECTORS
+            from .supported_isps.detection import get_isp_index
 
             default_isp = None
 
-            if not self._check_entry_exists():
-                from aiohttp import ClientSession
+            ip_api_data = None
+            if IP_API_LOOKUP and not self._check_entry_exists():
+                ip_api_data = await self._async_get_ip_api_data()
 
-                async with ClientSession() as session:
-                    async with session.get('http://ip-api.com/json/') as request:
-                        ip_api_data = await request.json()
-
-                for connector in ISP_CONNECTORS:
-                    if connector.ip_api_belongs(ip_api_data):
-                        _LOGGER.debug('Detected current ISP automatically: %s' % connector.isp_title)
-                        default_isp = connector.isp_identifiers[0]
-                        break
+            if ip_api_data:
+                # Matching is done against local index; lookup only supplies address, ASN and organization
+                connector = get_isp_index().detect_from_ip_api(ip_api_data)
+                if connector is not None:
+                    _LOGGER.debug('Detected current ISP automatically: %s' % connector.isp_title)
+                    default_isp = connector.isp_identifiers[0]
 
             schema_user = OrderedDict()
             schema_user[vol.Required(CONF_ISP, default=default_isp)] = vol.In({
@@ -90,14 +132,9 @@ class ISPCabinetFlowHandler(config_entries.ConfigFlow):
         if self._check_entry_exists(key):
             return self.async_abort("already_exists")
 
-        from .supported_isps import ISP_CONNECTORS
-
-        target_connector = None
-        for connector in ISP_CONNECTORS:
-            if isp_identifier in connector.isp_identifiers:
-                target_connector = connector
-                break
+        from .supported_isps import get_connector_class, get_account_key
 
+        target_connector = get_connector_class(isp_identifier)
         if target_connector is None:
             return self.async_abort("isp_not_supported")
 
@@ -114,6 +151,9 @@ class ISPCabinetFlowHandler(config_entries.ConfigFlow):
         except ISPCabinetException:
             return self.async_abort("unknown_error")
 
+        # Hand authenticated connector over to entry setup to avoid logging in twice
+        self.hass.data.setdefault(DATA_PENDING_CONNECTORS, {})[get_account_key(*key)] = (time.monotonic(), api)
+
         return self.async_create_entry(title=target_connector.isp_title + ": " + username, data=user_input)
 
     async def async_step_import(self, user_input=None):
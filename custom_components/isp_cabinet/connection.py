@@ -0,0 +1,130 @@
+"""Resources shared by ISP connectors and coordinators of all entries"""
+import os
+import uuid
+from typing import TYPE_CHECKING
+
+import aiohttp
+from homeassistant.const import EVENT_HOMEASSISTANT_CLOSE, EVENT_HOMEASSISTANT_STOP
+from homeassistant.core import callback, Event
+from homeassistant.helpers.storage import Store
+from homeassistant.helpers.typing import HomeAssistantType
+
+from .const import DATA_HTTP_CONNECTOR, DATA_ROUTE_POOL, CONNECTION_KEEPALIVE_TIMEOUT, DATA_LEASE_BACKENDS, \
+    DATA_LEASE_HOLDER, STORAGE_VERSION, STORAGE_KEY_INSTANCE, DATA_ARCHIVES, ARCHIVE_FLUSH_DELAY
+
+if TYPE_CHECKING:
+    from .archive import ArchiveWriter
+    from .leasing import LeaseBackend
+    from .supported_isps.routing import RoutePool
+
+
+@callback
+def async_get_http_connector(hass: HomeAssistantType) -> aiohttp.BaseConnector:
+    """
+    Получение общего для всех коннекторов пула соединений.
+
+    Соединения переживают сессии коннекторов, поэтому могут быть установлены заранее, до обновлений.
+    """
+    http_connector = hass.data.get(DATA_HTTP_CONNECTOR)
+    if http_connector is None:
+        http_connector = aiohttp.TCPConnector(keepalive_timeout=CONNECTION_KEEPALIVE_TIMEOUT.total_seconds())
+        hass.data[DATA_HTTP_CONNECTOR] = http_connector
+
+        async def _async_close_http_connector(_: Event) -> None:
+            hass.data.pop(DATA_HTTP_CONNECTOR, None)
+            await http_connector.close()
+
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_CLOSE, _async_close_http_connector)
+
+    return http_connector
+
+
+@callback
+def async_get_route_pool(hass: HomeAssistantType) -> 'RoutePool':
+    """Получение маршрутов для учётных записей с прокси-серверами (у каждого маршрута свой пул соединений)"""
+    route_pool = hass.data.get(DATA_ROUTE_POOL)
+    if route_pool is None:
+        from .supported_isps.routing import RoutePool
+
+        route_pool = RoutePool(keepalive_timeout=CONNECTION_KEEPALIVE_TIMEOUT.total_seconds())
+        hass.data[DATA_ROUTE_POOL] = route_pool
+
+        async def _async_close_route_pool(_: Event) -> None:
+            hass.data.pop(DATA_ROUTE_POOL, None)
+            await route_pool.close()
+
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_CLOSE, _async_close_route_pool)
+
+    return route_pool
+
+
+async def async_get_lease_backend(hass: HomeAssistantType, url: str) -> 'LeaseBackend':
+    """
+    Получение хранилища аренд, общего для учётных записей с одинаковым расположением.
+
+    Пути без схемы указывают на базы данных SQLite; относительные пути отсчитываются от каталога конфигурации.
+    """
+    from .leasing import create_lease_backend
+
+    lease_backends = hass.data.get(DATA_LEASE_BACKENDS)
+    if lease_backends is None:
+        lease_backends = hass.data[DATA_LEASE_BACKENDS] = {}
+
+        async def _async_close_lease_backends(_: Event) -> None:
+            for backend in hass.data.pop(DATA_LEASE_BACKENDS, {}).values():
+                await hass.async_add_executor_job(backend.close)
+
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_CLOSE, _async_close_lease_backends)
+
+    if '://' not in url and not os.path.isabs(url):
+        url = hass.config.path(url)
+
+    lease_backend = lease_backends.get(url)
+    if lease_backend is None:
+        lease_backend = await hass.async_add_executor_job(create_lease_backend, url)
+        lease_backends[url] = lease_backend
+
+    return lease_backend
+
+
+async def async_get_lease_holder(hass: HomeAssistantType) -> str:
+    """Получение идентификатора экземпляра (сохраняется между перезапусками, чтобы удерживаемые аренды узнавались)"""
+    lease_holder = hass.data.get(DATA_LEASE_HOLDER)
+    if lease_holder is None:
+        store = Store(hass, STORAGE_VERSION, STORAGE_KEY_INSTANCE)
+        stored_data = await store.async_load()
+
+        if stored_data and stored_data.get('id'):
+            lease_holder = stored_data['id']
+        else:
+            lease_holder = uuid.uuid4().hex
+            await store.async_save({'id': lease_holder})
+
+        hass.data[DATA_LEASE_HOLDER] = lease_holder
+
+    return lease_holder
+
+
+async def async_get_archive_writer(hass: HomeAssistantType, path: str) -> 'ArchiveWriter':
+    """Получение записи в архив снимков, общей для учётных записей с одной базой данных"""
+    from .archive import SnapshotArchive, ArchiveWriter
+
+    archives = hass.data.get(DATA_ARCHIVES)
+    if archives is None:
+        archives = hass.data[DATA_ARCHIVES] = {}
+
+        async def _async_close_archives(_: Event) -> None:
+            for writer in hass.data.pop(DATA_ARCHIVES, {}).values():
+                await writer.async_close()
+
+        # Pending snapshots are written while executor is still available
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, _async_close_archives)
+
+    path = hass.config.path(path)
+
+    writer = archives.get(path)
+    if writer is None:
+        archive = await hass.async_add_executor_job(SnapshotArchive, path)
+        writer = archives[path] = ArchiveWriter(archive, hass.loop, ARCHIVE_FLUSH_DELAY.total_seconds())
+
+    return writer
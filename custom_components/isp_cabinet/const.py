@@ -1,6 +1,75 @@
 """Constants"""
+from datetime import timedelta
 
 DOMAIN = "isp_cabinet"
 DATA_CONFIG = DOMAIN + "_config"
+DATA_PENDING_CONNECTORS = DOMAIN + "_pending_connectors"
+DATA_IP_API_CACHE = DOMAIN + "_ip_api_cache"
+DATA_IP_API_TASK = DOMAIN + "_ip_api_task"
+DATA_HTTP_CONNECTOR = DOMAIN + "_http_connector"
+DATA_ROUTE_POOL = DOMAIN + "_route_pool"
+DATA_LEASE_BACKENDS = DOMAIN + "_lease_backends"
+DATA_LEASE_HOLDER = DOMAIN + "_lease_holder"
+DATA_ARCHIVES = DOMAIN + "_archives"
+DATA_LOOP_MONITOR = DOMAIN + "_loop_monitor"
 
 CONF_ISP = "isp"
+CONF_REFRESH_COOLDOWN = "refresh_cooldown"
+CONF_REQUESTS_PER_MINUTE = "requests_per_minute"
+CONF_MEMORY_PROFILING = "memory_profiling"
+CONF_PROXY = "proxy"
+CONF_LEASE = "lease"
+CONF_ARCHIVE = "archive"
+
+DEFAULT_REFRESH_COOLDOWN = timedelta(seconds=60)
+
+# Authenticated connector left by config flow is reused by entry setup within this period
+PENDING_CONNECTOR_TTL = timedelta(minutes=5)
+# Sessions younger than this are reused instead of logging in again (when expiration can not be estimated)
+SESSION_REUSE_TTL = timedelta(minutes=5)
+# Sessions estimated to expire sooner than this are not reused
+SESSION_EXPIRY_MARGIN = timedelta(seconds=30)
+# Sessions are renewed in background this long before the next scheduled update
+SESSION_RENEWAL_LEAD = timedelta(seconds=60)
+# Connections to ISP hosts are opened this long before the next scheduled update
+CONNECTION_PREWARM_LEAD = timedelta(seconds=5)
+# Idle connections in the shared pool are kept open at least until the update starts
+CONNECTION_KEEPALIVE_TIMEOUT = timedelta(seconds=30)
+
+# Poll leases outlive update interval by this, so that the holder renews them before others may take over
+LEASE_GRACE = timedelta(minutes=1)
+
+# Snapshots are written to archive in batches collected over this period
+ARCHIVE_FLUSH_DELAY = timedelta(seconds=10)
+
+# Scheduled updates are deferred while event loop lags behind by more than this
+LOOP_LAG_THRESHOLD = timedelta(milliseconds=100)
+LOOP_LAG_CHECK_INTERVAL = timedelta(seconds=1)
+# Deferred updates re-check loop lag after a random delay within this range
+LOOP_LAG_STAGGER = (timedelta(seconds=5), timedelta(seconds=30))
+# Scheduled updates are never deferred longer than this
+LOOP_LAG_MAX_DEFERRAL = timedelta(minutes=5)
+
+# Whether the config flow looks up the external address to preselect current ISP; False - ISP is selected manually
+IP_API_LOOKUP = True
+IP_API_URL = "http://ip-api.com/json/"
+IP_API_TIMEOUT = 3
+IP_API_CACHE_TTL = timedelta(hours=1)
+# Time the user form waits for the lookup; slower lookups complete in background for the next display
+IP_API_FORM_WAIT = 1
+
+SERVICE_REFRESH = "refresh"
+SERVICE_PROFILE = "profile"
+SERVICE_DIAGNOSTICS = "diagnostics"
+
+# Profiles of update cycles are written to configuration directory as `<prefix>.pstats` and `<prefix>.collapsed`
+PROFILE_FILE_PREFIX = DOMAIN + "_profile_%s_%s"
+DEFAULT_PROFILE_CYCLES = 1
+MAX_PROFILE_CYCLES = 20
+
+# Fired with changed values only when consecutive contract snapshots differ
+EVENT_CONTRACT_CHANGED = DOMAIN + "_contract_changed"
+
+STORAGE_VERSION = 1
+STORAGE_KEY_SNAPSHOT = DOMAIN + "_snapshot_%s"
+STORAGE_KEY_INSTANCE = DOMAIN + "_instance"
@@ -0,0 +1,593 @@
+"""ISP account data update coordinator"""
+import asyncio
+import logging
+import sqlite3
+from datetime import timedelta, datetime
+from typing import Callable, Optional, Dict, TYPE_CHECKING, Tuple, Set, Any
+
+import aiohttp
+from homeassistant.core import callback
+from homeassistant.helpers.debounce import Debouncer
+from homeassistant.helpers.event import async_call_later
+from homeassistant.helpers.storage import Store
+from homeassistant.helpers.typing import HomeAssistantType
+from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
+from homeassistant.util import dt, slugify
+
+from .const import DEFAULT_REFRESH_COOLDOWN, STORAGE_VERSION, STORAGE_KEY_SNAPSHOT, SESSION_REUSE_TTL, \
+    SESSION_EXPIRY_MARGIN, SESSION_RENEWAL_LEAD, CONNECTION_PREWARM_LEAD, LOOP_LAG_MAX_DEFERRAL, \
+    EVENT_CONTRACT_CHANGED, LEASE_GRACE, PROFILE_FILE_PREFIX
+from .errors import ISPCabinetException, CircuitBreakerOpenError, AuthenticationRequiredError
+from .archive import ArchiveWriter, make_archive_rows
+from .leasing import LeaseBackend
+from .loop_monitor import async_get_loop_monitor
+from .memory import MemoryProfiler
+from .profiling import UpdateProfiler
+from .retry import async_call_with_retry, get_circuit_breaker, classify_error, ErrorClass, DEFAULT_RETRY_POLICY
+
+if TYPE_CHECKING:
+    # noinspection PyProtectedMember
+    from .supported_isps.base import _ISPConnector, _ISPContract
+    from .supported_isps.changes import ContractStateType
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class ISPCabinetCoordinator(DataUpdateCoordinator):
+    """Получение всех контрактов учётной записи один раз за цикл и передача их подписчикам"""
+
+    data: Optional[Dict[str, '_ISPContract']]
+
+    def __init__(self, hass: HomeAssistantType, connector: '_ISPConnector',
+                 key: Tuple[str, str], owner_key: Tuple[str, str], update_interval: timedelta,
+                 refresh_cooldown: timedelta = DEFAULT_REFRESH_COOLDOWN, memory_profiling: bool = False,
+                 lease_backend: Optional[LeaseBackend] = None, lease_holder: Optional[str] = None,
+                 archive_writer: Optional[ArchiveWriter] = None) -> None:
+        super().__init__(
+            hass, _LOGGER,
+            name='ISP "%s" for user "%s"' % key,
+            update_interval=update_interval,
+            request_refresh_debouncer=Debouncer(
+                hass, _LOGGER,
+                cooldown=refresh_cooldown.total_seconds(),
+                immediate=True,
+            ),
+        )
+
+        self._connector = connector
+        self._key = key
+        self._owner_key = owner_key
+        self._config_keys: Set[Tuple[str, str]] = {owner_key}
+        self._breaker = get_circuit_breaker(connector)
+        self._store = Store(hass, STORAGE_VERSION, STORAGE_KEY_SNAPSHOT % slugify('_'.join(key)))
+
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._metadata_task: Optional[asyncio.Task] = None
+        self._cancel_follow_up: Optional[Callable[[], None]] = None
+        self._cancel_session_renewal: Optional[Callable[[], None]] = None
+        self._cancel_prewarm: Optional[Callable[[], None]] = None
+        self._session_lock = asyncio.Lock()
+        self._loop_monitor = async_get_loop_monitor(hass)
+        self._refresh_started_at: Optional[float] = None
+        self._stopped = False
+        self._lease_backend = lease_backend
+        self._lease_holder = lease_holder
+        self._lease_key = '%s/%s' % key
+        self._lease_held = False
+        self._archive_writer = archive_writer
+
+        # States of contracts after the last update (None - nothing to compare with yet)
+        self._contract_states: Optional[Dict[str, 'ContractStateType']] = None
+
+        self.entity_ids: Set[str] = set()
+
+        self.memory_profiler: Optional[MemoryProfiler] = None
+        if memory_profiling:
+            self.memory_profiler = MemoryProfiler('ISP "%s" for user "%s"' % key)
+            self.memory_profiler.enable()
+
+        # Profiler of the next update cycles requested via service (None - not profiling)
+        self.update_profiler: Optional[UpdateProfiler] = None
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return self._key
+
+    @property
+    def owner_key(self) -> Tuple[str, str]:
+        """Ключ конфигурации записи, платформе которой принадлежат созданные объекты"""
+        return self._owner_key
+
+    @property
+    def config_keys(self) -> Set[Tuple[str, str]]:
+        """Ключи конфигурации всех записей, использующих учётную запись"""
+        return self._config_keys
+
+    @property
+    def connector(self) -> '_ISPConnector':
+        return self._connector
+
+    async def async_refresh(self) -> None:
+        """Выполнение обновления (с присоединением к уже выполняющемуся, если оно есть)"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_started_at = self.hass.loop.time()
+            self._refresh_task = self.hass.async_create_task(super().async_refresh())
+
+        await asyncio.shield(self._refresh_task)
+
+    async def async_restore(self) -> None:
+        """Загрузка контрактов из последнего сохранённого снимка без обращения к провайдеру"""
+        stored_data = await self._store.async_load()
+        if not stored_data:
+            return
+
+        try:
+            self._connector.metadata.load_snapshot(stored_data.get('metadata') or {})
+            contracts = self._connector.restore_contracts(stored_data['contracts'])
+
+        except (KeyError, TypeError, ValueError):
+            _LOGGER.warning('Could not restore snapshot for ISP "%s" and user "%s", discarding' % self._key)
+            return
+
+        if contracts:
+            _LOGGER.debug('Restored %d contracts for ISP "%s" and user "%s" from snapshot taken at %s'
+                          % (len(contracts), *self._key, stored_data.get('saved_at')))
+            self.data = contracts
+            self.last_update_success = True
+            self._contract_states = self._get_contract_states(contracts)
+
+    def _get_snapshot(self, contracts: Dict[str, '_ISPContract']) -> Dict[str, Any]:
+        return {
+            'saved_at': dt.utcnow().isoformat(),
+            'contracts': [contract.to_snapshot() for contract in contracts.values()],
+            'metadata': self._connector.metadata.to_snapshot(),
+        }
+
+    async def _async_save_snapshot(self, contracts: Dict[str, '_ISPContract'],
+                                   snapshot: Optional[Dict[str, Any]] = None) -> None:
+        await self._store.async_save(self._get_snapshot(contracts) if snapshot is None else snapshot)
+
+    @property
+    def lease_held(self) -> Optional[bool]:
+        """Опрашивает ли учётную запись данный экземпляр (None - аренда не настроена)"""
+        if self._lease_backend is None:
+            return None
+        return self._lease_held
+
+    async def _async_acquire_lease(self) -> bool:
+        duration = (self.update_interval + LEASE_GRACE).total_seconds()
+        try:
+            acquired = await self.hass.async_add_executor_job(
+                self._lease_backend.acquire, self._lease_key, self._lease_holder, duration
+            )
+
+        except (sqlite3.Error, OSError) as e:
+            # Duplicate polling is preferred over no data at all
+            _LOGGER.warning('Could not acquire poll lease for ISP "%s" and user "%s", polling anyway: %s'
+                            % (*self._key, e))
+            return True
+
+        if acquired != self._lease_held:
+            _LOGGER.debug('Poll lease for ISP "%s" and user "%s" %s'
+                          % (*self._key, 'acquired' if acquired else 'is held by another instance'))
+        self._lease_held = acquired
+        return acquired
+
+    async def _async_publish_snapshot(self, snapshot: Dict[str, Any]) -> None:
+        try:
+            await self.hass.async_add_executor_job(
+                self._lease_backend.publish, self._lease_key, self._lease_holder, snapshot
+            )
+
+        except (sqlite3.Error, OSError, TypeError, ValueError) as e:
+            _LOGGER.warning('Could not publish snapshot for ISP "%s" and user "%s": %s' % (*self._key, e))
+
+    async def _async_consume_published_snapshot(self) -> Dict[str, '_ISPContract']:
+        """Получение контрактов из снимка, опубликованного экземпляром, удерживающим аренду"""
+        try:
+            published = await self.hass.async_add_executor_job(self._lease_backend.get_snapshot, self._lease_key)
+
+        except (sqlite3.Error, OSError, ValueError) as e:
+            raise UpdateFailed('Could not read published snapshot: %s' % e) from None
+
+        if published is None:
+            raise UpdateFailed('ISP "%s" for user "%s" is polled by another instance, no snapshot published yet'
+                               % self._key)
+
+        published_at, snapshot = published
+        try:
+            self._connector.metadata.load_snapshot(snapshot.get('metadata') or {})
+            contracts = self._connector.restore_contracts(snapshot['contracts'])
+
+        except (KeyError, TypeError, ValueError):
+            raise UpdateFailed('Published snapshot for ISP "%s" and user "%s" is invalid' % self._key) from None
+
+        _LOGGER.debug('ISP "%s" for user "%s" is polled by another instance, using snapshot published at %s'
+                      % (*self._key, dt.utc_from_timestamp(published_at)))
+
+        try:
+            await self._async_save_snapshot(contracts, snapshot)
+
+        except (TypeError, ValueError, OSError):
+            _LOGGER.exception('Could not save snapshot for ISP "%s" and user "%s":' % self._key)
+
+        self._async_fire_contract_changes(contracts)
+        return contracts
+
+    @staticmethod
+    def _get_contract_states(contracts: Dict[str, '_ISPContract']) -> Dict[str, 'ContractStateType']:
+        from .supported_isps.changes import get_contract_state
+
+        return {code: get_contract_state(contract) for code, contract in contracts.items()}
+
+    @callback
+    def _async_fire_contract_changes(self, contracts: Dict[str, '_ISPContract']) -> None:
+        """Отправка событий для контрактов, изменившихся с предыдущего обновления"""
+        from .supported_isps.changes import diff_contract_states
+
+        old_states = self._contract_states
+        new_states = self._get_contract_states(contracts)
+        self._contract_states = new_states
+
+        if old_states is None:
+            return
+
+        isp_identifier, username = self._key
+        for code in old_states.keys() | new_states.keys():
+            if code not in old_states:
+                changes = {'added': True}
+            elif code not in new_states:
+                changes = {'removed': True}
+            else:
+                changes = diff_contract_states(old_states[code], new_states[code])
+                if not changes:
+                    continue
+
+            _LOGGER.debug('Contract "%s" of ISP "%s" for user "%s" changed: %s'
+                          % (code, isp_identifier, username, ', '.join(changes)))
+
+            self.hass.bus.async_fire(EVENT_CONTRACT_CHANGED, {
+                'isp': isp_identifier,
+                'username': username,
+                'contract': code,
+                'changes': changes,
+            })
+
+    async def _async_deferred_refresh(self) -> None:
+        """Выполнение несрочного обновления (откладывается, пока цикл событий загружен)"""
+        waiting_since = self.hass.loop.time()
+
+        waited = await self._loop_monitor.async_wait_idle(LOOP_LAG_MAX_DEFERRAL.total_seconds())
+        if waited >= 1.0:
+            _LOGGER.debug('Update for ISP "%s" and user "%s" deferred by %d seconds due to event loop lag'
+                          % (*self._key, waited))
+
+        if self._stopped:
+            return
+
+        if self._refresh_started_at is not None and self._refresh_started_at >= waiting_since:
+            # Another update (e.g. requested manually) has started meanwhile
+            return
+
+        await self.async_refresh()
+
+    async def _handle_refresh_interval(self, _now: datetime) -> None:
+        self._unsub_refresh = None
+        await self._async_deferred_refresh()
+
+    @callback
+    def async_start(self) -> None:
+        # First update runs in background to avoid blocking setup
+        self.hass.async_create_task(self._async_deferred_refresh())
+
+    @callback
+    def async_stop(self) -> None:
+        self._stopped = True
+
+        if self._unsub_refresh is not None:
+            self._unsub_refresh()
+            self._unsub_refresh = None
+
+        if self._cancel_follow_up is not None:
+            self._cancel_follow_up()
+            self._cancel_follow_up = None
+
+        if self._cancel_session_renewal is not None:
+            self._cancel_session_renewal()
+            self._cancel_session_renewal = None
+
+        if self._cancel_prewarm is not None:
+            self._cancel_prewarm()
+            self._cancel_prewarm = None
+
+        self._debounced_refresh.async_cancel()
+
+        for task in (self._refresh_task, self._metadata_task):
+            if task is not None and not task.done():
+                task.cancel()
+
+        if self.memory_profiler is not None:
+            self.memory_profiler.disable()
+
+        # Cycles profiled so far are discarded along with the coordinator
+        self.update_profiler = None
+
+        if self._lease_held:
+            # Let other instances take over without waiting for the lease to expire
+            self._lease_held = False
+            self.hass.async_add_executor_job(self._lease_backend.release, self._lease_key, self._lease_holder)
+
+    def _can_reuse_session(self) -> bool:
+        connector = self._connector
+
+        session_age = connector.session_age
+        if session_age is None:
+            return False
+
+        # Expiration estimated from cookies and sessions previously observed to expire
+        expires_in = connector.session_expires_in
+        if expires_in is not None:
+            return expires_in > SESSION_EXPIRY_MARGIN.total_seconds()
+
+        return session_age < SESSION_REUSE_TTL.total_seconds()
+
+    async def _async_fetch_contracts(self) -> Dict[str, '_ISPContract']:
+        connector = self._connector
+
+        async with self._session_lock:
+            # Perform authorization routine (valid sessions are reused)
+            reuse_session = self._can_reuse_session()
+
+            if not reuse_session:
+                if connector.is_logged_in:
+                    await connector.logout()
+
+                await connector.login()
+
+            try:
+                contracts = await connector.get_contracts()
+
+            except BaseException as e:
+                if reuse_session:
+                    error_class = classify_error(e)
+                    if error_class in (ErrorClass.SESSION, ErrorClass.AUTHENTICATION):
+                        connector.record_session_expired()
+
+                    # Do not trust reused session for subsequent attempts
+                    await connector.logout()
+
+                    if error_class == ErrorClass.AUTHENTICATION:
+                        # Credentials were accepted before, log in again instead of giving up
+                        raise AuthenticationRequiredError(connector) from e
+                raise
+
+            if reuse_session:
+                connector.record_session_valid()
+
+            return contracts
+
+    @callback
+    def _async_schedule_session_renewal(self) -> None:
+        """Повторная авторизация незадолго до следующего обновления, чтобы оно выполнялось в действующей сессии"""
+        if self._cancel_session_renewal is not None:
+            self._cancel_session_renewal()
+            self._cancel_session_renewal = None
+
+        update_interval = self.update_interval.total_seconds()
+        expires_in = self._connector.session_expires_in
+        if expires_in is not None and expires_in > update_interval + SESSION_EXPIRY_MARGIN.total_seconds():
+            # Current session outlives the next update
+            return
+
+        renewal_delay = update_interval - SESSION_RENEWAL_LEAD.total_seconds()
+        if renewal_delay <= 0:
+            return
+
+        async def _async_renew_session(*_) -> None:
+            self._cancel_session_renewal = None
+            await self._async_renew_session()
+
+        self._cancel_session_renewal = async_call_later(self.hass, renewal_delay, _async_renew_session)
+
+    @callback
+    def _async_schedule_prewarm(self) -> None:
+        """Установка соединений с узлами провайдера незадолго до следующего обновления"""
+        if self._cancel_prewarm is not None:
+            self._cancel_prewarm()
+            self._cancel_prewarm = None
+
+        if not getattr(self._connector, 'prewarm_urls', None):
+            return
+
+        prewarm_delay = self.update_interval.total_seconds() - CONNECTION_PREWARM_LEAD.total_seconds()
+        if prewarm_delay <= 0:
+            return
+
+        async def _async_prewarm(*_) -> None:
+            self._cancel_prewarm = None
+            if self._breaker.state != self._breaker.State.CLOSED:
+                return
+
+            warmed = await self._connector.prewarm()
+            _LOGGER.debug('Opened %d connections for ISP "%s" and user "%s" ahead of update'
+                          % (warmed, *self._key))
+
+        self._cancel_prewarm = async_call_later(self.hass, prewarm_delay, _async_prewarm)
+
+    async def _async_renew_session(self) -> None:
+        if self._breaker.state != self._breaker.State.CLOSED:
+            return
+
+        connector = self._connector
+        async with self._session_lock:
+            if self._can_reuse_session() and connector.session_age < SESSION_RENEWAL_LEAD.total_seconds():
+                # Session has just been established by an update
+                return
+
+            _LOGGER.debug('Renewing session for ISP "%s" and user "%s" ahead of update' % self._key)
+
+            try:
+                if connector.is_logged_in:
+                    await connector.logout()
+
+                await connector.login()
+
+            except (ISPCabinetException, aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                # Next update will log in by itself
+                _LOGGER.debug('Session renewal for ISP "%s" and user "%s" failed' % self._key, exc_info=e)
+
+    @callback
+    def _async_schedule_follow_up(self, error: BaseException) -> None:
+        """Планирование более ранней попытки вместо ожидания полного интервала обновления"""
+        if not isinstance(error, CircuitBreakerOpenError) \
+                and classify_error(error) not in (ErrorClass.NETWORK, ErrorClass.SERVER, ErrorClass.UNAVAILABLE):
+            return
+
+        follow_up_delay = self._breaker.retry_in
+        if follow_up_delay is None:
+            follow_up_delay = DEFAULT_RETRY_POLICY.max_delay
+        follow_up_delay = min(follow_up_delay, self.update_interval.total_seconds())
+
+        _LOGGER.debug('Retrying update for ISP "%s" and user "%s" in %d seconds'
+                      % (*self._key, follow_up_delay))
+
+        async def _async_follow_up(*_) -> None:
+            self._cancel_follow_up = None
+            await self.async_refresh()
+
+        self._cancel_follow_up = async_call_later(self.hass, follow_up_delay, _async_follow_up)
+
+    @callback
+    def _async_schedule_metadata_refresh(self) -> None:
+        """Фоновое обновление метаданных, истекающих до следующего обновления (вне опроса баланса)"""
+        if self._metadata_task is not None and not self._metadata_task.done():
+            return
+
+        fields = self._connector.metadata.stale_fields(within=self.update_interval)
+        if fields:
+            self._metadata_task = self.hass.async_create_task(self._async_refresh_metadata(fields))
+
+    async def _async_refresh_metadata(self, fields: Set[str]) -> None:
+        _LOGGER.debug('Refreshing metadata (%s) for ISP "%s" and user "%s"'
+                      % (', '.join(sorted(fields)), *self._key))
+
+        try:
+            async with self._session_lock:
+                await self._connector.refresh_metadata(fields)
+
+        except (ISPCabinetException, aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+            _LOGGER.debug('Metadata refresh for ISP "%s" and user "%s" failed' % self._key, exc_info=e)
+            return
+
+        if self.data:
+            try:
+                await self._async_save_snapshot(self.data)
+
+            except (TypeError, ValueError, OSError):
+                _LOGGER.exception('Could not save snapshot for ISP "%s" and user "%s":' % self._key)
+
+    @callback
+    def async_profile_updates(self, cycles: int) -> None:
+        """Профилирование следующих циклов обновления с записью результатов в каталог конфигурации"""
+        if self.update_profiler is not None:
+            _LOGGER.warning('Restarting profiling for ISP "%s" and user "%s", %d cycles left unprofiled'
+                            % (*self._key, self.update_profiler.remaining))
+
+        isp_identifier, username = self._key
+        path_prefix = self.hass.config.path(PROFILE_FILE_PREFIX % (
+            slugify('%s_%s' % (isp_identifier, username)), dt.now().strftime('%Y%m%d_%H%M%S')
+        ))
+
+        self.update_profiler = UpdateProfiler('ISP "%s" for user "%s"' % self._key, cycles, path_prefix)
+
+        _LOGGER.info('Profiling next %d update cycles for ISP "%s" and user "%s"' % (cycles, *self._key))
+
+    async def _async_dump_profile(self, update_profiler: UpdateProfiler) -> None:
+        try:
+            pstats_path, collapsed_path = await self.hass.async_add_executor_job(update_profiler.dump)
+
+        except OSError:
+            _LOGGER.exception('Could not write profile for ISP "%s" and user "%s":' % self._key)
+
+        else:
+            _LOGGER.info('Profile for ISP "%s" and user "%s" written to "%s" and "%s"'
+                         % (*self._key, pstats_path, collapsed_path))
+
+    async def _async_profile_update(self) -> Dict[str, '_ISPContract']:
+        update_profiler = self.update_profiler
+        if update_profiler is None:
+            return await self._async_update_contracts()
+
+        try:
+            return await update_profiler.async_profile(self._async_update_contracts())
+
+        finally:
+            # Profiler disables itself after the requested number of cycles
+            if update_profiler.remaining <= 0 and self.update_profiler is update_profiler:
+                self.update_profiler = None
+                await self._async_dump_profile(update_profiler)
+
+    async def _async_update_data(self) -> Dict[str, '_ISPContract']:
+        memory_profiler = self.memory_profiler
+        if memory_profiler is None:
+            return await self._async_profile_update()
+
+        await self.hass.async_add_executor_job(memory_profiler.start_cycle)
+        try:
+            return await self._async_profile_update()
+        finally:
+            await self.hass.async_add_executor_job(memory_profiler.end_cycle)
+
+    async def _async_update_contracts(self) -> Dict[str, '_ISPContract']:
+        isp_identifier, username = self._key
+
+        _LOGGER.debug('Running updater for ISP "%s" and user "%s" at %s'
+                      % (isp_identifier, username, dt.utcnow()))
+
+        if self._cancel_follow_up is not None:
+            self._cancel_follow_up()
+            self._cancel_follow_up = None
+
+        if self._lease_backend is not None and not await self._async_acquire_lease():
+            return await self._async_consume_published_snapshot()
+
+        try:
+            contracts = await async_call_with_retry(self._async_fetch_contracts, DEFAULT_RETRY_POLICY, self._breaker)
+
+        except (ISPCabinetException, aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+            self._async_schedule_follow_up(e)
+            self._async_schedule_session_renewal()
+            self._async_schedule_prewarm()
+
+            if isinstance(e, CircuitBreakerOpenError):
+                raise UpdateFailed('ISP "%s" is unavailable, skipping update for user "%s"'
+                                   % (isp_identifier, username)) from None
+
+            _LOGGER.debug('Update for ISP "%s" and user "%s" failed' % self._key, exc_info=e)
+            raise UpdateFailed('%s: %s' % (e.__class__.__name__, e)) from None
+
+        snapshot = None
+        try:
+            snapshot = self._get_snapshot(contracts)
+            await self._async_save_snapshot(contracts, snapshot)
+
+        except (TypeError, ValueError, OSError):
+            _LOGGER.exception('Could not save snapshot for ISP "%s" and user "%s":' % self._key)
+
+        if self._lease_backend is not None and snapshot is not None:
+            await self._async_publish_snapshot(snapshot)
+
+        if self._archive_writer is not None:
+            # Only snapshots actually fetched are archived, instances consuming published ones do not repeat them
+            self._archive_writer.add(make_archive_rows(isp_identifier, username, contracts.values()))
+
+        _LOGGER.debug('ISP "%s" for user "%s" completed update procedure with %d contracts'
+                      % (isp_identifier, username, len(contracts)))
+
+        self._async_fire_contract_changes(contracts)
+
+        self._async_schedule_session_renewal()
+        self._async_schedule_prewarm()
+        self._async_schedule_metadata_refresh()
+
+        return contracts
@@ -0,0 +1,55 @@
+"""ISP Cabinet diagnostics"""
+from typing import Any, Dict, Optional, TYPE_CHECKING
+
+from homeassistant import config_entries
+from homeassistant.const import CONF_USERNAME
+from homeassistant.helpers.typing import HomeAssistantType
+
+from .const import DOMAIN, CONF_ISP, DATA_LOOP_MONITOR, DATA_ROUTE_POOL
+
+if TYPE_CHECKING:
+    from .coordinator import ISPCabinetCoordinator
+
+
+def get_diagnostics(hass: HomeAssistantType, coordinator: Optional['ISPCabinetCoordinator']) -> Dict[str, Any]:
+    """
+    Диагностические данные учётной записи и общих ресурсов интеграции.
+    Используются диагностикой записей конфигурации (Home Assistant 2022.2+) и службой `isp_cabinet.diagnostics`.
+    :param coordinator: Координатор учётной записи (при наличии)
+    :return: Диагностические данные
+    """
+    from .supported_isps.ratelimit import get_rate_limiter_stats
+    from .supported_isps.transfer import get_transfer_stats
+
+    account = None
+    if coordinator is not None:
+        route = getattr(coordinator.connector, 'route', None)
+        account = {
+            'isp': coordinator.key[0],
+            'shared_by_entries': len(coordinator.config_keys),
+            'contracts': len(coordinator.data or {}),
+            'last_update_success': coordinator.last_update_success,
+            'session_age': coordinator.connector.session_age,
+            'session_expires_in': coordinator.connector.session_expires_in,
+            'route': route.name if route is not None else None,
+            'lease_held': coordinator.lease_held,
+        }
+
+        if coordinator.memory_profiler is not None:
+            account['memory_profiling'] = coordinator.memory_profiler.reports
+
+    return {
+        'account': account,
+        'rate_limits': get_rate_limiter_stats(),
+        'transfer': get_transfer_stats(),
+        'loop_lag': hass.data[DATA_LOOP_MONITOR].as_dict() if DATA_LOOP_MONITOR in hass.data else None,
+        'routes': hass.data[DATA_ROUTE_POOL].as_dict() if DATA_ROUTE_POOL in hass.data else None,
+    }
+
+
+async def async_get_config_entry_diagnostics(hass: HomeAssistantType,
+                                             config_entry: config_entries.ConfigEntry) -> Dict[str, Any]:
+    from .supported_isps import get_account_key
+
+    account_key = get_account_key(config_entry.data[CONF_ISP], config_entry.data[CONF_USERNAME])
+    return get_diagnostics(hass, hass.data.get(DOMAIN, {}).get(account_key))
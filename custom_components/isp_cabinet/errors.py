@@ -10,6 +10,14 @@ class SessionInitializationError(InvalidServerResponseError):
     pass
 
 
+class ServiceMaintenanceError(InvalidServerResponseError):
+    pass
+
+
+class CaptchaRequiredError(InvalidServerResponseError):
+    pass
+
+
 class AuthenticationError(ISPCabinetException):
     pass
 
@@ -24,3 +32,7 @@ class CredentialsInvalidError(AuthenticationError):
 
 class ServerTimeoutError(ISPCabinetException):
     pass
+
+
+class CircuitBreakerOpenError(ISPCabinetException):
+    pass
@@ -0,0 +1,276 @@
+"""Home Assistant setup of ISP Cabinet integration"""
+import asyncio
+import json
+from typing import Any, Optional, Dict, List, TYPE_CHECKING
+
+import pkg_resources
+import logging
+import voluptuous as vol
+
+from homeassistant import config_entries
+import homeassistant.helpers.config_validation as cv
+from homeassistant.const import CONF_USERNAME, CONF_PASSWORD, CONF_SCAN_INTERVAL, CONF_DEVICE_ID, CONF_DEVICE, \
+    ATTR_ENTITY_ID
+from homeassistant.core import callback, ServiceCall
+from homeassistant.helpers.typing import HomeAssistantType, ConfigType
+
+from .const import DOMAIN, CONF_ISP, DATA_CONFIG, CONF_REFRESH_COOLDOWN, SERVICE_REFRESH, CONF_REQUESTS_PER_MINUTE, \
+    CONF_MEMORY_PROFILING, CONF_PROXY, DATA_ROUTE_POOL, CONF_LEASE, CONF_ARCHIVE, SERVICE_PROFILE, \
+    DEFAULT_PROFILE_CYCLES, MAX_PROFILE_CYCLES, SERVICE_DIAGNOSTICS
+
+if TYPE_CHECKING:
+    from .coordinator import ISPCabinetCoordinator
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _check_isp_config(value: Dict[str, Any]) -> Dict[str, Any]:
+    from .supported_isps import ISP_CONNECTORS
+
+    isp_identifier = value[CONF_ISP]
+
+    for connector in ISP_CONNECTORS:
+        if isp_identifier in connector.isp_identifiers:
+            if CONF_SCAN_INTERVAL not in value:
+                value[CONF_SCAN_INTERVAL] = connector.scan_interval
+
+            return value
+
+    raise vol.Invalid('ISP "%s" is not supported' % isp_identifier, [CONF_ISP])
+
+
+def _check_proxy_url(value: str) -> str:
+    from .supported_isps.routing import validate_proxy_url
+
+    return validate_proxy_url(value)
+
+
+ISP_SCHEMA = vol.All(vol.Schema({
+    vol.Required(CONF_ISP): cv.string,
+    vol.Required(CONF_USERNAME): cv.string,
+    vol.Required(CONF_PASSWORD): cv.string,
+    vol.Optional(CONF_SCAN_INTERVAL): vol.All(cv.time_period, cv.positive_timedelta),
+    vol.Optional(CONF_REFRESH_COOLDOWN): vol.All(cv.time_period, cv.positive_timedelta),
+    vol.Optional(CONF_REQUESTS_PER_MINUTE): vol.All(vol.Coerce(float), vol.Range(min=0.1)),
+    vol.Optional(CONF_MEMORY_PROFILING, default=False): cv.boolean,
+    # Several proxies spread accounts of the same ISP across them
+    vol.Optional(CONF_PROXY): vol.All(cv.ensure_list, [vol.All(cv.string, _check_proxy_url)]),
+    # Instances sharing the lease location poll the account in turn instead of all at once
+    vol.Optional(CONF_LEASE): cv.string,
+    # SQLite database collecting snapshots of all accounts configured with it
+    vol.Optional(CONF_ARCHIVE): cv.string,
+}), _check_isp_config)
+
+CONFIG_SCHEMA = vol.Schema({
+    DOMAIN: vol.All(cv.ensure_list, [ISP_SCHEMA])
+}, extra=vol.ALLOW_EXTRA)
+
+SERVICE_REFRESH_SCHEMA = vol.Schema({
+    vol.Optional(ATTR_ENTITY_ID): cv.comp_entity_ids,
+    vol.Optional(CONF_ISP): cv.string,
+    vol.Optional(CONF_USERNAME): cv.string,
+})
+
+ATTR_CYCLES = "cycles"
+
+SERVICE_PROFILE_SCHEMA = SERVICE_REFRESH_SCHEMA.extend({
+    vol.Optional(ATTR_CYCLES, default=DEFAULT_PROFILE_CYCLES):
+        vol.All(vol.Coerce(int), vol.Range(min=1, max=MAX_PROFILE_CYCLES)),
+})
+
+
+@callback
+def _find_existing_entry(hass: HomeAssistantType, isp_identifier: str, username: str) \
+        -> Optional[config_entries.ConfigEntry]:
+    from .supported_isps import get_account_key
+
+    account_key = get_account_key(isp_identifier, username)
+    existing_entries = hass.config_entries.async_entries(DOMAIN)
+
+    for config_entry in existing_entries:
+        if get_account_key(config_entry.data[CONF_ISP], config_entry.data[CONF_USERNAME]) == account_key:
+            return config_entry
+
+
+@callback
+def _get_service_coordinators(hass: HomeAssistantType, service_call: ServiceCall) -> List['ISPCabinetCoordinator']:
+    entity_ids = service_call.data.get(ATTR_ENTITY_ID)
+    isp_identifier = service_call.data.get(CONF_ISP)
+    username = service_call.data.get(CONF_USERNAME)
+
+    coordinators = []
+    for coordinator in hass.data.get(DOMAIN, {}).values():
+        if entity_ids is not None and not set(entity_ids).intersection(coordinator.entity_ids):
+            continue
+        if isp_identifier is not None and isp_identifier not in coordinator.connector.isp_identifiers:
+            continue
+        if username is not None and username.strip().casefold() != coordinator.key[1]:
+            continue
+
+        coordinators.append(coordinator)
+
+    return coordinators
+
+
+async def _async_handle_refresh(hass: HomeAssistantType, service_call: ServiceCall) -> None:
+    tasks = []
+    for coordinator in _get_service_coordinators(hass, service_call):
+        _LOGGER.debug('Refresh requested for ISP "%s" and user "%s"' % coordinator.key)
+        tasks.append(coordinator.async_request_refresh())
+
+    if tasks:
+        await asyncio.gather(*tasks)
+
+
+@callback
+def _async_handle_profile(hass: HomeAssistantType, service_call: ServiceCall) -> None:
+    coordinators = _get_service_coordinators(hass, service_call)
+    if not coordinators:
+        _LOGGER.warning('No accounts matched for profiling')
+        return
+
+    for coordinator in coordinators:
+        coordinator.async_profile_updates(service_call.data[ATTR_CYCLES])
+
+
+@callback
+def _async_handle_diagnostics(hass: HomeAssistantType, service_call: ServiceCall) -> None:
+    from .diagnostics import get_diagnostics
+
+    coordinators = _get_service_coordinators(hass, service_call)
+    if not coordinators:
+        _LOGGER.warning('No accounts matched for diagnostics')
+        return
+
+    # Config entry diagnostics are not available before Home Assistant 2022.2
+    for coordinator in coordinators:
+        _LOGGER.info('Diagnostics for ISP "%s" and user "%s": %s'
+                     % (*coordinator.key, json.dumps(get_diagnostics(hass, coordinator), default=str)))
+
+
+async def async_setup(hass: HomeAssistantType, yaml_config: ConfigType) -> bool:
+    async def async_handle_refresh(service_call: ServiceCall) -> None:
+        await _async_handle_refresh(hass, service_call)
+
+    hass.services.async_register(DOMAIN, SERVICE_REFRESH, async_handle_refresh, schema=SERVICE_REFRESH_SCHEMA)
+
+    @callback
+    def async_handle_profile(service_call: ServiceCall) -> None:
+        _async_handle_profile(hass, service_call)
+
+    hass.services.async_register(DOMAIN, SERVICE_PROFILE, async_handle_profile, schema=SERVICE_PROFILE_SCHEMA)
+
+    @callback
+    def async_handle_diagnostics(service_call: ServiceCall) -> None:
+        _async_handle_diagnostics(hass, service_call)
+
+    hass.services.async_register(DOMAIN, SERVICE_DIAGNOSTICS, async_handle_diagnostics,
+                                 schema=SERVICE_REFRESH_SCHEMA)
+
+    if DOMAIN not in yaml_config:
+        return True
+
+    from .supported_isps import get_account_key
+
+    domain_config = hass.data.setdefault(DATA_CONFIG, dict())
+    configured_accounts = set()
+
+    for isp_conf in yaml_config[DOMAIN]:
+        isp_identifier = isp_conf[CONF_ISP]
+        username = isp_conf[CONF_USERNAME]
+        key = (isp_identifier, username)
+
+        account_key = get_account_key(isp_identifier, username)
+        if account_key in configured_accounts:
+            _LOGGER.warning('ISP "%s" entry for user "%s" has duplicate configuration in YAML. Please, remove'
+                            'duplicate configuration from your YAML config and restart HA!' % key)
+            continue
+
+        configured_accounts.add(account_key)
+
+        existing_entry = _find_existing_entry(hass, *key)
+        if existing_entry:
+            if existing_entry.source == config_entries.SOURCE_IMPORT:
+                # Existing entry may refer to the account using an identifier alias
+                domain_config[(existing_entry.data[CONF_ISP], existing_entry.data[CONF_USERNAME])] = isp_conf
+                _LOGGER.debug('ISP "%s" entry for user "%s" already added as import entry, not adding' % key)
+
+            else:
+                _LOGGER.warning('ISP "%s" entry for user "%s" is overridden by one configured from Home Assistant'
+                                'user interface.' % key)
+            continue
+
+        _LOGGER.debug('Adding ISP "%s" entry for user "%s"' % key)
+
+        domain_config[key] = isp_conf
+
+        hass.async_create_task(
+            hass.config_entries.flow.async_init(
+                DOMAIN,
+                context={"source": config_entries.SOURCE_IMPORT},
+                data={CONF_ISP: isp_identifier, CONF_USERNAME: username},
+            )
+        )
+
+    return True
+
+
+async def async_setup_entry(hass: HomeAssistantType, config_entry: config_entries.ConfigEntry) -> bool:
+    isp_conf = config_entry.data
+    isp_identifier = isp_conf[CONF_ISP]
+    username = isp_conf[CONF_USERNAME]
+    key = (isp_identifier, username)
+
+    if config_entry.source == config_entries.SOURCE_IMPORT:
+        isp_conf = hass.data.get(DATA_CONFIG, {}).get(key)
+        if not isp_conf:
+            _LOGGER.info('Removing ISP "%s" entry for user "%s" after removal from YAML configuration'
+                         % key)
+            hass.async_create_task(
+                hass.config_entries.async_remove(config_entry.entry_id)
+            )
+            return False
+
+    hass.async_create_task(
+        hass.config_entries.async_forward_entry_setup(
+            config_entry, "sensor"
+        )
+    )
+
+    return True
+
+
+async def async_unload_entry(hass: HomeAssistantType, config_entry: config_entries.ConfigEntry) -> bool:
+    from .supported_isps import get_account_key
+
+    isp_identifier = config_entry.data[CONF_ISP]
+    username = config_entry.data[CONF_USERNAME]
+    key = (isp_identifier, username)
+    account_key = get_account_key(isp_identifier, username)
+
+    _LOGGER.debug('Unloading entry "%s" for ISP "%s" with user "%s"'
+                  % (config_entry.entry_id, isp_identifier, username))
+
+    domain_updaters = hass.data.get(DOMAIN, {})
+    coordinator = domain_updaters.get(account_key)
+    if coordinator:
+        coordinator.config_keys.discard(key)
+
+        if coordinator.owner_key == key:
+            _LOGGER.debug('Cancelling updates for entry "%s"' % config_entry.entry_id)
+            coordinator.async_stop()
+            del domain_updaters[account_key]
+
+            route_pool = hass.data.get(DATA_ROUTE_POOL)
+            if route_pool is not None:
+                route_pool.release(account_key)
+
+            # Entities belong to the unloaded entry, let entries sharing the account take over
+            for other_entry in hass.config_entries.async_entries(DOMAIN):
+                if other_entry.entry_id != config_entry.entry_id \
+                        and (other_entry.data[CONF_ISP], other_entry.data[CONF_USERNAME]) in coordinator.config_keys:
+                    hass.async_create_task(hass.config_entries.async_reload(other_entry.entry_id))
+
+    return await hass.config_entries.async_forward_entry_unload(
+        config_entry, "sensor"
+    )
@@ -0,0 +1,160 @@
+"""Poll leases shared between multiple instances"""
+__all__ = [
+    'LeaseBackend',
+    'SQLiteLeaseBackend',
+    'LEASE_BACKENDS',
+    'create_lease_backend',
+]
+
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Optional, Dict, Any, Type, Tuple
+
+
+class LeaseBackend(ABC):
+    """
+    Хранилище аренд опроса и опубликованных снимков.
+
+    Портал провайдера опрашивает только экземпляр, удерживающий аренду учётной записи; остальные экземпляры
+    используют публикуемый им снимок. Методы блокирующие и должны выполняться в пуле потоков.
+    """
+
+    @abstractmethod
+    def acquire(self, key: str, holder: str, duration: float) -> bool:
+        """
+        Получение или продление аренды.
+        :param key: Ключ учётной записи
+        :param holder: Идентификатор экземпляра
+        :param duration: Срок аренды (в секундах)
+        :return: Удерживается ли аренда экземпляром
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def release(self, key: str, holder: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_holder(self, key: str) -> Optional[str]:
+        """Идентификатор экземпляра, удерживающего действующую аренду (при наличии)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def publish(self, key: str, holder: str, snapshot: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_snapshot(self, key: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+        """
+        Получение последнего опубликованного снимка.
+        :param key: Ключ учётной записи
+        :return: Время публикации (UNIX timestamp), снимок
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteLeaseBackend(LeaseBackend):
+    """Хранилище аренд в базе данных SQLite, доступной всем экземплярам (например, на общем томе)"""
+
+    def __init__(self, path: str, timeout: float = 10.0) -> None:
+        self._path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+
+        with self._lock:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS leases ('
+                'key TEXT PRIMARY KEY, holder TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS snapshots ('
+                'key TEXT PRIMARY KEY, holder TEXT NOT NULL, published_at REAL NOT NULL, data TEXT NOT NULL)'
+            )
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def acquire(self, key: str, holder: str, duration: float) -> bool:
+        now = time.time()
+        with self._lock:
+            connection = self._connection
+            # Write lock is taken upfront so that concurrent instances can not both see a free lease
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = connection.execute('SELECT holder, expires_at FROM leases WHERE key = ?', (key,)).fetchone()
+                if row is not None and row[0] != holder and row[1] > now:
+                    connection.execute('COMMIT')
+                    return False
+
+                connection.execute(
+                    'INSERT OR REPLACE INTO leases (key, holder, expires_at) VALUES (?, ?, ?)',
+                    (key, holder, now + duration)
+                )
+                connection.execute('COMMIT')
+                return True
+
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+
+    def release(self, key: str, holder: str) -> None:
+        with self._lock:
+            self._connection.execute('DELETE FROM leases WHERE key = ? AND holder = ?', (key, holder))
+
+    def get_holder(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT holder FROM leases WHERE key = ? AND expires_at > ?', (key, time.time())
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def publish(self, key: str, holder: str, snapshot: Dict[str, Any]) -> None:
+        data = json.dumps(snapshot, ensure_ascii=False)
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO snapshots (key, holder, published_at, data) VALUES (?, ?, ?, ?)',
+                (key, holder, time.time(), data)
+            )
+
+    def get_snapshot(self, key: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT published_at, data FROM snapshots WHERE key = ?', (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+LEASE_BACKENDS: Dict[str, Type[LeaseBackend]] = {
+    'sqlite': SQLiteLeaseBackend,
+}
+
+
+def create_lease_backend(url: str) -> LeaseBackend:
+    """
+    Создание хранилища аренд.
+    :param url: `<хранилище>://<расположение>` или путь к базе данных SQLite
+    :return: Хранилище
+    """
+    scheme, separator, location = url.partition('://')
+    if not separator:
+        scheme, location = 'sqlite', url
+
+    backend_class = LEASE_BACKENDS.get(scheme)
+    if backend_class is None:
+        raise ValueError('Unknown lease backend "%s"' % scheme)
+
+    return backend_class(location)
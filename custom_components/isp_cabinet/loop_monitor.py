@@ -0,0 +1,108 @@
+"""Event loop lag monitoring"""
+import asyncio
+import logging
+import random
+from typing import Optional
+
+from homeassistant.const import EVENT_HOMEASSISTANT_STOP
+from homeassistant.core import callback, Event
+from homeassistant.helpers.typing import HomeAssistantType
+
+from .const import DATA_LOOP_MONITOR, LOOP_LAG_THRESHOLD, LOOP_LAG_CHECK_INTERVAL, LOOP_LAG_STAGGER
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class LoopLagMonitor:
+    """Измерение задержки выполнения запланированных вызовов в цикле событий"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop,
+                 interval: float = LOOP_LAG_CHECK_INTERVAL.total_seconds(),
+                 threshold: float = LOOP_LAG_THRESHOLD.total_seconds(),
+                 smoothing: float = 0.3) -> None:
+        self._loop = loop
+        self._interval = interval
+        self._threshold = threshold
+        self._smoothing = smoothing
+
+        self._lag = 0.0
+        self._max_lag = 0.0
+        self._expected_at: Optional[float] = None
+        self._handle: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def lag(self) -> float:
+        """Сглаженная задержка (в секундах)"""
+        return self._lag
+
+    @property
+    def max_lag(self) -> float:
+        return self._max_lag
+
+    @property
+    def is_busy(self) -> bool:
+        return self._lag > self._threshold
+
+    @callback
+    def async_start(self) -> None:
+        if self._handle is None:
+            self._schedule()
+
+    @callback
+    def async_stop(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _schedule(self) -> None:
+        self._expected_at = self._loop.time() + self._interval
+        self._handle = self._loop.call_later(self._interval, self._measure)
+
+    def _measure(self) -> None:
+        lag = max(0.0, self._loop.time() - self._expected_at)
+        self._lag += self._smoothing * (lag - self._lag)
+        self._max_lag = max(self._max_lag, lag)
+        self._schedule()
+
+    async def async_wait_idle(self, max_delay: float) -> float:
+        """
+        Ожидание снижения задержки цикла событий ниже порога.
+
+        Ожидающие пробуждаются в случайные моменты, чтобы отложенная работа не возобновлялась одновременно.
+        :param max_delay: Максимальное время ожидания (в секундах)
+        :return: Время ожидания (в секундах)
+        """
+        started_at = self._loop.time()
+        min_stagger, max_stagger = (delay.total_seconds() for delay in LOOP_LAG_STAGGER)
+
+        while self.is_busy:
+            remaining = max_delay - (self._loop.time() - started_at)
+            if remaining <= 0:
+                break
+            await asyncio.sleep(min(remaining, random.uniform(min_stagger, max_stagger)))
+
+        return self._loop.time() - started_at
+
+    def as_dict(self):
+        return {
+            'lag': round(self._lag, 4),
+            'max_lag': round(self._max_lag, 4),
+            'busy': self.is_busy,
+        }
+
+
+@callback
+def async_get_loop_monitor(hass: HomeAssistantType) -> LoopLagMonitor:
+    monitor = hass.data.get(DATA_LOOP_MONITOR)
+    if monitor is None:
+        monitor = hass.data[DATA_LOOP_MONITOR] = LoopLagMonitor(hass.loop)
+        monitor.async_start()
+
+        @callback
+        def _async_stop_monitor(_: Event) -> None:
+            hass.data.pop(DATA_LOOP_MONITOR, None)
+            monitor.async_stop()
+
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, _async_stop_monitor)
+
+    return monitor
@@ -0,0 +1,154 @@
+"""Memory profiling of update cycles"""
+__all__ = [
+    'MemoryProfiler',
+]
+
+import gc
+import logging
+import time
+import tracemalloc
+from collections import deque, Counter
+from typing import Optional, Dict, Any, List, Deque, Tuple, Type
+
+_LOGGER = logging.getLogger(__name__)
+
+TRACEBACK_FRAMES = 10
+
+_active_profilers = 0
+
+
+def _get_watched_types() -> Tuple[Type, ...]:
+    """Типы объектов, которые могут удерживаться между циклами обновления"""
+    import aiohttp
+    from .supported_isps.base import _ISPContract, _ISPTariff, _ISPConnector
+
+    watched_types = [_ISPContract, _ISPTariff, _ISPConnector, aiohttp.CookieJar, aiohttp.ClientSession]
+
+    try:
+        from lxml import etree
+        watched_types.append(etree._Element)
+    except ImportError:
+        pass
+
+    return tuple(watched_types)
+
+
+def _format_report(report: Dict[str, Any]) -> str:
+    """Текстовое представление отчёта для журнала"""
+    lines = [
+        '%+d bytes (traced %d, peak %d)' % (report['size_diff'], report['traced_current'], report['traced_peak']),
+        'retained objects: ' + (', '.join(
+            '%s=%d' % item for item in sorted(report['retained_objects'].items())
+        ) or 'none'),
+    ]
+    for allocation in report['top_allocations']:
+        location = allocation['traceback'][0] if allocation['traceback'] else 'unknown'
+        lines.append('%+d bytes (%+d blocks) at %s' % (allocation['size_diff'], allocation['count_diff'], location))
+    return '\n'.join(lines)
+
+
+class MemoryProfiler:
+    """Снимки `tracemalloc` до и после цикла обновления и подсчёт удерживаемых объектов"""
+
+    def __init__(self, name: str, top_n: int = 15, max_reports: int = 5) -> None:
+        self._name = name
+        self._top_n = top_n
+        self._reports: Deque[Dict[str, Any]] = deque(maxlen=max_reports)
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._started_at: Optional[float] = None
+        self._enabled = False
+
+    @property
+    def reports(self) -> List[Dict[str, Any]]:
+        return list(self._reports)
+
+    def enable(self) -> None:
+        global _active_profilers
+        if self._enabled:
+            return
+
+        if not tracemalloc.is_tracing():
+            _LOGGER.warning('Starting tracemalloc for memory profiling; expect increased memory usage '
+                            'and slower operation')
+            tracemalloc.start(TRACEBACK_FRAMES)
+
+        _active_profilers += 1
+        self._enabled = True
+
+    def disable(self) -> None:
+        global _active_profilers
+        if not self._enabled:
+            return
+
+        self._enabled = False
+        self._snapshot = None
+        _active_profilers -= 1
+
+        if _active_profilers == 0 and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    @staticmethod
+    def _take_snapshot() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+
+    @staticmethod
+    def _count_retained_objects() -> Dict[str, int]:
+        watched_types = _get_watched_types()
+        counter = Counter(
+            type(obj).__name__
+            for obj in gc.get_objects()
+            if isinstance(obj, watched_types)
+        )
+        return dict(counter)
+
+    def start_cycle(self) -> None:
+        """Снимок перед циклом обновления (блокирующий вызов)"""
+        if not self._enabled:
+            return
+
+        self._started_at = time.time()
+        self._snapshot = self._take_snapshot()
+
+    def end_cycle(self) -> Optional[Dict[str, Any]]:
+        """Снимок после цикла обновления и формирование отчёта (блокирующий вызов)"""
+        if not self._enabled or self._snapshot is None:
+            return None
+
+        # Collect garbage first so that only actually retained memory is reported
+        gc.collect()
+
+        snapshot = self._take_snapshot()
+        differences = snapshot.compare_to(self._snapshot, 'traceback')
+        self._snapshot = None
+
+        current, peak = tracemalloc.get_traced_memory()
+
+        report = {
+            'started_at': self._started_at,
+            'finished_at': time.time(),
+            'size_diff': sum(stat.size_diff for stat in differences),
+            'traced_current': current,
+            'traced_peak': peak,
+            'top_allocations': [
+                {
+                    'size_diff': stat.size_diff,
+                    'count_diff': stat.count_diff,
+                    'size': stat.size,
+                    'traceback': [
+                        '%s:%d' % (frame.filename, frame.lineno)
+                        for frame in stat.traceback
+                    ],
+                }
+                for stat in differences[:self._top_n]
+            ],
+            'retained_objects': self._count_retained_objects(),
+        }
+
+        # Profiling is enabled explicitly, and diagnostics hook is not available before Home Assistant 2022.2
+        _LOGGER.info('Memory change for %s during update cycle: %s' % (self._name, _format_report(report)))
+
+        self._reports.append(report)
+        return report
@@ -0,0 +1,150 @@
+"""Deterministic profiling of update cycles"""
+__all__ = [
+    'UpdateProfiler',
+    'write_collapsed_stacks',
+]
+
+import asyncio
+import cProfile
+import logging
+import os
+import pstats
+from collections import defaultdict
+from typing import Optional, Dict, List, Tuple, Awaitable, TypeVar
+
+_LOGGER = logging.getLogger(__name__)
+
+ReturnType = TypeVar('ReturnType')
+
+FunctionType = Tuple[str, int, str]
+
+# Only one profiler may be active on a thread, so profiled cycles of different accounts run one at a time
+_profile_lock: Optional[asyncio.Lock] = None
+
+# Stack paths taking less time than this (in microseconds) are omitted from collapsed stacks
+_MIN_STACK_TIME = 1
+
+_MAX_STACK_DEPTH = 128
+
+
+def _get_profile_lock() -> asyncio.Lock:
+    global _profile_lock
+    if _profile_lock is None:
+        _profile_lock = asyncio.Lock()
+    return _profile_lock
+
+
+def _get_frame_label(function: FunctionType) -> str:
+    filename, lineno, name = function
+    if filename == '~':
+        # Built-in functions
+        label = name
+    else:
+        label = '%s:%d(%s)' % (os.path.join(os.path.basename(os.path.dirname(filename)),
+                                            os.path.basename(filename)), lineno, name)
+    # Semicolons separate frames in collapsed stacks
+    return label.replace(';', ',')
+
+
+def write_collapsed_stacks(stats: pstats.Stats, path: str) -> int:
+    """
+    Запись стеков в свёрнутом формате (`frame;frame;frame microseconds`), пригодном для построения
+    flame-графиков (flamegraph.pl, speedscope).
+
+    Детерминированный профилировщик сохраняет только пары "вызывающая - вызываемая функция", поэтому
+    стеки восстанавливаются по графу вызовов, а время функции распределяется между стеками пропорционально
+    времени вызовов из каждой вызывающей функции.
+    :param stats: Статистика профилировщика
+    :param path: Путь к файлу
+    :return: Количество записанных стеков
+    """
+    # noinspection PyUnresolvedReferences
+    entries = stats.stats
+
+    callees: Dict[FunctionType, List[Tuple[FunctionType, float]]] = defaultdict(list)
+    for function, (_, _, _, _, callers) in entries.items():
+        for caller, caller_stats in callers.items():
+            callees[caller].append((function, caller_stats[3]))
+
+    lines: Dict[str, int] = defaultdict(int)
+
+    def _walk(function: FunctionType, path_functions: List[FunctionType], share: float) -> None:
+        _, _, own_time, total_time, _ = entries[function]
+        path_functions.append(function)
+
+        own_time_us = int(own_time * share * 1e6)
+        if own_time_us > 0:
+            lines[';'.join(map(_get_frame_label, path_functions))] += own_time_us
+
+        if len(path_functions) < _MAX_STACK_DEPTH:
+            for callee, call_time in callees.get(function, ()):
+                # Recursive calls are already accounted for in the time of the outer frame
+                if callee in path_functions or call_time * share * 1e6 < _MIN_STACK_TIME:
+                    continue
+
+                callee_total_time = entries[callee][3]
+                if callee_total_time > 0:
+                    _walk(callee, path_functions, min(1.0, share * call_time / callee_total_time))
+
+        path_functions.pop()
+
+    for root, (_, _, _, _, callers) in entries.items():
+        # Functions called from frames entered before profiling started have no callers
+        if not callers:
+            _walk(root, [], 1.0)
+
+    with open(path, 'w', encoding='utf-8') as f:
+        for stack, time_us in lines.items():
+            f.write('%s %d\n' % (stack, time_us))
+
+    return len(lines)
+
+
+class UpdateProfiler:
+    """
+    Профилирование заданного количества циклов обновления с помощью `cProfile`.
+    Профилируется весь поток цикла событий, поэтому в результаты попадают и задачи, выполнявшиеся
+    одновременно с циклом обновления.
+    """
+
+    def __init__(self, name: str, cycles: int, path_prefix: str) -> None:
+        self._name = name
+        self._remaining = cycles
+        self._path_prefix = path_prefix
+        self._profile = cProfile.Profile()
+        self._profiled_cycles = 0
+
+    @property
+    def remaining(self) -> int:
+        return self._remaining
+
+    @property
+    def path_prefix(self) -> str:
+        return self._path_prefix
+
+    async def async_profile(self, awaitable: Awaitable[ReturnType]) -> ReturnType:
+        """Профилирование одного цикла обновления"""
+        async with _get_profile_lock():
+            self._remaining -= 1
+            self._profile.enable()
+            try:
+                return await awaitable
+            finally:
+                self._profile.disable()
+                self._profiled_cycles += 1
+
+    def dump(self) -> Tuple[str, str]:
+        """
+        Запись результатов (блокирующий вызов).
+        :return: Пути к файлам `pstats` и свёрнутых стеков
+        """
+        pstats_path = self._path_prefix + '.pstats'
+        collapsed_path = self._path_prefix + '.collapsed'
+
+        self._profile.dump_stats(pstats_path)
+        stacks = write_collapsed_stacks(pstats.Stats(self._profile), collapsed_path)
+
+        _LOGGER.debug('Profile of %d update cycles for %s written with %d collapsed stacks'
+                      % (self._profiled_cycles, self._name, stacks))
+
+        return pstats_path, collapsed_path
@@ -0,0 +1,263 @@
+"""Retry policy and circuit breakers for ISP portal requests"""
+__all__ = [
+    'ErrorClass',
+    'RetryPolicy',
+    'CircuitBreaker',
+    'classify_error',
+    'get_circuit_breaker',
+    'async_call_with_retry',
+    'DEFAULT_RETRY_POLICY',
+]
+
+import asyncio
+import logging
+import random
+import time
+from enum import IntEnum
+from typing import Optional, Dict, Callable, Awaitable, TypeVar, NamedTuple, Type, TYPE_CHECKING
+
+import aiohttp
+
+from .errors import ISPCabinetException, InvalidServerResponseError, AuthenticationError, \
+    AuthenticationRequiredError, ServerTimeoutError, CircuitBreakerOpenError, ServiceMaintenanceError, \
+    CaptchaRequiredError
+
+if TYPE_CHECKING:
+    # noinspection PyProtectedMember
+    from .supported_isps.base import _ISPConnector
+
+_LOGGER = logging.getLogger(__name__)
+
+ReturnType = TypeVar('ReturnType')
+
+
+class ErrorClass(IntEnum):
+    NETWORK = 0
+    SERVER = 1
+    SESSION = 2
+    AUTHENTICATION = 3
+    UNAVAILABLE = 4
+
+
+def classify_error(error: BaseException) -> Optional[ErrorClass]:
+    """
+    Классификация исключения, возникшего при обращении к порталу провайдера.
+    :param error: Исключение
+    :return: Класс ошибки / None - ошибка не относится к обращению к провайдеру
+    """
+    if isinstance(error, (ServiceMaintenanceError, CaptchaRequiredError)):
+        return ErrorClass.UNAVAILABLE
+    if isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError, ServerTimeoutError, OSError)):
+        return ErrorClass.NETWORK
+    if isinstance(error, InvalidServerResponseError):
+        return ErrorClass.SERVER
+    if isinstance(error, AuthenticationRequiredError):
+        return ErrorClass.SESSION
+    if isinstance(error, AuthenticationError):
+        return ErrorClass.AUTHENTICATION
+    return None
+
+
+class RetryPolicy(NamedTuple):
+    attempts: int = 3
+    base_delay: float = 5.0
+    max_delay: float = 300.0
+    multiplier: float = 2.0
+    jitter: float = 0.5
+
+    def get_delay(self, attempt: int) -> float:
+        """
+        Задержка перед повторной попыткой (экспоненциальная, со случайным отклонением).
+        :param attempt: Номер неудавшейся попытки, начиная с 1
+        :return: Задержка в секундах
+        """
+        delay = min(self.max_delay, self.base_delay * self.multiplier ** (attempt - 1))
+        if self.jitter:
+            delay *= 1.0 + random.uniform(-self.jitter, self.jitter)
+        return max(0.0, delay)
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+
+class CircuitBreaker:
+    class State(IntEnum):
+        CLOSED = 0
+        OPEN = 1
+        HALF_OPEN = 2
+
+    class Permit(NamedTuple):
+        # Number of the trial request owned by the caller; 0 - regular request
+        trial: int = 0
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 600.0,
+                 max_reset_timeout: float = 3600.0) -> None:
+        self._name = name
+        self._failure_threshold = failure_threshold
+        self._base_reset_timeout = reset_timeout
+        self._max_reset_timeout = max_reset_timeout
+
+        self._state = self.State.CLOSED
+        self._failures = 0
+        self._reset_timeout = reset_timeout
+        self._opened_at: Optional[float] = None
+        # Number of the trial request in progress (0 - none) and of the last started one
+        self._trial = 0
+        self._trials = 0
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def state(self) -> 'CircuitBreaker.State':
+        if self._state == self.State.OPEN and self.retry_in == 0.0:
+            return self.State.HALF_OPEN
+        return self._state
+
+    @property
+    def retry_in(self) -> Optional[float]:
+        """Время (в секундах) до пробного запроса; None - если цепь замкнута"""
+        if self._opened_at is None:
+            return None
+        return max(0.0, self._opened_at + self._reset_timeout - time.monotonic())
+
+    def allow_request(self) -> Optional['CircuitBreaker.Permit']:
+        """
+        Разрешение запроса; в полуоткрытом состоянии разрешается единственный пробный запрос.
+        :return: Разрешение (передаётся в `record_failure` и `release_trial`) / None - запрос запрещён
+        """
+        state = self.state
+        if state == self.State.CLOSED:
+            return self.Permit()
+        if state == self.State.HALF_OPEN and not self._trial:
+            self._state = self.State.HALF_OPEN
+            self._trials += 1
+            self._trial = self._trials
+            return self.Permit(self._trial)
+        return None
+
+    def record_success(self) -> None:
+        if self._state != self.State.CLOSED:
+            _LOGGER.info('Circuit breaker for "%s" closed, portal is responding again' % self._name)
+
+        self._state = self.State.CLOSED
+        self._failures = 0
+        self._reset_timeout = self._base_reset_timeout
+        self._opened_at = None
+        self._trial = 0
+
+    def record_failure(self, permit: 'CircuitBreaker.Permit') -> None:
+        if self._state == self.State.HALF_OPEN:
+            if not permit.trial or permit.trial != self._trial:
+                # Request started before the circuit opened; only the trial request decides on the state
+                return
+            # Trial request failed, back off further
+            self._reset_timeout = min(self._max_reset_timeout, self._reset_timeout * 2)
+            self._open()
+            return
+
+        self._failures += 1
+        if self._state == self.State.CLOSED and self._failures >= self._failure_threshold:
+            self._open()
+
+    def release_trial(self, permit: 'CircuitBreaker.Permit') -> None:
+        """
+        Завершение пробного запроса без учёта результата (запрос прерван или завершился посторонней ошибкой).
+        Запросы, не владеющие текущим пробным запросом, состояние не изменяют.
+        :param permit: Разрешение, полученное от `allow_request`
+        """
+        if permit.trial and permit.trial == self._trial:
+            self._trial = 0
+
+    def _open(self) -> None:
+        _LOGGER.warning('Circuit breaker for "%s" opened, suspending requests for %d seconds'
+                        % (self._name, self._reset_timeout))
+        self._state = self.State.OPEN
+        self._opened_at = time.monotonic()
+        self._trial = 0
+
+
+_CIRCUIT_BREAKERS: Dict[str, CircuitBreaker] = dict()
+
+
+def get_circuit_breaker(connector: Type['_ISPConnector']) -> CircuitBreaker:
+    """
+    Получение общего для всех учётных записей провайдера предохранителя.
+    :param connector: Класс (или экземпляр) коннектора
+    :return: Предохранитель
+    """
+    name = connector.isp_identifiers[0]
+    breaker = _CIRCUIT_BREAKERS.get(name)
+    if breaker is None:
+        breaker = CircuitBreaker(name)
+        _CIRCUIT_BREAKERS[name] = breaker
+    return breaker
+
+
+async def async_call_with_retry(func: Callable[[], Awaitable[ReturnType]],
+                                policy: RetryPolicy = DEFAULT_RETRY_POLICY,
+                                breaker: Optional[CircuitBreaker] = None) -> ReturnType:
+    """
+    Выполнение операции с повторными попытками.
+
+    Сетевые ошибки и неверные ответы сервера повторяются с экспоненциальной задержкой и
+    учитываются предохранителем; истёкшая сессия повторяется немедленно; ошибки авторизации
+    не повторяются. Недоступность портала (обслуживание, капча) учитывается предохранителем,
+    но не повторяется, так как не устраняется за время попыток.
+    :param func: Фабрика корутины, выполняющей операцию
+    :param policy: Политика повторных попыток
+    :param breaker: Предохранитель провайдера
+    :return: Результат операции
+    """
+    attempt = 0
+    while True:
+        permit = None
+        if breaker is not None:
+            permit = breaker.allow_request()
+            if permit is None:
+                raise CircuitBreakerOpenError(breaker.name, breaker.retry_in)
+
+        attempt += 1
+        try:
+            result = await func()
+
+        except (ISPCabinetException, aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+            error_class = classify_error(e)
+            if error_class is None:
+                if breaker is not None:
+                    breaker.release_trial(permit)
+                raise
+
+            if breaker is not None:
+                if error_class in (ErrorClass.NETWORK, ErrorClass.SERVER, ErrorClass.UNAVAILABLE):
+                    breaker.record_failure(permit)
+                else:
+                    # Portal responded, account-specific problems do not affect other accounts
+                    breaker.record_success()
+
+            if error_class in (ErrorClass.AUTHENTICATION, ErrorClass.UNAVAILABLE) or attempt >= policy.attempts:
+                raise
+
+            if error_class == ErrorClass.SESSION:
+                delay = 0.0
+            else:
+                delay = policy.get_delay(attempt)
+
+            _LOGGER.debug('Attempt %d failed (%s: %s), retrying in %.1f seconds'
+                          % (attempt, error_class.name.lower(), e.__class__.__name__, delay))
+
+            await asyncio.sleep(delay)
+            continue
+
+        except BaseException:
+            # Cancelled (e.g. on reload or shutdown) or otherwise failed call tells nothing about the portal,
+            # while a trial left in progress would block requests of all accounts of the ISP
+            if breaker is not None:
+                breaker.release_trial(permit)
+            raise
+
+        if breaker is not None:
+            breaker.record_success()
+
+        return result
@@ -1,22 +1,27 @@
 """ISP Sensor"""
-import asyncio
 import logging
-from datetime import timedelta, datetime, date
-from typing import Callable, Optional, Dict, Any, TYPE_CHECKING, Iterable, Tuple, Union
+import sqlite3
+import time
+from datetime import timedelta, datetime
+from typing import Callable, Optional, Dict, Any, TYPE_CHECKING, Iterable, Tuple, Type
 
 from homeassistant import config_entries
-from homeassistant.components.sensor import PLATFORM_SCHEMA
-from homeassistant.const import CONF_USERNAME, CONF_SCAN_INTERVAL, CONF_PASSWORD, ATTR_ATTRIBUTION, STATE_UNAVAILABLE
+from homeassistant.const import CONF_USERNAME, CONF_SCAN_INTERVAL, CONF_PASSWORD, ATTR_ATTRIBUTION
+from homeassistant.core import callback
 from homeassistant.exceptions import PlatformNotReady, ConfigEntryNotReady
 from homeassistant.helpers import ConfigType
 from homeassistant.helpers.entity import Entity
-from homeassistant.helpers.event import async_track_time_interval
 from homeassistant.helpers.typing import HomeAssistantType
+from homeassistant.helpers.update_coordinator import CoordinatorEntity
 from homeassistant.util import dt
 
 from custom_components.isp_cabinet import DATA_CONFIG, CONF_ISP, DOMAIN
-from custom_components.isp_cabinet.errors import CredentialsInvalidError, AuthenticationError, \
-    ServerTimeoutError, ISPCabinetException
+from custom_components.isp_cabinet.const import CONF_REFRESH_COOLDOWN, DEFAULT_REFRESH_COOLDOWN, \
+    DATA_PENDING_CONNECTORS, PENDING_CONNECTOR_TTL, CONF_REQUESTS_PER_MINUTE, CONF_MEMORY_PROFILING, CONF_PROXY, \
+    CONF_LEASE, CONF_ARCHIVE
+from custom_components.isp_cabinet.connection import async_get_http_connector, async_get_route_pool, \
+    async_get_lease_backend, async_get_lease_holder, async_get_archive_writer
+from custom_components.isp_cabinet.coordinator import ISPCabinetCoordinator
 
 if TYPE_CHECKING:
     # noinspection PyProtectedMember
@@ -25,119 +30,155 @@ if TYPE_CHECKING:
 _LOGGER = logging.getLogger(__name__)
 
 
-def _create_updater(connector_instance: '_ISPConnector',
-                    async_add_entities: Callable[[Iterable[Entity], bool], Any],
-                    debug_key: Tuple[str, str]):
-    created_entities: Dict[str, ISPContractEntity] = dict()
+@callback
+def _create_entities_updater(coordinator: ISPCabinetCoordinator,
+                             async_add_entities: Callable[[Iterable[Entity], bool], Any]) -> Callable[[], None]:
+    created_entities: Dict[str, Tuple[Entity, ...]] = dict()
 
-    async def update_contracts(now: datetime):
-        isp_identifier, username = debug_key
-
-        _LOGGER.debug('Running updater for ISP "%s" and user "%s" at %s'
-                      % (isp_identifier, username, now))
-
-        # Perform authorization routine
-        try:
-            if connector_instance.is_logged_in:
-                await connector_instance.logout()
-
-            await connector_instance.login()
-            contracts = await connector_instance.get_contracts()
-
-        except ISPCabinetException:
-            _LOGGER.exception('Exception occured:')
-            for entity in created_entities.values():
-                if entity.available:
-                    entity.state = STATE_UNAVAILABLE
-                    entity.async_schedule_update_ha_state()
-            return False
+    @callback
+    def update_entities() -> None:
+        contracts = coordinator.data
+        if contracts is None:
+            return
 
+        # Remove obsolete entities
+        for contract_code in created_entities.keys() - contracts.keys():
+            for entity in created_entities.pop(contract_code):
+                coordinator.hass.async_create_task(entity.async_remove())
 
         # Create new entities
-        new_entities: Dict[str, ISPContractEntity] = {
-            contract_code: ISPContractEntity(contracts[contract_code])
-            for contract_code in contracts.keys() - created_entities.keys()
-        }
+        new_entities = []
+        for contract_code in contracts.keys() - created_entities.keys():
+            contract = contracts[contract_code]
+            contract_entities = (ISPContractEntity(coordinator, contract_code), *[
+                ISPContractFieldEntity(coordinator, contract_code, field)
+                for field, (_, _, getter) in ISPContractFieldEntity.FIELDS.items()
+                if ISPContractFieldEntity.get_field_value(contract, getter) is not None
+            ])
+            created_entities[contract_code] = contract_entities
+            new_entities.extend(contract_entities)
 
-        # Remove obsolete entities and update new entities
-        tasks = []
-        for contract_code in created_entities.keys() - contracts.keys():
-            del created_entities[contract_code]
-            tasks.append(created_entities[contract_code].async_remove())
+        if new_entities:
+            async_add_entities(new_entities, False)
 
-        for contract_entity in new_entities.values():
-            tasks.append(contract_entity.async_update())
+            _LOGGER.debug('ISP "%s" for user "%s" provides %d contracts, %d new entities added'
+                          % (*coordinator.key, len(contracts), len(new_entities)))
 
-        if tasks:
-            await asyncio.wait(tasks)
+    return update_entities
 
-        # Update existing entities
-        for contract_code, contract_entity in created_entities.items():
-            contract_entity.async_schedule_update_ha_state(force_refresh=True)
 
-        if new_entities:
-            async_add_entities(new_entities.values(), True)
-            created_entities.update(new_entities)
+@callback
+def _pop_pending_connector(hass: HomeAssistantType, key: Tuple[str, str],
+                           connector_class: Type['_ISPConnector'], password: str) -> Optional['_ISPConnector']:
+    """Получение коннектора, авторизованного при настройке, если он ещё не устарел"""
+    pending_connectors = hass.data.get(DATA_PENDING_CONNECTORS)
+    if not pending_connectors:
+        return None
 
-        new_entity_count = len(new_entities)
+    pending = pending_connectors.pop(key, None)
+    if pending is None:
+        return None
 
-        _LOGGER.debug('ISP "%s" for user "%s" completed update procedure at %s. '
-                      'Removed %d contract entities. '
-                      'Added %d contract entities.'
-                      % (isp_identifier, username, dt.utcnow(), len(tasks)-new_entity_count, new_entity_count))
+    created_at, instance = pending
+    if time.monotonic() - created_at > PENDING_CONNECTOR_TTL.total_seconds() \
+            or type(instance) is not connector_class \
+            or instance._password != password:
+        return None
 
-    return update_contracts
+    _LOGGER.debug('Reusing connector authenticated during configuration for ISP "%s" and user "%s"' % key)
+    return instance
 
 
 # noinspection PyUnusedLocal
 async def async_setup_platform(hass: HomeAssistantType, config: ConfigType,
                                async_add_entities: Callable[[Iterable[Entity], bool], Any],
                                discovery_info: Optional[Dict[str, Any]] = None) -> Optional[bool]:
-    from .supported_isps import ISP_CONNECTORS
+    from .supported_isps import get_connector_class, get_account_key
+    # noinspection PyProtectedMember
+    from .supported_isps.base import _ISPHTTPConnector
 
     isp_identifier = config[CONF_ISP]
     username = config[CONF_USERNAME]
     key = (isp_identifier, username)
 
-    instance = None
-    for connector in ISP_CONNECTORS:
-        if isp_identifier in connector.isp_identifiers:
-            instance = connector(username=username, password=config[CONF_PASSWORD])
-            break
-
-    if instance is None:
+    connector_class = get_connector_class(isp_identifier)
+    if connector_class is None:
         _LOGGER.error('ISP Identifier "%s" not found in supported connectors' % isp_identifier)
         return False
 
-    if DOMAIN in hass.data and key in hass.data[DOMAIN]:
-        _LOGGER.error('ISP "%s" for user "%s" already configured. Please, check your configuration.'
-                      % key)
-        return False
+    account_key = get_account_key(isp_identifier, username)
+    domain_updaters = hass.data.setdefault(DOMAIN, dict())
 
-    updater = _create_updater(instance, async_add_entities, key)
+    coordinator = domain_updaters.get(account_key)
+    if coordinator is not None:
+        if key in coordinator.config_keys:
+            _LOGGER.error('ISP "%s" for user "%s" already configured. Please, check your configuration.'
+                          % key)
+            return False
 
-    try:
-        await updater(dt.utcnow())
+        if coordinator.connector._password != config[CONF_PASSWORD]:
+            _LOGGER.warning('ISP "%s" for user "%s" is configured multiple times with different passwords; '
+                            'using the one configured first' % key)
 
-    except ServerTimeoutError:
-        raise PlatformNotReady('ISP "%s" for user "%s" timed out while authenticating' % key)
+        _LOGGER.info('ISP "%s" for user "%s" is already configured as "%s" for user "%s", sharing its connector'
+                     % (*key, *coordinator.owner_key))
+        coordinator.config_keys.add(key)
+        return True
 
-    except CredentialsInvalidError:
-        _LOGGER.error('Credentials invalid on ISP identifier "%s" for user "%s". Please, update your'
-                      'credentials.' % key)
-        return False
+    instance = _pop_pending_connector(hass, account_key, connector_class, config[CONF_PASSWORD])
+    if instance is None:
+        connector_kwargs = {}
+        if CONF_REQUESTS_PER_MINUTE in config:
+            connector_kwargs['requests_per_minute'] = config[CONF_REQUESTS_PER_MINUTE]
 
-    except AuthenticationError:
-        _LOGGER.error('Authentication error for user with ISP identifier "%s" and user "%s"' % key)
-        return False
+        instance = connector_class(username=username, password=config[CONF_PASSWORD], **connector_kwargs)
 
-    domain_updaters = hass.data.setdefault(DOMAIN, dict())
+    if isinstance(instance, _ISPHTTPConnector):
+        proxy_urls = config.get(CONF_PROXY)
+        if proxy_urls:
+            try:
+                instance.route = async_get_route_pool(hass).assign(account_key, proxy_urls, connector_class)
+            except ImportError as e:
+                _LOGGER.error('Could not set up proxy for ISP "%s" and user "%s": %s' % (*key, e))
+                return False
+
+        # Shared pool keeps connections between updates and allows opening them ahead of updates
+        instance.http_connector = async_get_http_connector(hass)
 
     update_interval = config.get(CONF_SCAN_INTERVAL)
     if update_interval is None:
         update_interval = instance.scan_interval
 
-    domain_updaters[key] = async_track_time_interval(hass, updater, update_interval)
+    lease_backend, lease_holder = None, None
+    if config.get(CONF_LEASE):
+        try:
+            lease_backend = await async_get_lease_backend(hass, config[CONF_LEASE])
+        except (sqlite3.Error, OSError, ValueError) as e:
+            _LOGGER.error('Could not open poll lease storage for ISP "%s" and user "%s": %s' % (*key, e))
+            return False
+
+        lease_holder = await async_get_lease_holder(hass)
+
+    archive_writer = None
+    if config.get(CONF_ARCHIVE):
+        try:
+            archive_writer = await async_get_archive_writer(hass, config[CONF_ARCHIVE])
+        except (sqlite3.Error, OSError) as e:
+            # Archive is auxiliary, account is still set up
+            _LOGGER.error('Could not open snapshot archive for ISP "%s" and user "%s": %s' % (*key, e))
+
+    coordinator = ISPCabinetCoordinator(hass, instance, account_key, key, update_interval,
+                                        config.get(CONF_REFRESH_COOLDOWN, DEFAULT_REFRESH_COOLDOWN),
+                                        config.get(CONF_MEMORY_PROFILING, False),
+                                        lease_backend, lease_holder, archive_writer)
+    domain_updaters[account_key] = coordinator
+
+    await coordinator.async_restore()
+
+    update_entities = _create_entities_updater(coordinator, async_add_entities)
+    update_entities()
+    coordinator.async_add_listener(update_entities)
+    coordinator.async_start()
 
     _LOGGER.debug('Running updater for ISP "%s" and user "%s" every %d seconds'
                   % (key[0], key[1], update_interval.seconds + update_interval.days * 86400))
@@ -168,25 +209,44 @@ async def async_setup_entry(hass: HomeAssistantType, config_entry: config_entrie
     return True
 
 
-class ISPContractEntity(Entity):
-    def __init__(self, contract: '_ISPContract') -> None:
-        self._contract = contract
+class ISPContractEntity(CoordinatorEntity):
+    coordinator: ISPCabinetCoordinator
+
+    def __init__(self, coordinator: ISPCabinetCoordinator, contract_code: str) -> None:
+        super().__init__(coordinator)
+        self._contract_code = contract_code
         self._icon = 'mdi:web'
         self._state = None
         self._attributes = None
         self._unit_of_measurement = None
+        self._available = False
 
     @property
-    def should_poll(self) -> bool:
-        return False
+    def contract(self) -> Optional['_ISPContract']:
+        data = self.coordinator.data
+        if data is None:
+            return None
+        return data.get(self._contract_code)
 
     @property
     def contract_code(self) -> str:
-        return self._contract.code
+        return self._contract_code
+
+    @property
+    def isp_title(self) -> str:
+        return self.coordinator.connector.isp_title
 
     @property
     def name(self) -> Optional[str]:
-        return self._contract.connector.isp_title + ' ' + self.contract_code
+        return self.isp_title + ' ' + self.contract_code
+
+    @property
+    def device_info(self) -> Optional[Dict[str, Any]]:
+        return {
+            'identifiers': {(DOMAIN, '%s_%s' % (self.coordinator.connector.isp_identifiers[0], self._contract_code))},
+            'name': self.isp_title + ' ' + self._contract_code,
+            'manufacturer': self.isp_title,
+        }
 
     @staticmethod
     def _set_attr(input_dict: Dict[str, Any], key: str, value: Any, false_empty: bool = True,
@@ -201,38 +261,87 @@ class ISPContractEntity(Entity):
 
             input_dict[key] = value
 
-    async def async_update(self) -> None:
+    def _get_state_and_attributes(self, contract: '_ISPContract') \
+            -> Tuple[Any, Optional[Dict[str, Any]], Optional[str]]:
         attributes = {
-            'code': self._contract.code,
+            'code': contract.code,
         }
 
         for attr, false_empty, converter in [
             ('address', True, None),
             ('client', False, None),
             ('payment_required', False, None),
-            ('payment_suggested', False, None),
-            ('payment_until', True, date.isoformat)
         ]:
-            self._set_attr(attributes, attr, getattr(self._contract, attr), false_empty, converter)
+            self._set_attr(attributes, attr, getattr(contract, attr), false_empty, converter)
 
-        bonuses = self._contract.bonuses
-        if bonuses is not None:
-            attributes['bonuses'] = bonuses
+        support_phones = contract.connector.metadata.get('support_phones', allow_stale=True)
+        if support_phones:
+            attributes['support_phones'] = support_phones
 
-        tariff = self._contract.tariff
+        tariff = contract.tariff
         if tariff:
             attributes.update({
                 'tariff_name': tariff.name,
                 'tariff_speed': tariff.speed,
                 'tariff_speed_unit': tariff.speed_unit,
-                'tariff_monthly_cost': tariff.monthly_cost,
             })
 
-        attributes[ATTR_ATTRIBUTION] = 'Data provided by %s' % self._contract.connector.isp_title
+        # Forecast based on balance samples collected in memory
+        balance_history = contract.balance_history
+        burn_rate = balance_history.burn_rate
+        if burn_rate is not None:
+            attributes['burn_rate_daily'] = round(burn_rate, 2)
+
+            days_until_zero = balance_history.days_until_zero
+            if days_until_zero is not None:
+                attributes['days_until_zero'] = round(days_until_zero, 1)
+                attributes['depletion_date'] = dt.utc_from_timestamp(
+                    balance_history.depletion_timestamp
+                ).date().isoformat()
+
+        attributes[ATTR_ATTRIBUTION] = 'Data provided by %s' % self.isp_title
+
+        return contract.current_balance, attributes, contract.currency
+
+    @callback
+    def _async_update_from_contract(self) -> bool:
+        """Обновление состояния по контракту; возвращает, изменилось ли что-либо"""
+        contract = self.contract
+        available = self.coordinator.last_update_success and contract is not None
+        changed = available != self._available
+
+        if contract is not None:
+            state, attributes, unit_of_measurement = self._get_state_and_attributes(contract)
+            changed = changed \
+                or state != self._state \
+                or attributes != self._attributes \
+                or unit_of_measurement != self._unit_of_measurement
+
+            self._state = state
+            self._attributes = attributes
+            self._unit_of_measurement = unit_of_measurement
+
+        self._available = available
+        return changed
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        # Only write state when own value changes
+        if self._async_update_from_contract():
+            self.async_write_ha_state()
+
+    async def async_added_to_hass(self) -> None:
+        self._async_update_from_contract()
+        await super().async_added_to_hass()
+        self.coordinator.entity_ids.add(self.entity_id)
+
+    async def async_will_remove_from_hass(self) -> None:
+        await super().async_will_remove_from_hass()
+        self.coordinator.entity_ids.discard(self.entity_id)
 
-        self._attributes = attributes
-        self._state = self._contract.current_balance
-        self._unit_of_measurement = self._contract.currency
+    @property
+    def available(self) -> bool:
+        return self._available
 
     @property
     def unit_of_measurement(self) -> Optional[str]:
@@ -250,10 +359,59 @@ class ISPContractEntity(Entity):
     def state(self) -> Optional[float]:
         return self._state
 
-    @state.setter
-    def state(self, value: str) -> None:
-        self._state = value
+    @property
+    def unique_id(self) -> Optional[str]:
+        return self.coordinator.connector.isp_identifiers[0] + '_' + self._contract_code
+
+
+def _get_monthly_cost(contract: '_ISPContract') -> Optional[float]:
+    tariff = contract.tariff
+    if tariff is None:
+        return None
+    return tariff.monthly_cost
+
+
+def _get_payment_until(contract: '_ISPContract') -> Optional[str]:
+    payment_until = contract.payment_until
+    if payment_until is None:
+        return None
+    if isinstance(payment_until, datetime):
+        payment_until = payment_until.date()
+    return payment_until.isoformat()
+
+
+class ISPContractFieldEntity(ISPContractEntity):
+    # field: (name suffix, icon, value getter)
+    FIELDS: Dict[str, Tuple[str, str, Callable[['_ISPContract'], Any]]] = {
+        'payment_suggested': ('Payment Suggested', 'mdi:cash-plus', lambda c: c.payment_suggested),
+        'payment_until': ('Payment Until', 'mdi:calendar-clock', _get_payment_until),
+        'tariff_monthly_cost': ('Monthly Cost', 'mdi:cash-multiple', _get_monthly_cost),
+        'bonuses': ('Bonuses', 'mdi:star-circle', lambda c: c.bonuses),
+    }
+    MONETARY_FIELDS = ('payment_suggested', 'tariff_monthly_cost')
+
+    def __init__(self, coordinator: ISPCabinetCoordinator, contract_code: str, field: str) -> None:
+        super().__init__(coordinator, contract_code)
+        self._field = field
+        self._icon = self.FIELDS[field][1]
+
+    @staticmethod
+    def get_field_value(contract: '_ISPContract', getter: Callable[['_ISPContract'], Any]) -> Any:
+        try:
+            return getter(contract)
+        except (AttributeError, KeyError, TypeError, NotImplementedError):
+            return None
+
+    @property
+    def name(self) -> Optional[str]:
+        return super().name + ' ' + self.FIELDS[self._field][0]
+
+    def _get_state_and_attributes(self, contract: '_ISPContract') \
+            -> Tuple[Any, Optional[Dict[str, Any]], Optional[str]]:
+        state = self.get_field_value(contract, self.FIELDS[self._field][2])
+        unit_of_measurement = contract.currency if self._field in self.MONETARY_FIELDS else None
+        return state, None, unit_of_measurement
 
     @property
     def unique_id(self) -> Optional[str]:
-        return self._contract.isp_identifier + '_' + self._contract.code
+        return super().unique_id + '_' + self._field
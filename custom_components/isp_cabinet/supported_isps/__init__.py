@@ -1,8 +1,8 @@
 """Supported ISP configurations."""
-from .base import ISP_CONNECTORS
+from .base import ISP_CONNECTORS, get_connector_class, get_account_key
 from .almatel import AlmatelConnector
 from .sevensky import SevenSkyConnector
 from .sky_engineering import SkyEngineeringConnector
 from .mgts import MGTSConnector
 
-__all__ = ['ISP_CONNECTORS']
+__all__ = ['ISP_CONNECTORS', 'get_connector_class', 'get_account_key']
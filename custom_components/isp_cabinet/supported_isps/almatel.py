@@ -1,7 +1,5 @@
 import json
-import re
-from datetime import datetime
-from typing import List, Optional, Dict, Tuple
+from typing import List, Optional, Dict, Tuple, Any
 
 import aiohttp
 from lxml import html
@@ -9,9 +7,65 @@ from lxml import html
 from .base import register_isp_connector, _ISPHTTPConnector, ContractDataType, TariffDataType, PaymentsDataType, \
     ServicesDataType, InvoicesDataType, \
     _ISPGenericSingleContractConnector
+from .converters import extract_digits, parse_date
+from .signatures import PageKind
 from ..errors import SessionInitializationError, AuthenticationError, InvalidServerResponseError
 
 
+def parse_home_page(content: bytes, encoding: str) -> Dict[str, Any]:
+    parsed_object = html.fromstring(content.decode(encoding, errors='replace'))
+
+    contract_data = dict()
+
+    question_block_value = 'question-block-value'
+
+    profile_root = parsed_object.get_element_by_id('lk--profile')
+
+    contract_code_address_root = profile_root.find_class('lk__profile--name_act')[0]
+    contract_code_text, contract_data['address'] = \
+        map(lambda x: x.replace('&nbsp;', ' ').strip(), contract_code_address_root.text.split('|'))
+    contract_code = extract_digits(contract_code_text)
+    if contract_code is None:
+        raise ValueError('Contract code not found')
+
+    current_balance_root = profile_root.find_class('lk__profile-balance')[0]
+    current_balance_value_root = current_balance_root.find_class(question_block_value)[0]
+    contract_data['current_balance'] = float(current_balance_value_root.text.strip())
+
+    payment_roots = profile_root.find_class('lk__profile-payment')
+
+    payment_required_root = payment_roots[0]
+    payment_required_value_root = payment_required_root.get_element_by_id('need-sum')
+    contract_data['payment_suggested'] = float(payment_required_value_root.text.strip())
+
+    bonuses_root = payment_roots[1]
+    bonuses_value_root = bonuses_root.find_class(question_block_value)[0]
+    contract_data['bonuses'] = int(bonuses_value_root.text.strip())
+
+    payment_until_root = profile_root.find_class('lk__profile-date')[0]
+    payment_until_value_root = payment_until_root.find_class(question_block_value)[0]
+    contract_data['payment_until'] = parse_date(payment_until_value_root.text)
+
+    internet_tariff_root = parsed_object.get_element_by_id('internet')
+    internet_tariff_parts_root = internet_tariff_root.find_class('lk__billing-content-item-row')[0]
+
+    tariff_data = dict()
+    internet_tariff_parts = list(internet_tariff_parts_root)
+
+    lk_billing_value = 'lk__billing--val'
+    tariff_data['name'] = internet_tariff_parts[1].find_class(lk_billing_value)[0].text.strip()
+    tariff_data['status'] = internet_tariff_parts[2].find_class(lk_billing_value)[0].text.strip()
+    tariff_data['monthly_cost'] = float(internet_tariff_parts[3]
+                                        .find_class(lk_billing_value)[0]
+                                        .text.strip().split(' ')[0])
+
+    speed_parts = internet_tariff_parts[4].find_class(lk_billing_value)[0].text.strip().split(' ')
+    tariff_data['speed'] = int(speed_parts[0])
+    tariff_data['speed_unit'] = speed_parts[1]
+
+    return {'code': contract_code, 'contract': contract_data, 'tariff': tariff_data}
+
+
 @register_isp_connector
 class AlmatelConnector(_ISPGenericSingleContractConnector, _ISPHTTPConnector):
     isp_identifiers = ["almatel", "2kom", "2com"]
@@ -21,6 +75,15 @@ class AlmatelConnector(_ISPGenericSingleContractConnector, _ISPHTTPConnector):
     BASE_URL = "https://almatel.ru"
     BASE_LK_URL = BASE_URL + "/lk"
 
+    prewarm_urls = [BASE_URL]
+
+    org_keywords = ('альмател', '2com')
+
+    page_signatures = {
+        # Action of the login form; unlike field names, it is not shared with other forms (e.g. password change)
+        PageKind.LOGIN: (b'/login.php',),
+    }
+
     XHR_HEADERS = {
         'X-Requested-With': 'XMLHttpRequest',
         'Accept': 'application/json, text/javascript, */*; q=0.01',
@@ -31,6 +94,8 @@ class AlmatelConnector(_ISPGenericSingleContractConnector, _ISPHTTPConnector):
         'Referer': BASE_LK_URL + '/login.php',
     }
 
+    metadata_fields = frozenset({'support_phones'})
+
     @property
     def auth_headers(self) -> Optional[Dict[str, str]]:
         return self.XHR_HEADERS
@@ -50,13 +115,14 @@ class AlmatelConnector(_ISPGenericSingleContractConnector, _ISPHTTPConnector):
                 raise AuthenticationError(self)
 
             try:
-                response = await request.text()
-                response_json = json.loads(response)
+                content, encoding = await self._read_page(request)
+                response_json = json.loads(content.decode(encoding))
 
                 if not response_json.get('ok'):
                     raise AuthenticationError(self, response_json.get('error'))
 
-            except json.JSONDecodeError:
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                self._check_page(content, login_response=True)
                 raise InvalidServerResponseError(self) from None
 
     async def _get_contract_tariff_data(self) -> Tuple[str,
@@ -65,82 +131,29 @@ class AlmatelConnector(_ISPGenericSingleContractConnector, _ISPHTTPConnector):
                                                        Optional[ServicesDataType],
                                                        Optional[PaymentsDataType],
                                                        Optional[InvoicesDataType]]:
-        async with aiohttp.ClientSession(cookie_jar=self._cookies) as session:
-            home_page_url = self.BASE_LK_URL + '/index.php'
-            async with session.get(home_page_url) as request:
+        async with self._create_session() as session:
+            async with session.get(self.BASE_LK_URL + '/index.php') as request:
                 if request.status != 200:
                     raise InvalidServerResponseError(self)
 
-                html_content = await request.text()
-
-                parsed_object = html.fromstring(html_content, base_url=home_page_url)
-
-                try:
-                    contract_data = dict()
-
-                    question_block_value = 'question-block-value'
-
-                    profile_root = parsed_object.get_element_by_id('lk--profile')
-
-                    contract_code_address_root = profile_root.find_class('lk__profile--name_act')[0]
-                    contract_code_text, contract_data['address'] = \
-                        map(lambda x: x.replace('&nbsp;', ' ').strip(), contract_code_address_root.text.split('|'))
-                    contract_code = re.findall(r'\d+', contract_code_text)[0]
-
-                    current_balance_root = profile_root.find_class('lk__profile-balance')[0]
-                    current_balance_value_root = current_balance_root.find_class(question_block_value)[0]
-                    contract_data['current_balance'] = float(current_balance_value_root.text.strip())
+                content, encoding = await self._read_page(request)
 
-                    payment_roots = profile_root.find_class('lk__profile-payment')
-
-                    payment_required_root = payment_roots[0]
-                    payment_required_value_root = payment_required_root.get_element_by_id('need-sum')
-                    contract_data['payment_suggested'] = float(payment_required_value_root.text.strip())
-
-                    bonuses_root = payment_roots[1]
-                    bonuses_value_root = bonuses_root.find_class(question_block_value)[0]
-                    contract_data['bonuses'] = int(bonuses_value_root.text.strip())
-
-                    payment_until_root = profile_root.find_class('lk__profile-date')[0]
-                    payment_until_value_root = payment_until_root.find_class(question_block_value)[0]
-                    contract_data['payment_until'] = datetime.strptime(
-                        payment_until_value_root.text.strip(),
-                        "%d.%m.%Y"
-                    ).date()
-
-                    internet_tariff_root = parsed_object.get_element_by_id('internet')
-                    internet_tariff_parts_root = internet_tariff_root.find_class('lk__billing-content-item-row')[0]
-
-                    tariff_data = dict()
-                    internet_tariff_parts = list(internet_tariff_parts_root)
-
-                    lk_billing_value = 'lk__billing--val'
-                    tariff_data['name'] = internet_tariff_parts[1].find_class(lk_billing_value)[0].text.strip()
-                    tariff_data['status'] = internet_tariff_parts[2].find_class(lk_billing_value)[0].text.strip()
-                    tariff_data['monthly_cost'] = float(internet_tariff_parts[3]
-                                                        .find_class(lk_billing_value)[0]
-                                                        .text.strip().split(' ')[0])
-
-                    speed_parts = internet_tariff_parts[4].find_class(lk_billing_value)[0].text.strip().split(' ')
-                    tariff_data['speed'] = int(speed_parts[0])
-                    tariff_data['speed_unit'] = speed_parts[1]
-
-                except KeyError:
-                    raise InvalidServerResponseError(self)
+        result = await self._parse_page(parse_home_page, content, encoding)
 
-            return contract_code, contract_data, tariff_data, None, None, None
+        return result['code'], result['contract'], result['tariff'], None, None, None
 
     @staticmethod
     def hostname_belongs(hostname: str):
         return '2com' in hostname or 'almatel' in hostname
 
-    async def get_support_phones(self) -> Optional[List[str]]:
-        async with aiohttp.ClientSession(cookie_jar=self._cookies) as session:
+    async def _fetch_support_phones(self) -> Optional[List[str]]:
+        async with self._create_session() as session:
             async with session.get(self.BASE_URL + '/ajax/utmphone/get.php') as request:
                 if request.status != 200:
                     raise InvalidServerResponseError(self)
 
-                single_phone = await request.text()
+                content, encoding = await self._read_page(request)
+                single_phone = content.decode(encoding, errors='replace').strip()
 
                 if single_phone:
                     return [single_phone]
@@ -13,6 +13,8 @@ __all__ = [
     'Invoice',
     'Payment',
     'register_isp_connector',
+    'get_connector_class',
+    'get_account_key',
     'requires_authentication',
     'ContractDataType',
     'TariffDataType',
@@ -21,19 +23,32 @@ __all__ = [
     'InvoicesDataType',
     'format_float',
     'ISP_CONNECTORS',
+    'ContractSnapshotType',
 ]
 
 import asyncio
+import time
 from abc import ABC
 from datetime import timedelta, date, datetime
 from enum import IntEnum
 from types import MappingProxyType
-from typing import Optional, NamedTuple, List, Callable, TypeVar, Type, Union, Dict, Tuple, Any, Mapping
+from typing import Optional, NamedTuple, List, Callable, TypeVar, Type, Union, Dict, Tuple, Any, Mapping, Set, \
+    FrozenSet
 
 import aiohttp
 from fake_useragent import UserAgent
 
-from ..errors import AuthenticationRequiredError
+from .converters import format_float
+from .history import BalanceHistory
+from .metadata import MetadataCache, DEFAULT_METADATA_TTLS
+from .parsing import run_parser, PageParserType
+from .ratelimit import get_rate_limiter, DEFAULT_REQUESTS_PER_MINUTE
+from .routing import EgressRoute
+from .session import get_session_lifetime_estimator, CookieExpirations
+from .signatures import PageKind, PageSignaturesType, DEFAULT_PAGE_SIGNATURES, match_page_signatures
+from .transfer import ACCEPT_ENCODING, read_body, get_charset
+from ..errors import AuthenticationRequiredError, InvalidServerResponseError, ServiceMaintenanceError, \
+    CaptchaRequiredError
 
 
 ContractDataType = TypeVar('ContractDataType')
@@ -50,6 +65,8 @@ InvoicesDataType = Dict[InvoiceIDType, InvoiceDataType]
 PaymentsDataType = Dict[PaymentIDType, PaymentDataType]
 ServicesDataType = Dict[str, ServiceDataType]
 
+ContractSnapshotType = Dict[str, Any]
+
 ReturnType = TypeVar('ReturnType')
 
 
@@ -59,8 +76,29 @@ DEFAULT_CURRENCY = 'руб.'
 DEFAULT_SPEED_UNIT = 'Мбит/с'
 
 
-def format_float(float_string: str) -> float:
-    return float(float_string.strip().replace(' ', '').replace(',', '.'))
+def _encode_snapshot_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, date):
+        return {'__date__': value.isoformat()}
+    if isinstance(value, dict):
+        return {k: _encode_snapshot_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode_snapshot_value(v) for v in value]
+    return value
+
+
+def _decode_snapshot_value(value: Any) -> Any:
+    if isinstance(value, dict):
+        if len(value) == 1:
+            if '__datetime__' in value:
+                return datetime.fromisoformat(value['__datetime__'])
+            if '__date__' in value:
+                return date.fromisoformat(value['__date__'])
+        return {k: _decode_snapshot_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_decode_snapshot_value(v) for v in value]
+    return value
 
 
 def register_isp_connector(connector: Type['_ISPConnector']) -> Type['_ISPConnector']:
@@ -70,6 +108,31 @@ def register_isp_connector(connector: Type['_ISPConnector']) -> Type['_ISPConnec
     return connector
 
 
+def get_connector_class(isp_identifier: str) -> Optional[Type['_ISPConnector']]:
+    """
+    Поиск класса коннектора по идентификатору провайдера (в т.ч. по псевдонимам).
+    :param isp_identifier: Идентификатор провайдера
+    :return: Класс коннектора / None - провайдер не поддерживается
+    """
+    for connector in ISP_CONNECTORS:
+        if isp_identifier in connector.isp_identifiers:
+            return connector
+    return None
+
+
+def get_account_key(isp_identifier: str, username: str) -> Tuple[str, str]:
+    """
+    Ключ учётной записи, одинаковый для всех псевдонимов провайдера и вариантов написания имени пользователя.
+    :param isp_identifier: Идентификатор провайдера
+    :param username: Имя пользователя
+    :return: Кортеж (основной идентификатор провайдера, нормализованное имя пользователя)
+    """
+    connector = get_connector_class(isp_identifier)
+    if connector is not None:
+        isp_identifier = connector.isp_identifiers[0]
+    return isp_identifier, username.strip().casefold()
+
+
 def requires_authentication(func: Callable[..., ReturnType]) -> Callable[..., ReturnType]:
     def authentication_required_decorator(self, *args, **kwargs):
         if not self.is_logged_in:
@@ -89,6 +152,14 @@ class _ISPConnector:
     isp_identifiers: List[str] = NotImplemented
     isp_title: str = NotImplemented
 
+    # Network attributes used to detect current ISP (see `detection.ISPIndex`); identifiers are keywords as well
+    asn_numbers: Tuple[int, ...] = ()
+    org_keywords: Tuple[str, ...] = ()
+
+    # Slow-changing data retrieved by `_fetch_metadata` and cached in `metadata`
+    metadata_fields: FrozenSet[str] = frozenset()
+    metadata_ttls: Mapping[str, timedelta] = DEFAULT_METADATA_TTLS
+
     def __init__(self, username: str, password: str, scan_interval: Optional[timedelta] = None) -> None:
         """
 
@@ -98,6 +169,8 @@ class _ISPConnector:
         """
         self._username = username
         self._password = password
+        self._logged_in_at: Optional[float] = None
+        self._metadata = MetadataCache({field: self.metadata_ttls[field] for field in self.metadata_fields})
 
         if scan_interval is not None:
             self.scan_interval = scan_interval
@@ -119,6 +192,45 @@ class _ISPConnector:
     def is_logged_in(self):
         raise NotImplementedError
 
+    @property
+    def metadata(self) -> MetadataCache:
+        return self._metadata
+
+    @property
+    def session_age(self) -> Optional[float]:
+        """Время (в секундах), прошедшее с момента авторизации; None - если авторизация не выполнялась"""
+        if self._logged_in_at is None or not self.is_logged_in:
+            return None
+        return time.monotonic() - self._logged_in_at
+
+    @property
+    def session_expires_in(self) -> Optional[float]:
+        """
+        Оценка времени (в секундах) до истечения сессии по наблюдавшимся у провайдера истечениям.
+        None - авторизация не выполнялась или оценка невозможна.
+        """
+        session_age = self.session_age
+        if session_age is None:
+            return None
+
+        lifetime = get_session_lifetime_estimator(self.isp_identifiers[0]).lifetime
+        if lifetime is None:
+            return None
+
+        return lifetime - session_age
+
+    def record_session_expired(self) -> None:
+        """Учёт истечения текущей сессии (например, при требовании повторной авторизации)"""
+        session_age = self.session_age
+        if session_age is not None:
+            get_session_lifetime_estimator(self.isp_identifiers[0]).record_expired(session_age)
+
+    def record_session_valid(self) -> None:
+        """Учёт успешного использования текущей сессии"""
+        session_age = self.session_age
+        if session_age is not None:
+            get_session_lifetime_estimator(self.isp_identifiers[0]).record_valid(session_age)
+
     async def login(self) -> None:
         """Выполнение авторизации"""
         raise NotImplementedError
@@ -140,27 +252,130 @@ class _ISPConnector:
         """
         raise NotImplementedError
 
+    def restore_contracts(self, snapshots: List[ContractSnapshotType]) -> Dict[str, '_ISPContract']:
+        """
+        Восстановление контрактов из сохранённых снимков (без обращения к провайдеру).
+        :param snapshots: Снимки, полученные через `_ISPContract.to_snapshot()`
+        :return: Восстановленные контракты (пустой словарь, если восстановление не поддерживается)
+        """
+        return {}
+
     # Optional to override in inherent ISP Connector classes
     @classmethod
     def ip_api_belongs(cls, ip_api_data: Dict[str, Union[str, float]]):
-        search_in = ' '.join([ip_api_data["org"], ip_api_data["isp"], ip_api_data["as"]]).lower()
-        return any([p in search_in for p in cls.isp_identifiers])
+        from .detection import get_isp_index
+        return get_isp_index().detect_from_ip_api(ip_api_data) is cls
+
+    async def _fetch_metadata(self, fields: Set[str]) -> Dict[str, Any]:
+        """
+        Получение медленно меняющихся данных (телефоны поддержки, ФИО, адрес, каталог тарифов).
+        :param fields: Запрошенные поля (из `metadata_fields`)
+        :return: Полученные значения
+        """
+        values = {}
+        if 'support_phones' in fields:
+            values['support_phones'] = await self._fetch_support_phones()
+        return values
+
+    async def refresh_metadata(self, fields: Optional[Set[str]] = None) -> Dict[str, Any]:
+        """
+        Обновление кэша медленно меняющихся данных.
+        :param fields: Обновляемые поля (по умолчанию — устаревшие)
+        :return: Обновлённые значения
+        """
+        if fields is None:
+            fields = self._metadata.stale_fields()
+        else:
+            fields = fields & self.metadata_fields
+
+        if not fields:
+            return {}
+
+        values = await self._fetch_metadata(fields)
+        for field, value in values.items():
+            self._metadata.set(field, value)
+
+        return values
 
     async def get_support_phones(self) -> Optional[List[str]]:
+        if 'support_phones' not in self.metadata_fields:
+            return None
+
+        if not self._metadata.is_fresh('support_phones'):
+            await self.refresh_metadata({'support_phones'})
+
+        return self._metadata.get('support_phones', allow_stale=True)
+
+    async def _fetch_support_phones(self) -> Optional[List[str]]:
         return None
 
 
 class _ISPHTTPConnector(_ISPConnector):
-    def __init__(self, *args, user_agent: Optional[str] = None, **kwargs):
+    # Request budget for ISP hosts: (requests per minute, burst); None - use defaults
+    rate_limit: Optional[Tuple[float, int]] = None
+
+    # Portal URLs whose connections are opened ahead of updates (see `prewarm`)
+    prewarm_urls: List[str] = []
+
+    # Markers of service pages returned instead of requested ones (checked along with `DEFAULT_PAGE_SIGNATURES`)
+    page_signatures: PageSignaturesType = {}
+
+    def __init__(self, *args, user_agent: Optional[str] = None, requests_per_minute: Optional[float] = None,
+                 http_connector: Optional[aiohttp.BaseConnector] = None, route: Optional[EgressRoute] = None,
+                 **kwargs):
         super().__init__(*args, **kwargs)
 
         self._user_agent: Optional[str] = user_agent
         self._cookies: Optional[aiohttp.CookieJar] = None
+        self._cookie_expirations = CookieExpirations()
+        self._http_connector = http_connector
+        self._route = route
+
+        rate_limit = self.rate_limit or (DEFAULT_REQUESTS_PER_MINUTE, None)
+        # Configured budget can only tighten the one of the ISP, as the limiter is shared by all accounts of a host
+        self._requests_per_minute: float = rate_limit[0] if requests_per_minute is None \
+            else min(requests_per_minute, rate_limit[0])
+        self._burst: Optional[int] = rate_limit[1]
+        self._trace_config: Optional[aiohttp.TraceConfig] = None
 
     @property
     def is_logged_in(self):
         return self._cookies and len(self._cookies)
 
+    @property
+    def http_connector(self) -> Optional[aiohttp.BaseConnector]:
+        """Пул соединений (пул маршрута, если маршрут назначен)"""
+        if self._route is not None:
+            return self._route.connector
+        return self._http_connector
+
+    @http_connector.setter
+    def http_connector(self, value: Optional[aiohttp.BaseConnector]) -> None:
+        self._http_connector = value
+
+    @property
+    def route(self) -> Optional[EgressRoute]:
+        return self._route
+
+    @route.setter
+    def route(self, value: Optional[EgressRoute]) -> None:
+        self._route = value
+
+    @property
+    def session_expires_in(self) -> Optional[float]:
+        if self.session_age is None:
+            return None
+
+        expires_in = super().session_expires_in
+
+        cookies_expire_at = self._cookie_expirations.expires_at
+        if cookies_expire_at is not None:
+            cookies_expire_in = cookies_expire_at - time.monotonic()
+            if expires_in is None or cookies_expire_in < expires_in:
+                expires_in = cookies_expire_in
+
+        return expires_in
+
     @staticmethod
     def _get_user_agent():
         return UserAgent()['google chrome']
@@ -169,23 +384,164 @@ class _ISPHTTPConnector(_ISPConnector):
     def auth_headers(self) -> Optional[Dict[str, str]]:
         return None
 
+    async def _on_request_start(self, session: aiohttp.ClientSession, trace_config_ctx,
+                                params: aiohttp.TraceRequestStartParams) -> None:
+        limiter_name = params.url.host
+        if self._route is not None and not self._route.is_direct:
+            # Portals limit requests per source address, each proxy has its own budget
+            limiter_name += ' via ' + self._route.name
+        await get_rate_limiter(limiter_name, self._requests_per_minute, self._burst).acquire()
+
+    async def _on_request_end(self, session: aiohttp.ClientSession, trace_config_ctx,
+                              params: aiohttp.TraceRequestEndParams) -> None:
+        # Cookies of the response are already in the jar; their lifetime starts now
+        response = params.response
+        self._cookie_expirations.update(session.cookie_jar, [
+            morsel
+            for received_response in (*response.history, response)
+            for morsel in received_response.cookies.values()
+        ])
+
+    def _create_session(self, headers: Optional[Dict[str, str]] = None, **kwargs) -> aiohttp.ClientSession:
+        """
+        Создание сессии для обращения к порталу провайдера.
+        Все запросы к порталам должны выполняться через сессии, созданные данным методом.
+        :param headers: Дополнительные заголовки
+        :param kwargs: Параметры `aiohttp.ClientSession`
+        :return: Сессия
+        """
+        if self._trace_config is None:
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_request_start.append(self._on_request_start)
+            trace_config.on_request_end.append(self._on_request_end)
+            self._trace_config = trace_config
+
+        request_headers = {aiohttp.hdrs.ACCEPT_ENCODING: ACCEPT_ENCODING}
+        if self._user_agent is not None:
+            request_headers['User-Agent'] = self._user_agent
+        if headers:
+            request_headers.update(headers)
+
+        kwargs.setdefault('cookie_jar', self._cookies)
+        # Responses are decompressed while streaming in `_read_page`
+        kwargs.setdefault('auto_decompress', False)
+
+        if self._route is not None and self._route.request_class is not None:
+            kwargs.setdefault('request_class', self._route.request_class)
+
+        http_connector = self.http_connector
+        if http_connector is not None:
+            # Externally provided connection pool must outlive the session
+            kwargs.setdefault('connector', http_connector)
+            kwargs.setdefault('connector_owner', False)
+
+        return aiohttp.ClientSession(headers=request_headers, trace_configs=[self._trace_config], **kwargs)
+
+    async def prewarm(self, timeout: float = 10.0) -> int:
+        """
+        Установка соединений (DNS, TCP, TLS) с узлами портала до обращения к нему.
+        Имеет смысл только при общем пуле соединений, переживающем сессии коннектора.
+        Запросы `HEAD` не учитываются ограничителем частоты запросов.
+        :param timeout: Время ожидания (в секундах)
+        :return: Количество установленных соединений
+        """
+        http_connector = self.http_connector
+        if http_connector is None or not self.prewarm_urls:
+            return 0
+
+        headers = {}
+        if self._user_agent is not None:
+            headers['User-Agent'] = self._user_agent
+
+        kwargs = {}
+        if self._route is not None and self._route.request_class is not None:
+            # Requests must leave through the proxy of the route, pooled connections are keyed by proxy as well
+            kwargs['request_class'] = self._route.request_class
+
+        async def _prewarm_url(url: str) -> bool:
+            try:
+                async with session.head(url, allow_redirects=False):
+                    # Connection is returned to the pool on release
+                    return True
+
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError):
+                return False
+
+        async with aiohttp.ClientSession(connector=http_connector, connector_owner=False, headers=headers,
+                                         timeout=aiohttp.ClientTimeout(total=timeout),
+                                         auto_decompress=False, **kwargs) as session:
+            results = await asyncio.gather(*[_prewarm_url(url) for url in self.prewarm_urls])
+
+        return sum(results)
+
+    @staticmethod
+    async def _read_page(response: aiohttp.ClientResponse) -> Tuple[bytes, str]:
+        """
+        Чтение (с распаковкой) содержимого страницы для последующего разбора.
+        Ответы сессий, созданных `_create_session`, должны читаться только данным методом.
+        :param response: Ответ сервера
+        :return: Содержимое страницы, кодировка
+        """
+        content = await read_body(response)
+        return content, get_charset(response, content)
+
+    def _check_page(self, content: bytes, login_page: bool = False, login_response: bool = False) -> None:
+        """
+        Проверка содержимого страницы на сигнатуры служебных страниц.
+        :param content: Содержимое страницы
+        :param login_page: Ожидается страница входа (до отправки данных для входа)
+        :param login_response: Ожидается ответ на отправленные данные для входа
+        """
+        if login_page:
+            # Login forms may embed (invisible) captcha widgets, which only block a login once it is submitted
+            exclude = (PageKind.LOGIN, PageKind.CAPTCHA)
+        elif login_response:
+            exclude = (PageKind.LOGIN,)
+        else:
+            exclude = ()
+
+        page_kind = match_page_signatures(content, (DEFAULT_PAGE_SIGNATURES, self.page_signatures), exclude=exclude)
+
+        if page_kind == PageKind.MAINTENANCE:
+            raise ServiceMaintenanceError(self)
+        if page_kind == PageKind.CAPTCHA:
+            raise CaptchaRequiredError(self)
+        if page_kind == PageKind.LOGIN:
+            raise AuthenticationRequiredError(self)
+
+    async def _parse_page(self, parser: PageParserType, content: bytes, encoding: str,
+                          login_page: bool = False) -> Dict[str, Any]:
+        """
+        Разбор страницы функцией разбора.
+        Служебные страницы распознаются до разбора (см. `_check_page`); ошибки разбора
+        (несоответствие разметки ожидаемой) преобразуются в `InvalidServerResponseError`.
+        :param parser: Функция разбора
+        :param content: Содержимое страницы
+        :param encoding: Кодировка страницы
+        :param login_page: Ожидается страница входа
+        :return: Результат разбора
+        """
+        self._check_page(content, login_page)
+
+        try:
+            return await run_parser(parser, content, encoding)
+
+        except (IndexError, KeyError, AttributeError, ValueError):
+            raise InvalidServerResponseError(self) from None
+
     async def login(self) -> None:
         if self._user_agent is None:
             loop = asyncio.get_running_loop()
             self._user_agent = await loop.run_in_executor(None, self._get_user_agent)
 
         cookie_jar = aiohttp.CookieJar()
+        self._cookie_expirations.clear()
 
-        request_headers = {'User-Agent': self._user_agent, }
-
-        auth_headers = self.auth_headers
-        if auth_headers:
-            request_headers.update(auth_headers)
-
-        async with aiohttp.ClientSession(cookie_jar=cookie_jar, headers=request_headers) as session:
+        async with self._create_session(headers=self.auth_headers, cookie_jar=cookie_jar) as session:
             await self._login(session)
 
         self._cookies = cookie_jar
+        self._logged_in_at = time.monotonic()
 
     async def _login(self, session: aiohttp.ClientSession):
         raise NotImplementedError
@@ -195,6 +551,8 @@ class _ISPHTTPConnector(_ISPConnector):
 
         del self._cookies
         self._cookies = None
+        self._cookie_expirations.clear()
+        self._logged_in_at = None
 
     async def _logout(self) -> None:
         pass
@@ -226,6 +584,7 @@ class _ISPContract:
         self._code: str = code
         self._data: ContractDataType = initial_data
         self._tariff: Optional[_ISPTariff] = None
+        self._balance_history = BalanceHistory()
 
     @property
     def data(self) -> ContractDataType:
@@ -247,6 +606,24 @@ class _ISPContract:
     def isp_identifier(self) -> str:
         return self._isp_identifier
 
+    @property
+    def balance_history(self) -> BalanceHistory:
+        return self._balance_history
+
+    def to_snapshot(self) -> ContractSnapshotType:
+        """
+        Снимок данных контракта, пригодный для сериализации в JSON.
+        :return: Словарь с данными контракта и тарифа
+        """
+        tariff = self._tariff
+        return {
+            'code': self._code,
+            'isp_identifier': self._isp_identifier,
+            'data': _encode_snapshot_value(self._data),
+            'tariff': None if tariff is None else _encode_snapshot_value(tariff.data),
+            'balance_history': self._balance_history.to_compact(),
+        }
+
     # Necessary to override in inherent ISP Contract classes
     @property
     def current_balance(self) -> float:
@@ -616,7 +993,7 @@ class _ISPSingleContractConnector(_ISPConnector, ABC):
         result = await self._get_contract_tariff_data()
         contract_code, contract_data, tariff_data, services_data, invoices_data, payments_data = result
 
-        if self._bound_contract is not None and self._bound_contract.code == contract_code:
+        if self._bound_contract is not None and self._bound_contract.code != contract_code:
             del self._bound_contract
             self._bound_contract = None
 
@@ -647,8 +1024,32 @@ class _ISPSingleContractConnector(_ISPConnector, ABC):
         if invoices_data is not None:
             contract.set_invoices_data(invoices_data)
 
+        contract.balance_history.add(contract.current_balance)
+
         return {contract_code: contract}
 
+    def restore_contracts(self, snapshots: List[ContractSnapshotType]) -> Dict[str, '_ISPContract']:
+        if not snapshots:
+            return {}
+
+        snapshot = snapshots[0]
+        contract = self.contract_class(
+            connector=self,
+            code=snapshot['code'],
+            isp_identifier=snapshot.get('isp_identifier', self.isp_identifiers[0]),
+            initial_data=_decode_snapshot_value(snapshot['data'])
+        )
+        if snapshot.get('tariff') is not None:
+            contract.tariff = self.tariff_class(
+                contract=contract,
+                initial_data=_decode_snapshot_value(snapshot['tariff'])
+            )
+        if snapshot.get('balance_history'):
+            contract.balance_history.load_compact(snapshot['balance_history'])
+        self._bound_contract = contract
+
+        return {contract.code: contract}
+
 
 class _ISPGenericSingleContractConnector(_ISPSingleContractConnector, ABC):
     contract_class = _ISPGenericContract
@@ -0,0 +1,174 @@
+"""Batch processing of multiple ISP accounts"""
+__all__ = [
+    'BatchAccount',
+    'BatchResult',
+    'iterate_accounts',
+    'DEFAULT_CONCURRENCY',
+    'DEFAULT_CONCURRENCY_PER_HOST',
+]
+
+import asyncio
+import logging
+import time
+from typing import Optional, Dict, Any, Iterable, AsyncIterator, NamedTuple, Sequence, TYPE_CHECKING
+
+import aiohttp
+
+from .base import get_connector_class, _ISPHTTPConnector
+from .routing import RoutePool
+from ..errors import ISPCabinetException
+
+if TYPE_CHECKING:
+    from .base import _ISPContract
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 16
+DEFAULT_CONCURRENCY_PER_HOST = 4
+
+
+class BatchAccount(NamedTuple):
+    isp: str
+    username: str
+    password: str
+    # Proxy for this account only (overrides routes given to `iterate_accounts`)
+    proxy: Optional[str] = None
+
+
+class BatchResult(NamedTuple):
+    account: BatchAccount
+    contracts: Optional[Dict[str, '_ISPContract']]
+    error: Optional[BaseException]
+    timings: Dict[str, float]
+
+    @property
+    def success(self) -> bool:
+        return self.error is None
+
+
+async def _process_account(account: BatchAccount, connector_kwargs: Dict[str, Any],
+                           semaphore: asyncio.Semaphore, isp_semaphore: asyncio.Semaphore) -> BatchResult:
+    timings: Dict[str, float] = {}
+
+    connector_class = get_connector_class(account.isp)
+    if connector_class is None:
+        return BatchResult(account, None, ValueError('ISP "%s" is not supported' % account.isp), timings)
+
+    if not issubclass(connector_class, _ISPHTTPConnector):
+        connector_kwargs = {}
+
+    # Per-ISP slot is taken first so that waiting for it does not occupy a global slot
+    async with isp_semaphore, semaphore:
+        started_at = time.perf_counter()
+        instance = connector_class(username=account.username, password=account.password, **connector_kwargs)
+
+        try:
+            phase_started_at = time.perf_counter()
+            await instance.login()
+            timings['login'] = time.perf_counter() - phase_started_at
+
+            phase_started_at = time.perf_counter()
+            contracts = await instance.get_contracts()
+            timings['get_contracts'] = time.perf_counter() - phase_started_at
+
+        except (ISPCabinetException, aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+            _LOGGER.debug('Processing ISP "%s" account "%s" failed' % (account.isp, account.username), exc_info=e)
+            return BatchResult(account, None, e, timings)
+
+        finally:
+            if instance.is_logged_in:
+                try:
+                    await instance.logout()
+                except (ISPCabinetException, aiohttp.ClientError, asyncio.TimeoutError, OSError):
+                    pass
+
+            timings['total'] = time.perf_counter() - started_at
+
+    return BatchResult(account, contracts, None, timings)
+
+
+async def iterate_accounts(accounts: Iterable[BatchAccount],
+                           concurrency: int = DEFAULT_CONCURRENCY,
+                           concurrency_per_host: int = DEFAULT_CONCURRENCY_PER_HOST,
+                           http_connector: Optional[aiohttp.BaseConnector] = None,
+                           requests_per_minute: Optional[float] = None,
+                           user_agent: Optional[str] = None,
+                           proxies: Sequence[str] = (),
+                           route_pool: Optional[RoutePool] = None) -> AsyncIterator[BatchResult]:
+    """
+    Обработка множества учётных записей с ограничением параллельности.
+    Результаты выдаются по мере завершения обработки каждой учётной записи (порядок не сохраняется).
+    :param accounts: Учётные записи
+    :param concurrency: Максимальное количество одновременно обрабатываемых учётных записей
+    :param concurrency_per_host: Максимальное количество одновременно обрабатываемых учётных записей
+                                 (и соединений) одного провайдера на каждом маршруте
+    :param http_connector: Общий пул соединений (по умолчанию создаётся на время обработки)
+    :param requests_per_minute: Допустимое количество запросов в минуту к узлу провайдера
+    :param user_agent: Заголовок User-Agent (по умолчанию один на все учётные записи)
+    :param proxies: Маршруты (адреса прокси-серверов или `direct`), между которыми распределяются
+                    учётные записи; по умолчанию запросы выполняются напрямую
+    :param route_pool: Набор маршрутов (по умолчанию создаётся на время обработки)
+    :return: Асинхронный генератор результатов
+    """
+    accounts = list(accounts)
+
+    owns_http_connector = http_connector is None
+    if owns_http_connector:
+        http_connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=concurrency_per_host)
+
+    owns_route_pool = route_pool is None
+    if owns_route_pool and (proxies or any(account.proxy for account in accounts)):
+        route_pool = RoutePool(limit=concurrency, limit_per_host=concurrency_per_host)
+
+    if user_agent is None:
+        loop = asyncio.get_running_loop()
+        # noinspection PyProtectedMember
+        user_agent = await loop.run_in_executor(None, _ISPHTTPConnector._get_user_agent)
+
+    connector_kwargs = {
+        'http_connector': http_connector,
+        'requests_per_minute': requests_per_minute,
+        'user_agent': user_agent,
+    }
+
+    semaphore = asyncio.Semaphore(concurrency)
+    isp_semaphores: Dict[Any, asyncio.Semaphore] = {}
+
+    tasks = []
+    for index, account in enumerate(accounts):
+        # Aliases of the same ISP share a limit
+        isp_key = get_connector_class(account.isp) or account.isp
+
+        account_connector_kwargs = connector_kwargs
+        if route_pool is not None and (account.proxy or proxies):
+            route = route_pool.assign(index, [account.proxy] if account.proxy else proxies, isp_key)
+            account_connector_kwargs = {**connector_kwargs, 'route': route}
+            # Each route has its own address, hence its own per-ISP limit
+            isp_key = (isp_key, route.name)
+
+        isp_semaphore = isp_semaphores.get(isp_key)
+        if isp_semaphore is None:
+            isp_semaphore = isp_semaphores[isp_key] = asyncio.Semaphore(concurrency_per_host)
+
+        tasks.append(asyncio.ensure_future(
+            _process_account(account, account_connector_kwargs, semaphore, isp_semaphore)
+        ))
+
+    try:
+        for completed in asyncio.as_completed(tasks):
+            yield await completed
+
+    finally:
+        # Consumer may stop iterating early
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        if owns_http_connector:
+            await http_connector.close()
+
+        if owns_route_pool and route_pool is not None:
+            await route_pool.close()
@@ -0,0 +1,117 @@
+"""Changes between consecutive contract states"""
+__all__ = [
+    'ContractStateType',
+    'get_contract_state',
+    'diff_contract_states',
+]
+
+from datetime import date
+from typing import Dict, Any, Optional, Callable, TypeVar, List, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .base import _ISPContract
+
+ContractStateType = Dict[str, Any]
+
+ReturnType = TypeVar('ReturnType')
+
+# Balances differing by less than this are considered equal
+_AMOUNT_TOLERANCE = 0.005
+
+
+def _get_value(getter: Callable[[], ReturnType]) -> Optional[ReturnType]:
+    try:
+        return getter()
+    except (KeyError, TypeError, AttributeError, NotImplementedError):
+        # Not every connector provides every value
+        return None
+
+
+def _encode_date(value: Optional[date]) -> Optional[str]:
+    return None if value is None else value.isoformat()
+
+
+def get_contract_state(contract: '_ISPContract') -> ContractStateType:
+    """
+    Состояние контракта, сравниваемое между обновлениями.
+    Контракты обновляются на месте, поэтому состояние содержит копии значений.
+    :param contract: Контракт
+    :return: Состояние
+    """
+    tariff = contract.tariff
+    payments = _get_value(lambda: contract.payments)
+    invoices = _get_value(lambda: contract.invoices)
+
+    return {
+        'current_balance': _get_value(lambda: contract.current_balance),
+        'payment_required': _get_value(lambda: contract.payment_required),
+        'payment_until': _get_value(lambda: contract.payment_until),
+        'tariff': None if tariff is None else _get_value(lambda: tariff.name),
+        'monthly_cost': None if tariff is None else _get_value(lambda: tariff.monthly_cost),
+        'payments': None if payments is None else {
+            payment_id: {'amount': payment.amount, 'paid_at': payment.paid_at.isoformat()}
+            for payment_id, payment in payments.items()
+        },
+        'invoices': None if invoices is None else {
+            invoice_id: {'amount': invoice.amount, 'issued_at': invoice.issued_at.isoformat()}
+            for invoice_id, invoice in invoices.items()
+        },
+    }
+
+
+def _amounts_differ(old: Optional[float], new: Optional[float]) -> bool:
+    if old is None or new is None:
+        return old is not new
+    return abs(new - old) >= _AMOUNT_TOLERANCE
+
+
+def _get_new_items(old: Optional[Dict[Any, Dict[str, Any]]],
+                   new: Optional[Dict[Any, Dict[str, Any]]]) -> Optional[List[Dict[str, Any]]]:
+    # Lists that were not retrieved before (or restored from snapshots, which do not keep them)
+    # are not reported as entirely new
+    if not old or new is None:
+        return None
+    return [{'id': item_id, **item} for item_id, item in new.items() if item_id not in old] or None
+
+
+def diff_contract_states(old: ContractStateType, new: ContractStateType) -> Dict[str, Any]:
+    """
+    Сравнение состояний контракта.
+    :param old: Предыдущее состояние
+    :param new: Текущее состояние
+    :return: Изменения, пригодные для сериализации в JSON (пустой словарь - изменений нет)
+    """
+    changes = dict()
+
+    old_balance, new_balance = old['current_balance'], new['current_balance']
+    if _amounts_differ(old_balance, new_balance):
+        changes['balance'] = {
+            'old': old_balance,
+            'new': new_balance,
+            'delta': None if old_balance is None or new_balance is None else round(new_balance - old_balance, 2),
+        }
+
+    if _amounts_differ(old['payment_required'], new['payment_required']):
+        changes['payment_required'] = {'old': old['payment_required'], 'new': new['payment_required']}
+
+    if old['payment_until'] != new['payment_until']:
+        changes['payment_until'] = {
+            'old': _encode_date(old['payment_until']),
+            'new': _encode_date(new['payment_until']),
+        }
+
+    if old['tariff'] != new['tariff']:
+        changes['tariff'] = {'old': old['tariff'], 'new': new['tariff']}
+
+    if _amounts_differ(old['monthly_cost'], new['monthly_cost']):
+        changes['monthly_cost'] = {'old': old['monthly_cost'], 'new': new['monthly_cost']}
+
+    new_payments = _get_new_items(old['payments'], new['payments'])
+    if new_payments:
+        changes['new_payments'] = new_payments
+
+    new_invoices = _get_new_items(old['invoices'], new['invoices'])
+    if new_invoices:
+        changes['new_invoices'] = new_invoices
+
+    return changes
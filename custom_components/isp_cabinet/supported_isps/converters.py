@@ -0,0 +1,87 @@
+"""Value converters for data extracted from ISP portals"""
+__all__ = [
+    'format_float',
+    'extract_int',
+    'extract_float',
+    'extract_digits',
+    'parse_date',
+    'extract_date',
+]
+
+import re
+from datetime import date, datetime
+from typing import Optional
+
+_DIGITS_PATTERN = re.compile(r'\d+')
+_FLOAT_PATTERN = re.compile(r'\d+(?:\.\d+)?')
+# Non-padded values (`5.1.2020`) are accepted, like in `parse_date`
+_DATE_PATTERN = re.compile(r'(\d{1,2})\.(\d{1,2})\.(\d{4})')
+
+
+def format_float(float_string: str) -> float:
+    return float(float_string.strip().replace(' ', '').replace(',', '.'))
+
+
+def extract_int(text: str) -> Optional[int]:
+    """
+    Поиск первого целого числа в тексте (`100 Мбит/с` -> `100`).
+    :param text: Текст
+    :return: Число (при наличии)
+    """
+    match = _DIGITS_PATTERN.search(text)
+    if match is None:
+        return None
+    return int(match.group(0))
+
+
+def extract_float(text: str) -> Optional[float]:
+    """
+    Поиск первого неотрицательного числа с необязательной дробной частью в тексте (`К оплате: 350.50 руб.` -> `350.5`).
+    :param text: Текст
+    :return: Число (при наличии)
+    """
+    match = _FLOAT_PATTERN.search(text)
+    if match is None:
+        return None
+    return float(match.group(0))
+
+
+def extract_digits(text: str) -> Optional[str]:
+    """
+    Поиск первой последовательности цифр в тексте (например, номера договора с ведущими нулями).
+    :param text: Текст
+    :return: Последовательность цифр (при наличии)
+    """
+    match = _DIGITS_PATTERN.search(text)
+    if match is None:
+        return None
+    return match.group(0)
+
+
+def parse_date(date_string: str) -> date:
+    """
+    Преобразование даты в формате `дд.мм.гггг` (быстрее, чем `datetime.strptime`).
+    :param date_string: Строка с датой
+    :return: Дата
+    """
+    date_string = date_string.strip()
+    if len(date_string) == 10 and date_string[2] == '.' and date_string[5] == '.':
+        day, month, year = date_string[:2], date_string[3:5], date_string[6:]
+        if day.isdigit() and month.isdigit() and year.isdigit():
+            return date(int(year), int(month), int(day))
+
+    # Non-padded values (`5.1.2020`) and error reporting
+    return datetime.strptime(date_string, '%d.%m.%Y').date()
+
+
+def extract_date(text: str) -> Optional[date]:
+    """
+    Поиск первой даты в формате `дд.мм.гггг` в тексте (`Оплатить до 05.11.2020.` -> `date(2020, 11, 5)`).
+    :param text: Текст
+    :return: Дата (при наличии)
+    """
+    match = _DATE_PATTERN.search(text)
+    if match is None:
+        return None
+    day, month, year = match.groups()
+    return date(int(year), int(month), int(day))
@@ -0,0 +1,96 @@
+"""ISP detection by network attributes"""
+__all__ = [
+    'ISPIndex',
+    'get_isp_index',
+    'parse_asn',
+]
+
+import re
+from typing import Optional, Dict, Tuple, Type, Iterable, Any, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .base import _ISPConnector
+
+_ASN_PATTERN = re.compile(r'^\s*AS(\d+)', re.IGNORECASE)
+
+
+def parse_asn(value: str) -> Optional[int]:
+    """
+    Извлечение номера автономной системы из строки вида `AS25513 PJSC Moscow city telephone network`.
+    :param value: Строка
+    :return: Номер автономной системы
+    """
+    match = _ASN_PATTERN.match(value)
+    if match is None:
+        return None
+    return int(match.group(1))
+
+
+class ISPIndex:
+    """Индекс коннекторов по номерам автономных систем и названиям организаций"""
+
+    def __init__(self, connectors: Iterable[Type['_ISPConnector']]) -> None:
+        self._by_asn: Dict[int, Type['_ISPConnector']] = dict()
+        self._keywords: Dict[str, Type['_ISPConnector']] = dict()
+
+        for connector in connectors:
+            for asn in connector.asn_numbers:
+                self._by_asn[asn] = connector
+
+            for keyword in (*connector.isp_identifiers, *connector.org_keywords):
+                self._keywords[keyword.casefold()] = connector
+
+        # Longer keywords first, so that the most specific one matches; keywords match whole words only
+        self._keywords_pattern = re.compile(r'(?<!\w)(?:' + '|'.join(
+            re.escape(keyword) for keyword in sorted(self._keywords, key=len, reverse=True)
+        ) + r')(?!\w)') if self._keywords else None
+
+    def find_by_asn(self, asn: int) -> Optional[Type['_ISPConnector']]:
+        return self._by_asn.get(asn)
+
+    def find_by_name(self, *names: Optional[str]) -> Optional[Type['_ISPConnector']]:
+        if self._keywords_pattern is None:
+            return None
+
+        for name in names:
+            if not name:
+                continue
+            match = self._keywords_pattern.search(name.casefold())
+            if match is not None:
+                return self._keywords[match.group(0)]
+        return None
+
+    def detect(self, asn: Optional[int] = None,
+               names: Iterable[Optional[str]] = ()) -> Optional[Type['_ISPConnector']]:
+        """
+        Определение провайдера (в порядке достоверности: номер АС, название организации).
+        :param asn: Номер автономной системы
+        :param names: Названия организации, провайдера, имя узла
+        :return: Класс коннектора
+        """
+        connector = None
+        if asn is not None:
+            connector = self.find_by_asn(asn)
+        if connector is None:
+            connector = self.find_by_name(*names)
+        return connector
+
+    def detect_from_ip_api(self, ip_api_data: Dict[str, Any]) -> Optional[Type['_ISPConnector']]:
+        as_value = ip_api_data.get('as')
+        return self.detect(
+            asn=parse_asn(as_value) if as_value else None,
+            names=(ip_api_data.get('org'), ip_api_data.get('isp'), as_value, ip_api_data.get('reverse')),
+        )
+
+
+_INDEX: Optional[Tuple[int, ISPIndex]] = None
+
+
+def get_isp_index() -> ISPIndex:
+    """Индекс зарегистрированных коннекторов (перестраивается при регистрации новых коннекторов)"""
+    global _INDEX
+    from .base import ISP_CONNECTORS
+
+    if _INDEX is None or _INDEX[0] != len(ISP_CONNECTORS):
+        _INDEX = (len(ISP_CONNECTORS), ISPIndex(ISP_CONNECTORS))
+    return _INDEX[1]
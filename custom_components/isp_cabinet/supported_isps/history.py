@@ -0,0 +1,130 @@
+"""Balance history"""
+__all__ = [
+    'BalanceHistory',
+]
+
+import time
+from collections import deque
+from typing import Optional, Tuple, Deque, Dict, Any, List
+
+SECONDS_PER_DAY = 86400
+
+
+class BalanceHistory:
+    """Ограниченный кольцевой буфер отсчётов баланса `(время, баланс)`"""
+    default_max_samples: int = 256
+
+    def __init__(self, max_samples: Optional[int] = None) -> None:
+        self._samples: Deque[Tuple[float, float]] = deque(maxlen=max_samples or self.default_max_samples)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    @property
+    def samples(self) -> List[Tuple[float, float]]:
+        return list(self._samples)
+
+    def add(self, balance: float, timestamp: Optional[float] = None) -> None:
+        """
+        Добавление отсчёта.
+        :param balance: Баланс
+        :param timestamp: Время (UNIX); по умолчанию - текущее
+        """
+        if timestamp is None:
+            timestamp = time.time()
+
+        samples = self._samples
+        if samples:
+            last_timestamp, last_balance = samples[-1]
+            if timestamp <= last_timestamp:
+                return
+
+            # Collapse unchanged stretches, keeping their first and last samples only
+            if len(samples) > 1 and last_balance == balance and samples[-2][1] == balance:
+                samples.pop()
+
+        samples.append((timestamp, balance))
+
+    def _current_segment(self) -> List[Tuple[float, float]]:
+        """Отсчёты с момента последнего пополнения баланса"""
+        samples = self._samples
+        start = len(samples) - 1
+        while start > 0 and samples[start - 1][1] >= samples[start][1]:
+            start -= 1
+        return [samples[i] for i in range(start, len(samples))]
+
+    @property
+    def burn_rate(self) -> Optional[float]:
+        """
+        Скорость расходования баланса в сутки (метод наименьших квадратов по отсчётам
+        с момента последнего пополнения).
+        :return: Расход в сутки / None - недостаточно данных
+        """
+        segment = self._current_segment()
+        count = len(segment)
+        if count < 2:
+            return None
+
+        # Single pass over sums; timestamps are offset to keep precision
+        origin = segment[0][0]
+        sum_x = sum_y = sum_xx = sum_xy = 0.0
+        for timestamp, balance in segment:
+            x = (timestamp - origin) / SECONDS_PER_DAY
+            sum_x += x
+            sum_y += balance
+            sum_xx += x * x
+            sum_xy += x * balance
+
+        denominator = count * sum_xx - sum_x * sum_x
+        if denominator <= 0:
+            return None
+
+        return -(count * sum_xy - sum_x * sum_y) / denominator
+
+    @property
+    def days_until_zero(self) -> Optional[float]:
+        """
+        Прогноз количества суток до исчерпания баланса.
+        :return: Количество суток / None - баланс не расходуется или недостаточно данных
+        """
+        if not self._samples:
+            return None
+
+        balance = self._samples[-1][1]
+        if balance <= 0:
+            return 0.0
+
+        burn_rate = self.burn_rate
+        if not burn_rate or burn_rate <= 0:
+            return None
+
+        return balance / burn_rate
+
+    @property
+    def depletion_timestamp(self) -> Optional[float]:
+        days_until_zero = self.days_until_zero
+        if days_until_zero is None:
+            return None
+        return self._samples[-1][0] + days_until_zero * SECONDS_PER_DAY
+
+    def to_compact(self) -> Dict[str, Any]:
+        """Компактное представление для сохранения (целые смещения времени)"""
+        timestamps = []
+        previous = 0
+        for timestamp, _ in self._samples:
+            timestamp = int(timestamp)
+            timestamps.append(timestamp - previous)
+            previous = timestamp
+
+        return {
+            't': timestamps,
+            'b': [balance for _, balance in self._samples],
+        }
+
+    def load_compact(self, compact: Dict[str, Any]) -> None:
+        self._samples.clear()
+
+        timestamp = 0
+        for delta, balance in zip(compact.get('t', ()), compact.get('b', ())):
+            timestamp += delta
+            self._samples.append((float(timestamp), float(balance)))
@@ -0,0 +1,85 @@
+"""Cache of slow-changing account metadata"""
+__all__ = [
+    'MetadataCache',
+    'DEFAULT_METADATA_TTLS',
+]
+
+import time
+from datetime import timedelta
+from typing import Dict, Any, Optional, Tuple, Set, Mapping
+
+DEFAULT_METADATA_TTLS: Mapping[str, timedelta] = {
+    'support_phones': timedelta(days=7),
+    'tariff_catalog': timedelta(days=7),
+    'client': timedelta(days=1),
+    'address': timedelta(days=1),
+}
+
+
+class MetadataCache:
+    """Значения с индивидуальным временем жизни; время получения хранится по настенным часам для сохранения"""
+
+    def __init__(self, ttls: Mapping[str, timedelta]) -> None:
+        self._ttls = {field: ttl.total_seconds() for field, ttl in ttls.items()}
+        self._entries: Dict[str, Tuple[Any, float]] = dict()
+
+    @property
+    def fields(self) -> Set[str]:
+        return set(self._ttls)
+
+    def set(self, field: str, value: Any, fetched_at: Optional[float] = None) -> None:
+        self._entries[field] = (value, time.time() if fetched_at is None else fetched_at)
+
+    def get(self, field: str, default: Any = None, allow_stale: bool = False) -> Any:
+        """
+        Получение значения.
+        :param field: Поле
+        :param default: Значение по умолчанию (при отсутствии или устаревании значения)
+        :param allow_stale: Возвращать устаревшие значения
+        :return: Значение
+        """
+        entry = self._entries.get(field)
+        if entry is None or (not allow_stale and self._expires_in(field, entry[1]) <= 0):
+            return default
+        return entry[0]
+
+    def is_fresh(self, *fields: str) -> bool:
+        now = time.time()
+        for field in fields:
+            entry = self._entries.get(field)
+            if entry is None or self._expires_in(field, entry[1], now) <= 0:
+                return False
+        return True
+
+    def _expires_in(self, field: str, fetched_at: float, now: Optional[float] = None) -> float:
+        ttl = self._ttls.get(field)
+        if ttl is None:
+            return 0.0
+        return fetched_at + ttl - (time.time() if now is None else now)
+
+    def stale_fields(self, within: Optional[timedelta] = None) -> Set[str]:
+        """
+        Поля, значения которых отсутствуют или устареют в течение заданного времени.
+        :param within: Запас времени (например, до следующего опроса)
+        :return: Поля
+        """
+        margin = 0.0 if within is None else within.total_seconds()
+        now = time.time()
+
+        stale = set()
+        for field in self._ttls:
+            entry = self._entries.get(field)
+            if entry is None or self._expires_in(field, entry[1], now) <= margin:
+                stale.add(field)
+        return stale
+
+    def to_snapshot(self) -> Dict[str, Any]:
+        return {
+            field: {'value': value, 'fetched_at': fetched_at}
+            for field, (value, fetched_at) in self._entries.items()
+        }
+
+    def load_snapshot(self, snapshot: Dict[str, Any]) -> None:
+        for field, entry in snapshot.items():
+            if field in self._ttls:
+                self._entries[field] = (entry['value'], float(entry['fetched_at']))
@@ -1,27 +1,106 @@
 import asyncio
 import json
 import re
-from datetime import datetime
-from typing import Optional, Dict, Tuple
+from typing import Optional, Dict, Tuple, Any
 
 import aiohttp
 from lxml import html
 
 from .base import register_isp_connector, \
     _ISPGenericSingleContractConnector, _ISPHTTPConnector, TariffDataType, ContractDataType, ServicesDataType, \
-    PaymentsDataType, InvoicesDataType, format_float
+    PaymentsDataType, InvoicesDataType
+from .signatures import PageKind
+from .converters import format_float, extract_date
 from ..errors import SessionInitializationError, AuthenticationError, InvalidServerResponseError
 
+_WIDGETS_PATTERN = re.compile(r'mgts\.data\.widgets\s*=\s*(\[[^;]+);\s*')
+
+
+def parse_login_page(content: bytes, encoding: str) -> Dict[str, Any]:
+    parsed_object = html.fromstring(content.decode(encoding, errors='replace'))
+
+    login_form_root = parsed_object.get_element_by_id('login')
+
+    return {
+        elem.get('name'): elem.get('value')
+        for elem in login_form_root.findall('input')
+    }
+
+
+def parse_main_page(content: bytes, encoding: str) -> Dict[str, Any]:
+    html_content = content.decode(encoding, errors='replace')
+    parsed_object = html.fromstring(html_content)
+
+    account_info_root = parsed_object.find_class('account-info')[0]
+
+    contract_code = account_info_root.find_class('account-info_item_value')[-1].text.strip()
+
+    contract_data = dict()
+    contract_data['current_balance'] = float(
+        account_info_root.find_class('account-info_balance_value')[0].text_content().strip().split(' ')[0].replace(
+            ',', '.'))
+    contract_data['client'] = ' '.join([
+        p.text.capitalize()
+        for p in list(account_info_root.find_class('account-info_title')[0])
+    ])
+
+    tariff_data = dict()
+
+    matched_widgets = _WIDGETS_PATTERN.search(html_content)
+    widgets_data = json.loads(matched_widgets.group(1))
+
+    for widget in widgets_data:
+        if widget['relatedPageUrl'] == '/internet/':
+            data_parts = widget['value'].split('-')
+            tariff_data['name'] = data_parts[0].strip()
+            tariff_data['speed'], tariff_data['speed_unit'] = data_parts[1].strip().split(' ')
+            break
+
+    return {'code': contract_code, 'contract': contract_data, 'tariff': tariff_data}
+
+
+def parse_account_status_page(content: bytes, encoding: str) -> Dict[str, Any]:
+    parsed_object = html.fromstring(content.decode(encoding, errors='replace'))
+
+    payment_parts = parsed_object.get_element_by_id('paymentsTable').find('tbody').find_class('right')
+    contract_data = {'payment_required': max(-format_float(payment_parts[-1].text), 0.0)}
+
+    comment = payment_parts[-1].getparent().find_class('comment')
+    if comment:
+        payment_until = extract_date(comment[0].text)
+        if payment_until is None:
+            raise ValueError('Payment due date not found')
+        contract_data['payment_until'] = payment_until
+    else:
+        contract_data['payment_until'] = None
+
+    tariff_data = {'monthly_cost': format_float(payment_parts[0].text)}
+
+    return {'contract': contract_data, 'tariff': tariff_data}
+
 
 @register_isp_connector
 class MGTSConnector(_ISPGenericSingleContractConnector, _ISPHTTPConnector):
     isp_identifiers = ['mgts', 'mts']
     isp_title = 'MGTS'
 
+    # MGTS portals throttle aggressively
+    rate_limit = (12.0, 4)
+
     BASE_URL_LK = 'https://lk.mgts.ru'
     BASE_URL_LOGIN = 'https://login.mgts.ru'
     URL_LOGIN = BASE_URL_LOGIN + '/amserver/UI/Login'
 
+    prewarm_urls = [BASE_URL_LOGIN, BASE_URL_LK]
+
+    asn_numbers = (25513,)
+    org_keywords = ('мгтс', 'moscow city telephone network')
+
+    # Expired sessions are redirected to login form
+    page_signatures = {
+        PageKind.LOGIN: (b'name="IDToken1"',),
+    }
+
     @property
     def auth_headers(self) -> Optional[Dict[str, str]]:
         return {
@@ -42,16 +121,9 @@ class MGTSConnector(_ISPGenericSingleContractConnector, _ISPHTTPConnector):
             if request.status != 200:
                 raise SessionInitializationError(self)
 
-            html_content = await request.text()
-
-        parsed_object = html.fromstring(html_content)
+            content, encoding = await self._read_page(request)
 
-        login_form_root = parsed_object.get_element_by_id('login')
-
-        request_data = {
-            elem.get('name'): elem.get('value')
-            for elem in login_form_root.findall('input')
-        }
+        request_data = await self._parse_page(parse_login_page, content, encoding, login_page=True)
 
         request_data['IDToken1'] = self._username
         request_data['IDToken2'] = self._password
@@ -65,60 +137,22 @@ class MGTSConnector(_ISPGenericSingleContractConnector, _ISPHTTPConnector):
             if request.status != 200:
                 raise AuthenticationError(self)
 
-            html_content = await request.text()
+            content, encoding = await self._read_page(request)
 
-        parsed_object = html.fromstring(html_content)
+        result = await self._parse_page(parse_main_page, content, encoding)
 
-        account_info_root = parsed_object.find_class('account-info')[0]
-
-        contract_code = account_info_root.find_class('account-info_item_value')[-1].text.strip()
-
-        contract_data = dict()
-        contract_data['current_balance'] = float(
-            account_info_root.find_class('account-info_balance_value')[0].text_content().strip().split(' ')[0].replace(
-                ',', '.'))
-        contract_data['client'] = ' '.join([
-            p.text.capitalize()
-            for p in list(account_info_root.find_class('account-info_title')[0])
-        ])
-
-        tariff_data = dict()
-
-        matched_widgets = re.search(r'mgts\.data\.widgets\s*=\s*(\[[^;]+);\s*', html_content)
-        widgets_data = json.loads(matched_widgets.group(1))
-
-        for widget in widgets_data:
-            if widget['relatedPageUrl'] == '/internet/':
-                data_parts = widget['value'].split('-')
-                tariff_data['name'] = data_parts[0].strip()
-                tariff_data['speed'], tariff_data['speed_unit'] = data_parts[1].strip().split(' ')
-                break
-
-        return contract_code, contract_data, tariff_data
+        return result['code'], result['contract'], result['tariff']
 
     async def _process_auxiliary_data(self, session: aiohttp.ClientSession):
         async with session.get(self.BASE_URL_LOGIN + '/CustomerSelfCare2/account-status.aspx') as request:
             if request.status != 200:
                 raise InvalidServerResponseError(self)
 
-            html_content = await request.text()
-
-            parsed_object = html.fromstring(html_content)
-
-            payment_parts = parsed_object.get_element_by_id('paymentsTable').find('tbody').find_class('right')
-            contract_data = {'payment_required': max(-format_float(payment_parts[-1].text), 0.0)}
+            content, encoding = await self._read_page(request)
 
-            comment = payment_parts[-1].getparent().find_class('comment')
-            if comment:
-                contract_data['payment_until'] = datetime.strptime(
-                    comment[0].text.strip().split(' ')[-1][:-1],
-                    '%d.%m.%Y'
-                )
-            else:
-                contract_data['payment_until'] = None
+        result = await self._parse_page(parse_account_status_page, content, encoding)
 
-            tariff_data = {'monthly_cost': format_float(payment_parts[0].text)}
-            return contract_data, tariff_data
+        return result['contract'], result['tariff']
 
     async def _get_contract_tariff_data(self) -> Tuple[str,
                                                        ContractDataType,
@@ -126,7 +160,7 @@ class MGTSConnector(_ISPGenericSingleContractConnector, _ISPHTTPConnector):
                                                        Optional[ServicesDataType],
                                                        Optional[PaymentsDataType],
                                                        Optional[InvoicesDataType]]:
-        async with aiohttp.ClientSession(cookie_jar=self._cookies) as session:
+        async with self._create_session() as session:
             results = await asyncio.gather(*[
                 self._process_main_data(session),
                 self._process_auxiliary_data(session)
@@ -0,0 +1,72 @@
+"""Page parsing backends"""
+__all__ = [
+    'run_parser',
+    'enable_process_pool',
+    'disable_process_pool',
+    'PageParserType',
+    'PROCESS_POOL_THRESHOLD',
+]
+
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Optional, Callable, Dict, Any
+
+_LOGGER = logging.getLogger(__name__)
+
+# Page extraction function: (raw page content, encoding) -> plain data
+PageParserType = Callable[[bytes, str], Dict[str, Any]]
+
+# Smaller pages are parsed in place, as transferring them to a worker costs more than parsing
+PROCESS_POOL_THRESHOLD = 32 * 1024
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_threshold = PROCESS_POOL_THRESHOLD
+
+
+def enable_process_pool(max_workers: Optional[int] = None, threshold: int = PROCESS_POOL_THRESHOLD) -> None:
+    """
+    Включение разбора страниц в пуле процессов.
+    Функции разбора должны быть определены на уровне модуля, принимать сырое содержимое страницы
+    и возвращать простые структуры данных.
+    :param max_workers: Количество процессов (по умолчанию — по количеству ядер)
+    :param threshold: Минимальный размер страницы (в байтах) для разбора в пуле
+    """
+    global _process_pool, _process_pool_threshold
+    disable_process_pool()
+
+    _process_pool = ProcessPoolExecutor(max_workers=max_workers)
+    _process_pool_threshold = threshold
+
+
+def disable_process_pool(wait: bool = True) -> None:
+    global _process_pool
+    process_pool, _process_pool = _process_pool, None
+
+    if process_pool is not None:
+        process_pool.shutdown(wait=wait)
+
+
+async def run_parser(parser: PageParserType, content: bytes, encoding: str) -> Dict[str, Any]:
+    """
+    Разбор страницы в пуле процессов (если включён и страница достаточно велика) или на месте.
+    :param parser: Функция разбора
+    :param content: Содержимое страницы
+    :param encoding: Кодировка страницы
+    :return: Результат разбора
+    """
+    process_pool = _process_pool
+    if process_pool is None or len(content) < _process_pool_threshold:
+        return parser(content, encoding)
+
+    try:
+        return await asyncio.get_running_loop().run_in_executor(process_pool, partial(parser, content, encoding))
+
+    except BrokenProcessPool:
+        _LOGGER.warning('Parse process pool terminated unexpectedly, falling back to in-place parsing')
+        if _process_pool is process_pool:
+            disable_process_pool(wait=False)
+
+        return parser(content, encoding)
@@ -0,0 +1,138 @@
+"""Request rate limiting"""
+__all__ = [
+    'TokenBucket',
+    'get_rate_limiter',
+    'get_rate_limiter_stats',
+    'DEFAULT_REQUESTS_PER_MINUTE',
+    'DEFAULT_BURST',
+]
+
+import asyncio
+import logging
+import time
+from typing import Dict, Optional, Any
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_REQUESTS_PER_MINUTE = 30.0
+DEFAULT_BURST = 10
+
+
+class TokenBucket:
+    """Ограничитель частоты запросов; ожидающие запросы обслуживаются в порядке очереди"""
+
+    def __init__(self, name: str, requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE,
+                 burst: int = DEFAULT_BURST) -> None:
+        self._name = name
+        self._rate = requests_per_minute / 60.0
+        self._capacity = float(burst)
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+        self._queue_depth = 0
+        self._total_requests = 0
+        self._total_wait = 0.0
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def requests_per_minute(self) -> float:
+        return self._rate * 60.0
+
+    @property
+    def burst(self) -> int:
+        return int(self._capacity)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue_depth
+
+    def configure(self, requests_per_minute: Optional[float] = None, burst: Optional[int] = None) -> None:
+        self._refill()
+        if requests_per_minute is not None:
+            self._rate = requests_per_minute / 60.0
+        if burst is not None:
+            self._capacity = float(burst)
+            self._tokens = min(self._tokens, self._capacity)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated_at) * self._rate)
+        self._updated_at = now
+
+    async def acquire(self) -> float:
+        """
+        Ожидание разрешения на выполнение запроса.
+        :return: Время ожидания (в секундах)
+        """
+        started_at = time.monotonic()
+        self._queue_depth += 1
+        try:
+            async with self._lock:
+                while True:
+                    self._refill()
+                    if self._tokens >= 1.0:
+                        self._tokens -= 1.0
+                        break
+
+                    delay = (1.0 - self._tokens) / self._rate
+                    _LOGGER.debug('Request to "%s" delayed by %.1f seconds (%d queued)'
+                                  % (self._name, delay, self._queue_depth))
+                    await asyncio.sleep(delay)
+        finally:
+            self._queue_depth -= 1
+
+        waited = time.monotonic() - started_at
+        self._total_requests += 1
+        self._total_wait += waited
+        return waited
+
+    def as_dict(self) -> Dict[str, Any]:
+        self._refill()
+        return {
+            'requests_per_minute': self.requests_per_minute,
+            'burst': self.burst,
+            'tokens': round(self._tokens, 2),
+            'queue_depth': self._queue_depth,
+            'total_requests': self._total_requests,
+            'total_wait': round(self._total_wait, 3),
+        }
+
+
+_RATE_LIMITERS: Dict[str, TokenBucket] = dict()
+
+
+def get_rate_limiter(host: str, requests_per_minute: Optional[float] = None,
+                     burst: Optional[int] = None) -> TokenBucket:
+    """
+    Получение общего для всех коннекторов ограничителя запросов к узлу.
+    Если несколько учётных записей задают разные ограничения, применяется наиболее строгое.
+    :param host: Имя узла
+    :param requests_per_minute: Допустимое количество запросов в минуту
+    :param burst: Допустимое количество запросов подряд
+    :return: Ограничитель
+    """
+    bucket = _RATE_LIMITERS.get(host)
+    if bucket is None:
+        bucket = TokenBucket(
+            host,
+            DEFAULT_REQUESTS_PER_MINUTE if requests_per_minute is None else requests_per_minute,
+            DEFAULT_BURST if burst is None else burst
+        )
+        _RATE_LIMITERS[host] = bucket
+
+    elif (requests_per_minute is not None and requests_per_minute < bucket.requests_per_minute) \
+            or (burst is not None and burst < bucket.burst):
+        bucket.configure(
+            min(requests_per_minute or bucket.requests_per_minute, bucket.requests_per_minute),
+            min(burst or bucket.burst, bucket.burst)
+        )
+
+    return bucket
+
+
+def get_rate_limiter_stats() -> Dict[str, Dict[str, Any]]:
+    return {host: bucket.as_dict() for host, bucket in _RATE_LIMITERS.items()}
@@ -0,0 +1,120 @@
+"""Session lifetime tracking"""
+__all__ = [
+    'SessionLifetimeEstimator',
+    'get_session_lifetime_estimator',
+    'CookieExpirations',
+]
+
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from http.cookies import Morsel
+from typing import Optional, Dict, Deque, Iterable
+
+import aiohttp
+
+
+class SessionLifetimeEstimator:
+    """Оценка времени жизни сессий провайдера по наблюдаемым истечениям"""
+
+    def __init__(self, max_samples: int = 10) -> None:
+        self._expired_ages: Deque[float] = deque(maxlen=max_samples)
+        self._longest_valid_age: Optional[float] = None
+
+    @property
+    def lifetime(self) -> Optional[float]:
+        """Консервативная оценка времени жизни сессии (в секундах); None - истечения не наблюдались"""
+        if not self._expired_ages:
+            return None
+        return min(self._expired_ages)
+
+    def record_expired(self, age: float) -> None:
+        self._expired_ages.append(age)
+
+    def record_valid(self, age: float) -> None:
+        if self._longest_valid_age is None or age > self._longest_valid_age:
+            self._longest_valid_age = age
+
+        # Sessions turned out to live longer than estimated (e.g. after portal configuration change)
+        while self._expired_ages and min(self._expired_ages) < age:
+            self._expired_ages.remove(min(self._expired_ages))
+
+    def as_dict(self):
+        return {
+            'lifetime': self.lifetime,
+            'expired_samples': len(self._expired_ages),
+            'longest_valid_age': self._longest_valid_age,
+        }
+
+
+_ESTIMATORS: Dict[str, SessionLifetimeEstimator] = dict()
+
+
+def get_session_lifetime_estimator(isp_identifier: str) -> SessionLifetimeEstimator:
+    estimator = _ESTIMATORS.get(isp_identifier)
+    if estimator is None:
+        estimator = _ESTIMATORS[isp_identifier] = SessionLifetimeEstimator()
+    return estimator
+
+
+class CookieExpirations:
+    """
+    Сроки истечения cookie, зафиксированные в момент их получения.
+    `Max-Age` отсчитывается от получения cookie, поэтому срок вычисляется при получении cookie
+    (в том числе повторном), а не при каждом обращении.
+    """
+
+    def __init__(self) -> None:
+        # Cookie name -> expiration (None - session cookie)
+        self._expirations: Dict[str, Optional[float]] = dict()
+
+    @staticmethod
+    def _get_expiration(morsel: Morsel, now_wall: float, now_monotonic: float) -> Optional[float]:
+        max_age = morsel['max-age']
+        if max_age:
+            try:
+                return now_monotonic + int(max_age)
+            except ValueError:
+                pass
+
+        if morsel['expires']:
+            try:
+                return now_monotonic + parsedate_to_datetime(morsel['expires']).timestamp() - now_wall
+            except (TypeError, ValueError):
+                pass
+
+        return None
+
+    def update(self, cookie_jar: aiohttp.CookieJar, received: Iterable[Morsel] = ()) -> None:
+        """
+        Учёт полученных cookie (вызывается после каждого запроса).
+        :param cookie_jar: Хранилище cookie
+        :param received: Cookie, полученные в ответах на запрос (включая перенаправления)
+        """
+        now_wall, now_monotonic = time.time(), time.monotonic()
+
+        for morsel in received:
+            self._expirations[morsel.key] = self._get_expiration(morsel, now_wall, now_monotonic)
+
+        stored = dict()
+        for morsel in cookie_jar:
+            name = morsel.key
+            if name in self._expirations:
+                stored[name] = self._expirations[name]
+            else:
+                # Cookies put into the jar otherwise are considered received now
+                stored[name] = self._get_expiration(morsel, now_wall, now_monotonic)
+
+        # Expired and deleted cookies are no longer in the jar
+        self._expirations = stored
+
+    def clear(self) -> None:
+        self._expirations.clear()
+
+    @property
+    def expires_at(self) -> Optional[float]:
+        """Ближайший момент истечения (по `time.monotonic()`); None - все cookie сеансовые"""
+        expirations = [expires_at for expires_at in self._expirations.values() if expires_at is not None]
+        if not expirations:
+            return None
+        return min(expirations)
@@ -1,7 +1,6 @@
 import asyncio
 import json
-import re
-from typing import Dict, Tuple, Any, Optional
+from typing import Dict, Tuple, Any, Optional, Set
 
 import aiohttp
 from lxml import html
@@ -9,10 +8,70 @@ from lxml import html
 from .base import register_isp_connector, _ISPHTTPConnector, \
     ContractDataType, TariffDataType, ServicesDataType, PaymentsDataType, InvoicesDataType, \
     _ISPGenericSingleContractConnector
+from .converters import extract_int, extract_float
+from .signatures import PageKind
 from ..errors import SessionInitializationError, AuthenticationError, \
     InvalidServerResponseError
 
 
+def parse_home_page(content: bytes, encoding: str) -> Dict[str, Any]:
+    parsed_object = html.fromstring(content.decode(encoding, errors='replace'))
+
+    contract_data = dict()
+
+    account_header_root = parsed_object.get_element_by_id('inner-table')
+
+    contract_code_root = account_header_root.get_element_by_id('info-header-1')
+    contract_code = list(contract_code_root)[1].text.strip().split(' ')[-1]
+    current_balance_value_root = account_header_root.find_class('info-table-content')[0]\
+        .find('li').find('span')
+    contract_data['current_balance'] = float(current_balance_value_root.text.strip())
+    contract_data['currency'] = current_balance_value_root.getnext().text.strip()
+
+    try:
+        payment_required_root = account_header_root.find_class('block-message')[0]
+        payment_required = extract_float(payment_required_root.find('strong').text)
+        if payment_required is None:
+            raise ValueError('Required payment not found')
+        contract_data['payment_required'] = payment_required
+        contract_data['status'] = payment_required_root.text
+
+    except (IndexError, KeyError):
+        pass
+
+    tariff_data = dict()
+    tariff_name_speed_root = parsed_object.find_class('tarif')[0]
+    internet_tariff_parts = list(tariff_name_speed_root)
+    tariff_data['name'] = internet_tariff_parts[0].text.strip()[7:-1]
+
+    speed = extract_int(internet_tariff_parts[2].text)
+    if speed is None:
+        raise ValueError('Tariff speed not found')
+    tariff_data['speed'] = speed
+
+    monthly_cost = extract_int(tariff_name_speed_root.getparent().find_class('price')[0].text)
+    if monthly_cost is None:
+        raise ValueError('Monthly cost not found')
+    tariff_data['monthly_cost'] = float(monthly_cost)
+
+    return {'code': contract_code, 'contract': contract_data, 'tariff': tariff_data}
+
+
+def parse_settings_page(content: bytes, encoding: str) -> Dict[str, Any]:
+    parsed_object = html.fromstring(content.decode(encoding, errors='replace'))
+
+    contract_data = dict()
+
+    page_content = parsed_object.get_element_by_id('page-content')
+    data_table_root = page_content.xpath('//table[@class="data-table"]/tr')
+    data_table_rows = list(data_table_root)
+
+    contract_data['client'] = list(data_table_rows[0])[1].text.strip()
+    contract_data['address'] = list(data_table_rows[1])[1].text.strip()
+
+    return contract_data
+
+
 @register_isp_connector
 class SevenSkyConnector(_ISPGenericSingleContractConnector, _ISPHTTPConnector):
     isp_identifiers = ['sevensky', 'gorcom']
@@ -21,6 +80,23 @@ class SevenSkyConnector(_ISPGenericSingleContractConnector, _ISPHTTPConnector):
 
     BASE_URL_LK = 'https://lk.seven-sky.net'
 
+    prewarm_urls = [BASE_URL_LK]
+
+    org_keywords = ('seven sky', 'seven-sky')
+
+    # Login form submits credentials to `/ajax/login.jsp`
+    page_signatures = {
+        PageKind.LOGIN: (b'ajax/login.jsp',),
+    }
+
+    SESSION_HEADERS = {
+        'Connection': 'keep-alive',
+        'Referer': BASE_URL_LK + '/login.jsp',
+    }
+
+    # Personal details page is requested only when cached values are about to expire
+    metadata_fields = frozenset({'client', 'address'})
+
     async def _login(self, session: aiohttp.ClientSession) -> None:
         async with session.get(self.BASE_URL_LK) as request:
             if request.status != 200:
@@ -34,93 +110,36 @@ class SevenSkyConnector(_ISPGenericSingleContractConnector, _ISPHTTPConnector):
                 raise AuthenticationError(self)
 
             try:
-                response = await request.text()
-                response_json = json.loads(response)
+                content, encoding = await self._read_page(request)
+                response_json = json.loads(content.decode(encoding))
 
                 if not response_json.get('res'):
                     raise AuthenticationError(self)
 
-            except json.JSONDecodeError:
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                self._check_page(content, login_response=True)
                 raise InvalidServerResponseError(self) from None
 
     async def _retrieve_contract_main(self, session: aiohttp.ClientSession) \
             -> Tuple[str, Dict[str, Any], Dict[str, Any]]:
-        home_page_url = self.BASE_URL_LK + '/index.jsp'
-
-        async with session.get(home_page_url) as request:
+        async with session.get(self.BASE_URL_LK + '/index.jsp') as request:
             if request.status != 200:
                 raise InvalidServerResponseError(self)
 
-            html_content = await request.text()
+            content, encoding = await self._read_page(request)
 
-            parsed_object = html.fromstring(html_content, base_url=home_page_url)
-
-            try:
-                contract_data = dict()
-
-                account_header_root = parsed_object.get_element_by_id('inner-table')
-
-                contract_code_root = account_header_root.get_element_by_id('info-header-1')
-                contract_code = list(contract_code_root)[1].text.strip().split(' ')[-1]
-                current_balance_value_root = account_header_root.find_class('info-table-content')[0]\
-                    .find('li').find('span')
-                contract_data['current_balance'] = float(current_balance_value_root.text.strip())
-                contract_data['currency'] = current_balance_value_root.getnext().text.strip()
-
-                try:
-                    payment_required_root = account_header_root.find_class('block-message')[0]
-                    contract_data['payment_required'] = float(re.search(
-                        r'\d+(\.\d+)?',
-                        payment_required_root.find('strong').text
-                    ).group(0))
-                    contract_data['status'] = payment_required_root.text
-
-                except (IndexError, KeyError):
-                    pass
-
-                tariff_data = dict()
-                tariff_name_speed_root = parsed_object.find_class('tarif')[0]
-                internet_tariff_parts = list(tariff_name_speed_root)
-                tariff_data['name'] = internet_tariff_parts[0].text.strip()[7:-1]
-                tariff_data['speed'] = int(re.findall(r'\d+', internet_tariff_parts[2].text)[0])
-                tariff_data['monthly_cost'] = float(
-                    re.findall(
-                        r'\d+',
-                        tariff_name_speed_root.getparent().find_class('price')[0].text
-                    )[0]
-                )
-
-                return contract_code, contract_data, tariff_data
-
-            except (IndexError, KeyError):
+        result = await self._parse_page(parse_home_page, content, encoding)
 
-                raise InvalidServerResponseError(self)
+        return result['code'], result['contract'], result['tariff']
 
     async def _retrieve_personal_details(self, session: aiohttp.ClientSession) -> Dict[str, Any]:
-        personal_details_url = self.BASE_URL_LK + '/settings.jsp'
-
-        async with session.get(personal_details_url) as request:
+        async with session.get(self.BASE_URL_LK + '/settings.jsp') as request:
             if request.status != 200:
                 raise InvalidServerResponseError(self)
 
-            html_content = await request.text()
-
-            parsed_object = html.fromstring(html_content, base_url=personal_details_url)
-
-            try:
-                contract_data = dict()
+            content, encoding = await self._read_page(request)
 
-                page_content = parsed_object.get_element_by_id('page-content')
-                data_table_root = page_content.xpath('//table[@class="data-table"]/tr')
-                data_table_rows = list(data_table_root)
-
-                contract_data['client'] = list(data_table_rows[0])[1].text.strip()
-                contract_data['address'] = list(data_table_rows[1])[1].text.strip()
-
-                return contract_data
-
-            except (IndexError, KeyError):
-                raise InvalidServerResponseError(self)
+        return await self._parse_page(parse_settings_page, content, encoding)
 
     async def _get_contract_tariff_data(self) -> Tuple[str,
                                                        ContractDataType,
@@ -128,18 +147,36 @@ class SevenSkyConnector(_ISPGenericSingleContractConnector, _ISPHTTPConnector):
                                                        Optional[ServicesDataType],
                                                        Optional[PaymentsDataType],
                                                        Optional[InvoicesDataType]]:
-        async with aiohttp.ClientSession(cookie_jar=self._cookies, headers={
-            'Connection': 'keep-alive',
-            'User-Agent': self._user_agent,
-            'Referer': self.BASE_URL_LK + '/login.jsp',
-        }) as session:
-            results = await asyncio.gather(*[
-                self._retrieve_contract_main(session),
-                self._retrieve_personal_details(session)
-            ])
+        metadata = self.metadata
+
+        async with self._create_session(headers=self.SESSION_HEADERS) as session:
+            if metadata.is_fresh('client', 'address'):
+                contract_code, contract_data, tariff_data = await self._retrieve_contract_main(session)
+                personal_details = {
+                    'client': metadata.get('client'),
+                    'address': metadata.get('address'),
+                }
 
-        contract_code, contract_data, tariff_data = results[0]
+            else:
+                results = await asyncio.gather(*[
+                    self._retrieve_contract_main(session),
+                    self._retrieve_personal_details(session)
+                ])
+                contract_code, contract_data, tariff_data = results[0]
+                personal_details = results[1]
 
-        contract_data.update(results[1])
+                for field, value in personal_details.items():
+                    metadata.set(field, value)
+
+        contract_data.update(personal_details)
 
         return contract_code, contract_data, tariff_data, None, None, None
+
+    async def _fetch_metadata(self, fields: Set[str]) -> Dict[str, Any]:
+        values = await super()._fetch_metadata(fields)
+
+        if fields & {'client', 'address'}:
+            async with self._create_session(headers=self.SESSION_HEADERS) as session:
+                values.update(await self._retrieve_personal_details(session))
+
+        return values
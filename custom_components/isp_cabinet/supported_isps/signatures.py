@@ -0,0 +1,52 @@
+"""Byte signatures of service pages"""
+__all__ = [
+    'PageKind',
+    'PageSignaturesType',
+    'DEFAULT_PAGE_SIGNATURES',
+    'match_page_signatures',
+]
+
+from enum import IntEnum
+from typing import Optional, Mapping, Tuple, Iterable, Collection
+
+
+class PageKind(IntEnum):
+    # Values define check order: pages may contain markers of several kinds (e.g. login form with captcha)
+    MAINTENANCE = 0
+    CAPTCHA = 1
+    LOGIN = 2
+
+
+PageSignaturesType = Mapping[PageKind, Tuple[bytes, ...]]
+
+DEFAULT_PAGE_SIGNATURES: PageSignaturesType = {
+    PageKind.MAINTENANCE: (
+        b'503 Service Temporarily Unavailable',
+        b'503 Service Unavailable',
+    ),
+    PageKind.CAPTCHA: (
+        b'g-recaptcha',
+        b'h-captcha',
+        b'smart-captcha',
+    ),
+}
+
+
+def match_page_signatures(content: bytes, signatures: Iterable[PageSignaturesType],
+                          exclude: Collection[PageKind] = ()) -> Optional[PageKind]:
+    """
+    Определение служебной страницы по сырому содержимому (без разбора разметки).
+    :param content: Содержимое страницы
+    :param signatures: Таблицы сигнатур
+    :param exclude: Не проверяемые виды страниц
+    :return: Вид страницы / None - ни одна сигнатура не найдена
+    """
+    signatures = tuple(signatures)
+    for kind in PageKind:
+        if kind in exclude:
+            continue
+        for table in signatures:
+            for signature in table.get(kind, ()):
+                if signature in content:
+                    return kind
+    return None
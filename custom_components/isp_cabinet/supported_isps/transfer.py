@@ -0,0 +1,163 @@
+"""Compressed response transfer"""
+__all__ = [
+    'ACCEPT_ENCODING',
+    'read_body',
+    'get_charset',
+    'get_transfer_stats',
+]
+
+import codecs
+import logging
+import re
+import zlib
+from typing import Dict, Any
+
+import aiohttp
+
+_LOGGER = logging.getLogger(__name__)
+
+READ_CHUNK_SIZE = 64 * 1024
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+ACCEPT_ENCODING = 'gzip, deflate, br' if brotli is not None else 'gzip, deflate'
+
+_DECOMPRESSION_ERRORS = (zlib.error,) if brotli is None else (zlib.error, brotli.error)
+
+_META_CHARSET_PATTERN = re.compile(rb'<meta[^>]+charset=["\']?([\w-]+)', re.IGNORECASE)
+
+
+class _TransferStats:
+    __slots__ = ('responses', 'compressed_responses', 'transferred_bytes', 'content_bytes')
+
+    def __init__(self) -> None:
+        self.responses = 0
+        self.compressed_responses = 0
+        self.transferred_bytes = 0
+        self.content_bytes = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'responses': self.responses,
+            'compressed_responses': self.compressed_responses,
+            'transferred_bytes': self.transferred_bytes,
+            'content_bytes': self.content_bytes,
+            'compression_ratio': round(self.content_bytes / self.transferred_bytes, 2)
+            if self.transferred_bytes else None,
+        }
+
+
+_TRANSFER_STATS: Dict[str, _TransferStats] = dict()
+
+
+class _DeflateDecompressor:
+    """`deflate` is sent both with and without zlib header; the header is detected on the first chunk"""
+
+    def __init__(self) -> None:
+        self._decompressor = None
+
+    def decompress(self, data: bytes) -> bytes:
+        if self._decompressor is None:
+            is_zlib = len(data) >= 2 and data[0] & 0x0F == 8 and ((data[0] << 8) | data[1]) % 31 == 0
+            self._decompressor = zlib.decompressobj(zlib.MAX_WBITS if is_zlib else -zlib.MAX_WBITS)
+        return self._decompressor.decompress(data)
+
+    def flush(self) -> bytes:
+        return self._decompressor.flush() if self._decompressor is not None else b''
+
+
+class _BrotliDecompressor:
+    def __init__(self) -> None:
+        self._decompressor = brotli.Decompressor()
+
+    def decompress(self, data: bytes) -> bytes:
+        # `brotli` exposes `process`, `brotlicffi` exposes `decompress`
+        if hasattr(self._decompressor, 'process'):
+            return self._decompressor.process(data)
+        return self._decompressor.decompress(data)
+
+    def flush(self) -> bytes:
+        return b''
+
+
+def _create_decompressor(content_encoding: str) -> Any:
+    if content_encoding in ('gzip', 'x-gzip'):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if content_encoding == 'deflate':
+        return _DeflateDecompressor()
+    if content_encoding == 'br' and brotli is not None:
+        return _BrotliDecompressor()
+
+    raise aiohttp.ClientPayloadError('Unsupported content encoding "%s"' % content_encoding)
+
+
+async def read_body(response: aiohttp.ClientResponse) -> bytes:
+    """
+    Чтение тела ответа с потоковой распаковкой (для сессий с `auto_decompress=False`).
+    :param response: Ответ сервера
+    :return: Распакованное тело ответа
+    """
+    content_encoding = response.headers.get(aiohttp.hdrs.CONTENT_ENCODING, '').strip().lower()
+
+    decompressor = None
+    if content_encoding and content_encoding != 'identity':
+        decompressor = _create_decompressor(content_encoding)
+
+    transferred_bytes = 0
+    chunks = []
+
+    try:
+        async for chunk in response.content.iter_chunked(READ_CHUNK_SIZE):
+            transferred_bytes += len(chunk)
+            chunks.append(chunk if decompressor is None else decompressor.decompress(chunk))
+
+        if decompressor is not None:
+            chunks.append(decompressor.flush())
+
+    except _DECOMPRESSION_ERRORS as e:
+        raise aiohttp.ClientPayloadError('Could not decompress response: %s' % e) from None
+
+    body = b''.join(chunks)
+
+    stats = _TRANSFER_STATS.get(response.url.host)
+    if stats is None:
+        stats = _TRANSFER_STATS[response.url.host] = _TransferStats()
+    stats.responses += 1
+    stats.compressed_responses += decompressor is not None
+    stats.transferred_bytes += transferred_bytes
+    stats.content_bytes += len(body)
+
+    return body
+
+
+def get_charset(response: aiohttp.ClientResponse, body: bytes, default: str = 'utf-8') -> str:
+    """
+    Определение кодировки тела ответа: из заголовка `Content-Type`, затем из разметки.
+    :param response: Ответ сервера
+    :param body: Распакованное тело ответа
+    :param default: Кодировка по умолчанию
+    :return: Кодировка
+    """
+    charset = response.charset
+    if not charset:
+        match = _META_CHARSET_PATTERN.search(body, 0, 2048)
+        if match is not None:
+            charset = match.group(1).decode('ascii')
+
+    if charset:
+        try:
+            return codecs.lookup(charset).name
+        except LookupError:
+            _LOGGER.debug('Unknown charset "%s" in response from "%s"' % (charset, response.url.host))
+
+    return default
+
+
+def get_transfer_stats() -> Dict[str, Dict[str, Any]]:
+    return {host: stats.as_dict() for host, stats in _TRANSFER_STATS.items()}
@@ -0,0 +1,20 @@
+from datetime import date
+
+from custom_components.isp_cabinet.supported_isps.converters import extract_int, extract_float, extract_date
+
+
+def test_extract_int():
+    assert extract_int('100 Мбит/с') == 100
+    assert extract_int('Мбит/с') is None
+
+
+def test_extract_float():
+    assert extract_float('К оплате: 350.50 руб.') == 350.5
+    assert extract_float('К оплате: 350 руб.') == 350.0
+    assert extract_float('руб.') is None
+
+
+def test_extract_date():
+    assert extract_date('Оплатить до 05.11.2020.') == date(2020, 11, 5)
+    assert extract_date('Оплатить до 5.1.2020') == date(2020, 1, 5)
+    assert extract_date('Оплатить до конца месяца') is None
@@ -0,0 +1,68 @@
+import asyncio
+
+import aiohttp
+import pytest
+
+from custom_components.isp_cabinet.errors import CircuitBreakerOpenError
+from custom_components.isp_cabinet.retry import CircuitBreaker, RetryPolicy, async_call_with_retry
+
+SINGLE_ATTEMPT = RetryPolicy(attempts=1)
+
+
+def test_stale_call_does_not_release_trial():
+    async def _run() -> None:
+        breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0.05)
+        stale_started, trial_started, trial_finish = asyncio.Event(), asyncio.Event(), asyncio.Event()
+
+        async def _stale() -> None:
+            stale_started.set()
+            await asyncio.sleep(3600)
+
+        async def _fail() -> None:
+            raise aiohttp.ClientConnectionError()
+
+        async def _trial() -> str:
+            trial_started.set()
+            await trial_finish.wait()
+            return 'ok'
+
+        # Started while the circuit is closed
+        stale_task = asyncio.ensure_future(async_call_with_retry(_stale, SINGLE_ATTEMPT, breaker))
+        await stale_started.wait()
+
+        with pytest.raises(aiohttp.ClientConnectionError):
+            await async_call_with_retry(_fail, SINGLE_ATTEMPT, breaker)
+        assert breaker.state == CircuitBreaker.State.OPEN
+
+        await asyncio.sleep(0.1)
+        trial_task = asyncio.ensure_future(async_call_with_retry(_trial, SINGLE_ATTEMPT, breaker))
+        await trial_started.wait()
+
+        # The stale call ends during the trial and must not let another trial through
+        stale_task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await stale_task
+
+        with pytest.raises(CircuitBreakerOpenError):
+            await asyncio.wait_for(async_call_with_retry(_trial, SINGLE_ATTEMPT, breaker), 1.0)
+
+        trial_finish.set()
+        assert await trial_task == 'ok'
+        assert breaker.state == CircuitBreaker.State.CLOSED
+
+    asyncio.run(_run())
+
+
+def test_cancelled_trial_is_released():
+    async def _run() -> None:
+        breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0.0)
+        breaker.record_failure(breaker.allow_request())
+
+        permit = breaker.allow_request()
+        assert permit is not None and permit.trial
+        assert breaker.allow_request() is None
+
+        breaker.release_trial(permit)
+        assert breaker.allow_request() is not None
+
+    asyncio.run(_run())
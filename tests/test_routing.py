@@ -0,0 +1,43 @@
+import asyncio
+from typing import List
+
+from custom_components.isp_cabinet.supported_isps.base import _ISPHTTPConnector
+from custom_components.isp_cabinet.supported_isps.routing import EgressRoute
+
+
+class _PrewarmedConnector(_ISPHTTPConnector):
+    isp_identifiers = ['test']
+    isp_title = 'Test'
+    # Unresolvable host: only reachable through the proxy
+    prewarm_urls = ['http://portal.invalid/']
+
+
+async def _start_proxy(request_lines: List[str]) -> asyncio.AbstractServer:
+    async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        head = await reader.readuntil(b'\r\n\r\n')
+        request_lines.append(head.split(b'\r\n', 1)[0].decode())
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n')
+        await writer.drain()
+        writer.close()
+
+    return await asyncio.start_server(_handle, '127.0.0.1', 0)
+
+
+def test_prewarm_uses_http_proxy():
+    async def _run() -> None:
+        request_lines: List[str] = []
+        server = await _start_proxy(request_lines)
+        port = server.sockets[0].getsockname()[1]
+
+        route = EgressRoute('http://127.0.0.1:%d' % port)
+        connector = _PrewarmedConnector('username', 'password', route=route)
+        try:
+            assert await connector.prewarm(timeout=5.0) == 1
+        finally:
+            await route.close()
+            server.close()
+            await server.wait_closed()
+
+        assert request_lines == ['HEAD http://portal.invalid/ HTTP/1.1']
+
+    asyncio.run(_run())
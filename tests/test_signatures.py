@@ -0,0 +1,25 @@
+import pytest
+
+from custom_components.isp_cabinet.errors import CaptchaRequiredError, AuthenticationRequiredError
+from custom_components.isp_cabinet.supported_isps.almatel import AlmatelConnector
+
+LOGIN_FORM = b'<form action="/login.php"><div class="g-recaptcha" data-size="invisible"></div></form>'
+HOME_PAGE = b'<form action="/change_password.php"><input type="password" name="password"></form>'
+
+
+def test_captcha_on_login_form_does_not_block():
+    AlmatelConnector('username', 'password')._check_page(LOGIN_FORM, login_page=True)
+
+
+def test_captcha_after_submitted_login_blocks():
+    with pytest.raises(CaptchaRequiredError):
+        AlmatelConnector('username', 'password')._check_page(LOGIN_FORM, login_response=True)
+
+
+def test_login_form_instead_of_page_requires_authentication():
+    with pytest.raises(AuthenticationRequiredError):
+        AlmatelConnector('username', 'password')._check_page(b'<form action="/login.php"></form>')
+
+
+def test_password_change_form_is_not_login_page():
+    AlmatelConnector('username', 'password')._check_page(HOME_PAGE)